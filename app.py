@@ -1,10 +1,22 @@
+import asyncio
 import os
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
-from routers import auth, users, transactions
-from utils.database import create_tables
+from routers import auth, users, transactions, events, schedules
+from utils.database import create_tables, engine, async_engine, replica_engine, get_pool_stats
+from utils.security import hashing_service
+from utils.background import start_periodic_task, start_task, stop_background_tasks
+from utils.idempotency import sweep_expired_keys, IDEMPOTENCY_SWEEP_INTERVAL
+from utils.shards import consolidate_sharded_accounts, SHARD_CONSOLIDATE_INTERVAL
+from utils.metrics import MetricsMiddleware, render_metrics
+from utils.outbox import dispatch_outbox, sweep_outbox, OUTBOX_SWEEP_INTERVAL
+from utils.group_commit import group_committer, GROUP_COMMIT
+from utils.replica import ConsistencyMiddleware, check_replica, REPLICA_HEALTH_INTERVAL
+from utils.partitions import create_partitioned_transactions, ensure_partitions
+from utils.scheduler import run_scheduled_payments, SCHEDULER_ENABLED, SCHEDULER_INTERVAL
 
 # Load environment variables
 load_dotenv()
@@ -30,24 +42,66 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed", "X-Consistency-Token"],
 )
 
+# Successful writes return an X-Consistency-Token for read-your-writes routing
+app.add_middleware(ConsistencyMiddleware)
+
+# Per-route latency, query count, DB time and hashing time
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api")
 app.include_router(users.router, prefix="/api/users")
 app.include_router(transactions.router, prefix="/api/transactions")
+app.include_router(events.router, prefix="/api/events")
+app.include_router(schedules.router, prefix="/api/schedules")
 
 # Initialize database tables
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
+    partitioned = create_partitioned_transactions(engine)
     create_tables()
     print("Database tables initialized successfully!")
+    hashing_service.start()
+    start_periodic_task("idempotency-sweeper", IDEMPOTENCY_SWEEP_INTERVAL, sweep_expired_keys)
+    start_periodic_task("shard-consolidator", SHARD_CONSOLIDATE_INTERVAL, consolidate_sharded_accounts)
+    start_task("outbox-dispatcher", dispatch_outbox())
+    start_periodic_task("outbox-sweeper", OUTBOX_SWEEP_INTERVAL, sweep_outbox)
+    if SCHEDULER_ENABLED:
+        start_periodic_task("payment-scheduler", SCHEDULER_INTERVAL, run_scheduled_payments)
+    if GROUP_COMMIT:
+        group_committer.start()
+    if replica_engine is not None:
+        start_periodic_task("replica-health", REPLICA_HEALTH_INTERVAL, check_replica)
+    if partitioned:
+        # Keep next months' partitions in place ahead of the first insert into them
+        start_periodic_task("partition-maintainer", 86400, lambda: asyncio.to_thread(ensure_partitions, engine))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_background_tasks()
+    hashing_service.shutdown()
+    await async_engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
 
 # Root endpoint
 @app.get("/")
 def root():
     return {"message": "Welcome to TwinPay Digital Wallet API"}
 
+# Connection pool occupancy and checkout waits
+@app.get("/health/db")
+def database_health():
+    return get_pool_stats()
+
+# Prometheus metrics for this worker process
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Run application
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,85 @@
+"""ID generator throughput and uniqueness across processes
+
+Each worker process claims its own generator slot, allocates IDs one at a
+time and in blocks, and sends them back so the parent can check that no ID
+was issued twice.
+
+    python -m benchmarks.ids --processes 8 --count 200000 --block-size 1000
+"""
+import argparse
+import json
+import multiprocessing
+import time
+
+from utils.ids import id_generator
+
+def _generate(count: int, block_size: int) -> dict:
+    started = time.perf_counter()
+    single = [id_generator.next_id() for _ in range(count)]
+    single_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    blocks = []
+    while len(blocks) < count:
+        blocks.extend(id_generator.next_ids(min(block_size, count - len(blocks))))
+    block_seconds = time.perf_counter() - started
+
+    return {
+        "worker": id_generator._worker,
+        "single_per_second": count / single_seconds,
+        "block_per_second": count / block_seconds,
+        "ids": single + blocks,
+    }
+
+def run(processes: int, count: int, block_size: int) -> dict:
+    """Generate `count` IDs per mode in each process and check for collisions"""
+    started = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.starmap(_generate, [(count, block_size)] * processes)
+    elapsed = time.perf_counter() - started
+
+    seen = set()
+    collisions = 0
+    ordered = True
+    for result in results:
+        ids = result.pop("ids")
+        ordered = ordered and ids == sorted(ids)
+        before = len(seen)
+        seen.update(ids)
+        collisions += len(ids) - (len(seen) - before)
+
+    total = processes * count * 2
+    return {
+        "processes": processes,
+        "ids_per_process": count * 2,
+        "block_size": block_size,
+        "total_ids": total,
+        "unique_ids": len(seen),
+        "collisions": collisions,
+        "monotonic_per_process": ordered,
+        "elapsed_seconds": round(elapsed, 3),
+        "aggregate_ids_per_second": round(total / elapsed),
+        "workers": [
+            {key: round(value) if isinstance(value, float) else value for key, value in result.items()}
+            for result in results
+        ],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the transaction ID generator")
+    parser.add_argument("--processes", type=int, default=4, help="concurrent generator processes")
+    parser.add_argument("--count", type=int, default=100000, help="IDs per process and mode")
+    parser.add_argument("--block-size", type=int, default=1000, help="IDs per block allocation")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    result = run(args.processes, args.count, args.block_size)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if result["collisions"]:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""Load test for the main API endpoints
+
+Boots app:app under uvicorn against a fresh database, seeds it with users and
+transaction history, then drives concurrent workloads over HTTP and reports
+throughput and latency percentiles per scenario. Results are written as JSON
+so runs before and after a change can be compared.
+
+Scenarios:
+    deposit        every client deposits into its own account
+    transfer       transfers between random pairs of accounts
+    hot_account    every client pays the same merchant account
+    history        first page of an ordinary user's transaction history
+    large_history  history pages and filters on one account with a long ledger
+    login_storm    concurrent logins, bound by bcrypt
+
+    python -m benchmarks.load --users 200 --transactions 50 --concurrency 32 --requests 2000
+    python -m benchmarks.load --scenarios hot_account --hot-shards 16
+    python -m benchmarks.load --database-url postgresql://bench@localhost/bench --reset
+
+Requires httpx (pip install -r benchmarks/requirements.txt).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+try:
+    import httpx
+except ImportError:
+    raise SystemExit("The load benchmark needs httpx: pip install -r benchmarks/requirements.txt")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["deposit", "transfer", "hot_account", "history", "large_history", "login_storm"]
+PASSWORD = "bench-password"
+PIN = "1234"
+SEED_CHUNK_SIZE = 10000
+
+def _mobile(index: int) -> str:
+    return f"9{index:09d}"
+
+def _twinpay_id(index: int) -> str:
+    return f"bench{index}@twinpay"
+
+def seed(users: int, transactions: int, large_history: int, hot_shards: int):
+    """Create the schema and insert users with deposit histories directly
+
+    Runs in this process against DATABASE_URL; every user shares one bcrypt
+    hash so seeding is not bound by hashing.
+    """
+    from sqlalchemy import insert
+
+    from models.models import User, Transaction
+    from utils.database import Base, SessionLocal, engine
+    from utils.helpers import generate_transaction_numbers
+    from utils.security import get_password_hash
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    hashed_password = get_password_hash(PASSWORD)
+    hashed_pin = get_password_hash(PIN)
+    now = datetime.utcnow()
+
+    # User 0 is the large-history account and user 1 the hot merchant
+    history_sizes = [large_history] + [transactions] * (users - 1)
+    with SessionLocal() as db:
+        db.execute(insert(User), [
+            {
+                "mobile_number": _mobile(index),
+                "full_name": f"Bench User {index}",
+                "twinpay_id": _twinpay_id(index),
+                "hashed_password": hashed_password,
+                "pin": hashed_pin,
+                "balance": 100.0 * history_sizes[index],
+                "email": f"bench{index}@example.com",
+            }
+            for index in range(users)
+        ])
+        user_ids = [row.id for row in db.query(User.id).order_by(User.id)]
+
+        pending = []
+        for user_id, size in zip(user_ids, history_sizes):
+            numbers = generate_transaction_numbers(size)
+            for n in range(size):
+                pending.append({
+                    "user_id": user_id,
+                    "transaction_number": numbers[n],
+                    "transaction_type": "deposit",
+                    "amount": 100.0,
+                    "timestamp": now - timedelta(minutes=size - n),
+                })
+                if len(pending) >= SEED_CHUNK_SIZE:
+                    db.execute(insert(Transaction), pending)
+                    pending = []
+        if pending:
+            db.execute(insert(Transaction), pending)
+        db.commit()
+
+    engine.dispose()
+
+    if hot_shards:
+        from utils.database import AsyncSessionLocal, async_engine
+        from utils.shards import set_balance_shards
+
+        async def shard_hot_account():
+            async with AsyncSessionLocal() as db:
+                await set_balance_shards(db, user_ids[1], hot_shards)
+                await db.commit()
+            await async_engine.dispose()
+        asyncio.run(shard_hot_account())
+
+def tokens_for(users: int) -> list:
+    """Mint access tokens directly instead of logging every user in"""
+    from utils.security import create_access_token
+    return [create_access_token({"sub": _mobile(index)}, timedelta(hours=6)) for index in range(users)]
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(port: int, workers: int) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning",
+        ],
+        cwd=REPO_ROOT,
+        env=os.environ.copy(),
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"uvicorn exited with status {server.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("uvicorn did not become ready within 60 seconds")
+
+def summarize(latencies: list, statuses: Counter, elapsed: float, concurrency: int) -> dict:
+    """Throughput and latency percentiles (milliseconds) of one scenario"""
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    if len(latencies_ms) > 1:
+        cuts = statistics.quantiles(latencies_ms, n=100, method="inclusive")
+    else:
+        cuts = latencies_ms * 99
+    ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+    return {
+        "requests": len(latencies_ms),
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_per_second": round(len(latencies_ms) / elapsed, 1) if elapsed else None,
+        "successful_per_second": round(ok / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies_ms), 2) if latencies_ms else None,
+            "p50": round(cuts[49], 2) if cuts else None,
+            "p95": round(cuts[94], 2) if cuts else None,
+            "p99": round(cuts[98], 2) if cuts else None,
+            "max": round(latencies_ms[-1], 2) if latencies_ms else None,
+        },
+        "status_codes": dict(sorted(statuses.items())),
+    }
+
+async def drive(client: httpx.AsyncClient, build_request, requests: int, concurrency: int) -> dict:
+    """Send `requests` requests from `concurrency` clients and time each one"""
+    latencies = []
+    statuses = Counter()
+    issued = itertools.count()
+
+    async def client_loop(client_id: int):
+        rng = random.Random(client_id)
+        while next(issued) < requests:
+            method, url, kwargs = build_request(client_id, rng)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(client_id) for client_id in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started, concurrency)
+
+def request_builders(users: int, tokens: list) -> dict:
+    """Per-scenario functions returning (method, url, kwargs) for one request"""
+    def auth(index: int) -> dict:
+        return {"Authorization": f"Bearer {tokens[index]}"}
+
+    # Users 0 and 1 are reserved for the large-history and hot-account scenarios
+    ordinary = list(range(2, users))
+
+    def deposit(client_id, rng):
+        index = ordinary[client_id % len(ordinary)]
+        return "POST", "/api/transactions/deposit", {
+            "headers": auth(index), "json": {"amount": 1.0, "transaction_type": "deposit"},
+        }
+
+    def transfer(client_id, rng):
+        sender, recipient = rng.sample(ordinary, 2)
+        return "POST", "/api/transactions/transfer", {
+            "headers": auth(sender),
+            "json": {"amount": 0.01, "transaction_type": "transfer", "pin": PIN, "recipient_twinpay_id": _twinpay_id(recipient)},
+        }
+
+    def hot_account(client_id, rng):
+        sender = rng.choice(ordinary)
+        return "POST", "/api/transactions/transfer", {
+            "headers": auth(sender),
+            "json": {"amount": 0.01, "transaction_type": "transfer", "pin": PIN, "recipient_twinpay_id": _twinpay_id(1)},
+        }
+
+    def history(client_id, rng):
+        return "GET", "/api/transactions/transactions", {
+            "headers": auth(rng.choice(ordinary)), "params": {"limit": 50},
+        }
+
+    def large_history(client_id, rng):
+        params = rng.choice([
+            {"limit": 50},
+            {"limit": 200},
+            {"limit": 50, "transaction_type": "deposit", "min_amount": 50},
+            {"limit": 50, "start_date": (datetime.utcnow() - timedelta(days=7)).isoformat()},
+        ])
+        return "GET", "/api/transactions/transactions", {"headers": auth(0), "params": params}
+
+    def login_storm(client_id, rng):
+        return "POST", "/api/login", {
+            "json": {"mobile_number": _mobile(rng.randrange(users)), "password": PASSWORD},
+        }
+
+    return {
+        "deposit": deposit,
+        "transfer": transfer,
+        "hot_account": hot_account,
+        "history": history,
+        "large_history": large_history,
+        "login_storm": login_storm,
+    }
+
+async def run_scenarios(port: int, scenarios: list, users: int, requests: int, concurrency: int) -> dict:
+    builders = request_builders(users, tokens_for(users))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as client:
+        for name in scenarios:
+            print(f"Running {name} ({requests} requests, {concurrency} concurrent)...", flush=True)
+            results[name] = await drive(client, builders[name], requests, concurrency)
+            latency = results[name]["latency_ms"]
+            print(
+                f"  {results[name]['throughput_per_second']} req/s, "
+                f"p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms, "
+                f"status {results[name]['status_codes']}",
+                flush=True
+            )
+    return results
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the TwinPay API")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated scenarios to run")
+    parser.add_argument("--users", type=int, default=200, help="seeded users")
+    parser.add_argument("--transactions", type=int, default=50, help="seeded transactions per user")
+    parser.add_argument("--large-history", type=int, default=100000, help="transactions on the large-history account")
+    parser.add_argument("--hot-shards", type=int, default=0, help="shard the hot account's balance this many ways")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--database-url", help="database to run against (default: a fresh SQLite file)")
+    parser.add_argument("--reset", action="store_true", help="allow dropping all tables in --database-url")
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON results file")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.users < 4:
+        parser.error("--users must be at least 4")
+    if args.database_url and not args.reset:
+        parser.error("--database-url wipes that database; pass --reset to confirm")
+
+    workdir = tempfile.mkdtemp(prefix="twinpay-bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    # Environment is read at import time, so it must be set before seeding
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("TWINPAY_ID_LOCK_DIR", os.path.join(workdir, "ids"))
+    # Every simulated user shares one address; measure the server, not the limiter
+    os.environ.setdefault("ADMISSION_CLIENT_RATE", "0")
+    os.environ.setdefault("ADMISSION_ACCOUNT_RATE", "0")
+    # Seeded histories and the load mix would trip the velocity limits
+    os.environ.setdefault("VELOCITY_MAX_OUTFLOW", "0")
+    os.environ.setdefault("VELOCITY_MAX_TRANSFERS", "0")
+    sys.path.insert(0, REPO_ROOT)
+
+    print(f"Seeding {args.users} users x {args.transactions} transactions into {database_url}...", flush=True)
+    started = time.perf_counter()
+    seed(args.users, args.transactions, args.large_history, args.hot_shards)
+    seed_seconds = time.perf_counter() - started
+
+    port = _free_port()
+    server = start_server(port, args.workers)
+    try:
+        results = asyncio.run(run_scenarios(port, scenarios, args.users, args.requests, args.concurrency))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    report = {
+        "started_at": datetime.utcnow().isoformat(),
+        "git_commit": _git_commit(),
+        "database": database_url.split("://")[0],
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("output", "database_url", "reset")
+        },
+        "seed_seconds": round(seed_seconds, 3),
+        "scenarios": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Move transactions older than the retention window into the archive
+
+Months are archived oldest first into gzip NDJSON segments under
+ARCHIVE_DIR (see utils/archive.py), then removed from the database: monthly
+partitions are detached and dropped on a partitioned Postgres table, rows
+are deleted otherwise. History and statement reads fall through to the
+archive for those months.
+
+A month is only archived once every user with transactions in it has a
+balance checkpoint covering them, so reconciliation never needs archived
+rows; pass --reconcile to write fresh checkpoints first. An interrupted
+run is safe to repeat: rows already in a published segment are deleted
+rather than archived twice.
+
+    python -m jobs.archive_transactions --retention-months 12
+    python -m jobs.archive_transactions --reconcile --dry-run
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+from sqlalchemy import and_, delete, distinct, exists, func, select
+
+from models.models import Transaction, BalanceCheckpoint
+from utils.database import SessionLocal
+from utils.archive import ARCHIVE_FIELDS, add_months, month_start, read_manifest, write_segment
+from utils.partitions import drop_partition, is_partitioned
+
+TRANSACTION_RETENTION_MONTHS = int(os.getenv("TRANSACTION_RETENTION_MONTHS", "12"))
+ARCHIVE_FETCH_SIZE = 5000
+
+def archive_period(db, start: datetime, dry_run: bool = False) -> dict:
+    """Archive one month and delete it from the database
+
+    Returns a summary with status "archived", "empty", "unreconciled" or "dry-run".
+    """
+    period = f"{start:%Y-%m}"
+    in_period = and_(Transaction.timestamp >= start, Transaction.timestamp < add_months(start, 1))
+    manifest = read_manifest(period)
+    already_archived = max((segment["max_id"] or 0 for segment in manifest["segments"]), default=0) if manifest else 0
+    pending = and_(in_period, Transaction.id > already_archived)
+
+    uncovered = db.scalar(
+        select(func.count(distinct(Transaction.user_id))).where(
+            pending,
+            ~exists().where(
+                BalanceCheckpoint.user_id == Transaction.user_id,
+                BalanceCheckpoint.last_transaction_id >= Transaction.id
+            )
+        )
+    )
+    if uncovered:
+        return {"period": period, "status": "unreconciled", "users": uncovered}
+
+    count = db.scalar(select(func.count(Transaction.id)).where(pending))
+    if dry_run:
+        return {"period": period, "status": "dry-run", "rows": count}
+
+    if count:
+        columns = [getattr(Transaction, field) for field in ARCHIVE_FIELDS]
+        rows = db.execute(
+            select(*columns).where(pending).order_by(Transaction.timestamp, Transaction.id)
+            .execution_options(yield_per=ARCHIVE_FETCH_SIZE)
+        ).mappings()
+        write_segment(period, rows)
+    elif manifest is None:
+        return {"period": period, "status": "empty", "rows": 0}
+
+    # Everything in the period is now in a published segment
+    conn = db.connection()
+    if is_partitioned(conn):
+        drop_partition(conn, start)
+    db.execute(delete(Transaction).where(in_period).execution_options(synchronize_session=False))
+    db.commit()
+    return {"period": period, "status": "archived", "rows": count}
+
+def run_archival(retention_months: int, dry_run: bool = False, now: datetime = None) -> list:
+    """Archive every month that ended more than `retention_months` months ago"""
+    cutoff = add_months(month_start(now or datetime.utcnow()), -retention_months)
+    results = []
+    with SessionLocal() as db:
+        oldest = db.scalar(select(func.min(Transaction.timestamp)))
+        if oldest is None:
+            return results
+        start = month_start(oldest)
+        while start < cutoff:
+            started = time.perf_counter()
+            result = archive_period(db, start, dry_run)
+            result["seconds"] = round(time.perf_counter() - started, 3)
+            results.append(result)
+            # Months must be archived without gaps; stop at the first that cannot be
+            if result["status"] == "unreconciled":
+                break
+            start = add_months(start, 1)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive transactions older than the retention window")
+    parser.add_argument("--retention-months", type=int, default=TRANSACTION_RETENTION_MONTHS,
+                        help="full months kept in the database besides the current one")
+    parser.add_argument("--reconcile", action="store_true", help="write fresh balance checkpoints first")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be archived")
+    args = parser.parse_args()
+
+    if args.reconcile:
+        from jobs.reconcile import run_reconciliation
+        reconciled = run_reconciliation()
+        print(f"Reconciled {reconciled.users_checked} users, wrote {reconciled.checkpoints_written} checkpoints")
+
+    for result in run_archival(args.retention_months, args.dry_run):
+        if result["status"] == "unreconciled":
+            print(f"{result['period']}: {result['users']} users lack a covering checkpoint; run with --reconcile")
+        else:
+            rate = result["rows"] / result["seconds"] if result["seconds"] else 0
+            print(f"{result['period']}: {result['status']}, {result['rows']} rows in {result['seconds']}s ({rate:.0f} rows/s)")
+
+if __name__ == "__main__":
+    main()
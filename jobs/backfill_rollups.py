@@ -0,0 +1,80 @@
+"""Rebuild spending rollups from the transactions table
+
+Processes users in id-range batches. Each batch locks its user rows, which
+every balance write also takes, so live deposits and transfers cannot
+interleave with the rebuild of their rollups.
+
+Months up to the archive horizon are left alone: their transactions live
+only in the archive, and their rollups are kept as they are.
+
+    python -m jobs.backfill_rollups --batch-size 500
+"""
+import argparse
+import time
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import delete, func, select
+
+from models.models import User, Transaction, SpendingRollup
+from utils.database import SessionLocal
+from utils.archive import archive_horizon
+from utils.rollups import period_expression, period_of
+
+def backfill_range(db, start_id: int, end_id: int, since: Optional[datetime] = None) -> int:
+    """Recompute rollups for users with start_id <= id < end_id; returns rows written
+
+    With `since` (a month start), only the months from `since` on are rebuilt.
+    """
+    db.execute(
+        select(User.id).where(User.id >= start_id, User.id < end_id).order_by(User.id).with_for_update()
+    )
+    stale = delete(SpendingRollup).where(SpendingRollup.user_id >= start_id, SpendingRollup.user_id < end_id)
+    if since is not None:
+        stale = stale.where(SpendingRollup.period >= period_of(since))
+    db.execute(stale)
+
+    period = period_expression(db.get_bind().dialect.name, Transaction.timestamp)
+    aggregated = select(
+        Transaction.user_id,
+        period,
+        Transaction.transaction_type,
+        func.sum(Transaction.amount),
+        func.count(Transaction.id)
+    ).where(
+        Transaction.user_id >= start_id, Transaction.user_id < end_id
+    ).group_by(Transaction.user_id, period, Transaction.transaction_type)
+    if since is not None:
+        aggregated = aggregated.where(Transaction.timestamp >= since)
+
+    result = db.execute(
+        SpendingRollup.__table__.insert().from_select(
+            ["user_id", "period", "transaction_type", "total_amount", "transaction_count"], aggregated
+        )
+    )
+    return result.rowcount
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild spending rollups from existing transactions")
+    parser.add_argument("--batch-size", type=int, default=500, help="user ids per batch")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    horizon = archive_horizon()
+    if horizon is not None:
+        print(f"Keeping the rollups of archived months; rebuilding from {period_of(horizon)}")
+    with SessionLocal() as db:
+        low, high = db.execute(select(func.min(User.id), func.max(User.id))).one()
+        if low is None:
+            print("No users to backfill")
+            return
+
+        written = 0
+        for start in range(low, high + 1, args.batch_size):
+            written += backfill_range(db, start, start + args.batch_size, horizon)
+            db.commit()
+            print(f"Users {start}-{min(start + args.batch_size, high + 1) - 1}: {written} rollup rows so far")
+
+    print(f"Backfill finished in {time.perf_counter() - started:.2f}s")
+
+if __name__ == "__main__":
+    main()
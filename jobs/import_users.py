@@ -0,0 +1,273 @@
+"""Bulk-import users from a CSV or NDJSON file
+
+For onboarding wallets migrated from elsewhere, without the per-request
+cost of POST /api/register. Records are read as a stream and handled in
+chunks:
+
+- each record is validated like a registration (UserCreate);
+- unique fields are checked with one IN query per field for the whole
+  chunk, plus against earlier records of the same chunk;
+- generated TwinPay IDs are assigned for the whole chunk from one
+  candidate query per round;
+- passwords and PINs are bcrypt-hashed in a process pool;
+- the chunk is inserted with one executemany and committed.
+
+Records that fail validation or conflict, and NDJSON lines that are not a
+JSON object, are written to the reject file as NDJSON with their record
+number and reason (without password and PIN; unreadable lines without
+their content).
+After every commit the number of records consumed is saved to the
+checkpoint file, and a rerun with the same checkpoint skips them. If a run
+dies between a commit and its checkpoint, that chunk is read again on
+resume and its users are rejected as already registered.
+
+Columns / keys are those of the registration request: mobile_number,
+full_name, password, pin and optionally email, aadhar_number, pan_card,
+date_of_birth, address, twinpay_id. Imported users start with a zero
+balance.
+
+    python -m jobs.import_users partner.csv --rejects partner.rejects.ndjson
+    python -m jobs.import_users partner.ndjson --checkpoint partner.checkpoint --workers 8
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from models.models import User
+from routers.auth import UNIQUE_FIELDS
+from schemas.schemas import UserCreate
+from utils.database import SessionLocal
+from utils.helpers import TWINPAY_ID_ROUNDS, normalize_twinpay_id, twinpay_id_bases, twinpay_id_candidates
+from utils.security import HASH_WORKERS, get_password_hash
+
+SECRET_FIELDS = ("password", "pin")
+
+class UnreadableRecord(NamedTuple):
+    """An input line that is not a record; rejected like an invalid one"""
+    reason: str
+
+def read_records(path: str, file_format: str) -> Iterator[Union[dict, UnreadableRecord]]:
+    """Records of the input file in order; empty CSV cells are treated as missing"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if file_format == "csv":
+            for row in csv.DictReader(f):
+                yield {key: value for key, value in row.items() if key and value not in ("", None)}
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield UnreadableRecord(f"Malformed JSON: {e.msg}")
+                    continue
+                yield record if isinstance(record, dict) else UnreadableRecord("Record is not a JSON object")
+
+def hash_credentials(credentials: Tuple[str, str]) -> Tuple[str, str]:
+    """bcrypt hashes of a (password, pin) pair (runs in a pool worker)"""
+    password, pin = credentials
+    return get_password_hash(password), get_password_hash(pin)
+
+class Importer:
+    """Validates, deduplicates, hashes and inserts users one chunk at a time"""
+
+    def __init__(self, db, pool: ProcessPoolExecutor, workers: int, rejects, imported: int = 0, rejected: int = 0):
+        self.db = db
+        self.pool = pool
+        self.workers = workers
+        self.rejects = rejects
+        self.imported = imported
+        self.rejected = rejected
+
+    def reject(self, number: int, record: Any, reason: str):
+        row = {key: value for key, value in record.items() if key not in SECRET_FIELDS} if isinstance(record, dict) else None
+        self.rejects.write(json.dumps({"record": number, "reason": reason, "row": row}, default=str) + "\n")
+        self.rejected += 1
+
+    def _validate(self, chunk: List[Tuple[int, dict]]) -> List[Tuple[int, dict, UserCreate]]:
+        valid = []
+        for number, record in chunk:
+            if isinstance(record, UnreadableRecord):
+                self.reject(number, record, record.reason)
+                continue
+            try:
+                user = UserCreate.model_validate(record)
+                if user.twinpay_id:
+                    user.twinpay_id = normalize_twinpay_id(user.twinpay_id)
+            except (ValidationError, ValueError) as e:
+                message = e.errors()[0]["msg"] if isinstance(e, ValidationError) else str(e)
+                self.reject(number, record, f"Invalid record: {message}")
+                continue
+            valid.append((number, record, user))
+        return valid
+
+    def _unique(self, valid: List[Tuple[int, dict, UserCreate]]) -> Tuple[List[Tuple[int, dict, UserCreate]], Set[str]]:
+        """Drop records whose unique fields are taken, by the database or an earlier record
+
+        Also returns the TwinPay IDs known to be taken, chosen ones included.
+        """
+        taken = {}
+        for field in UNIQUE_FIELDS:
+            values = {getattr(user, field) for _, _, user in valid if getattr(user, field)}
+            column = getattr(User, field)
+            taken[field] = set(self.db.scalars(select(column).where(column.in_(values)))) if values else set()
+
+        unique = []
+        for number, record, user in valid:
+            conflicts = [
+                label for field, label in UNIQUE_FIELDS.items()
+                if getattr(user, field) and getattr(user, field) in taken[field]
+            ]
+            if conflicts:
+                self.reject(number, record, f"{', '.join(conflicts)} already registered")
+                continue
+            for field in UNIQUE_FIELDS:
+                if getattr(user, field):
+                    taken[field].add(getattr(user, field))
+            unique.append((number, record, user))
+        return unique, taken["twinpay_id"]
+
+    def _assign_twinpay_ids(self, unique: List[Tuple[int, dict, UserCreate]], reserved: Set[str]) -> List[Tuple[int, dict, UserCreate]]:
+        """Give users without a TwinPay ID a free one, one candidate query per round"""
+        bases = {number: twinpay_id_bases(user.full_name, user.email) for number, _, user in unique if not user.twinpay_id}
+        pending = [(number, record, user) for number, record, user in unique if bases.get(number)]
+        unusable = [(number, record, user) for number, record, user in unique if number in bases and not bases[number]]
+        for round_no in range(TWINPAY_ID_ROUNDS):
+            if not pending:
+                break
+            candidates = {number: twinpay_id_candidates(bases[number], round_no) for number, _, _ in pending}
+            everything = {candidate for batch in candidates.values() for candidate in batch}
+            reserved |= set(self.db.scalars(select(User.twinpay_id).where(User.twinpay_id.in_(everything))))
+            unassigned = []
+            for number, record, user in pending:
+                user.twinpay_id = next((c for c in candidates[number] if c not in reserved), None)
+                if user.twinpay_id:
+                    reserved.add(user.twinpay_id)
+                else:
+                    unassigned.append((number, record, user))
+            pending = unassigned
+
+        pending += unusable
+        for number, record, _ in pending:
+            self.reject(number, record, "Could not allocate a TwinPay ID")
+        failed = {number for number, _, _ in pending}
+        return [entry for entry in unique if entry[0] not in failed]
+
+    def _insert(self, ready: List[Tuple[int, dict, dict]]):
+        try:
+            self.db.execute(insert(User), [row for _, _, row in ready])
+            self.db.commit()
+            self.imported += len(ready)
+            return
+        except IntegrityError:
+            # Taken meanwhile by a live registration; find the culprits one by one
+            self.db.rollback()
+        for number, record, row in ready:
+            try:
+                with self.db.begin_nested():
+                    self.db.execute(insert(User), [row])
+                self.imported += 1
+            except IntegrityError:
+                self.reject(number, record, "Registration failed due to duplicate data")
+        self.db.commit()
+
+    def import_chunk(self, chunk: List[Tuple[int, dict]]):
+        users = self._assign_twinpay_ids(*self._unique(self._validate(chunk)))
+        if not users:
+            return
+        # Hash only what survived the checks
+        hashes = self.pool.map(
+            hash_credentials,
+            [(user.password, user.pin) for _, _, user in users],
+            chunksize=max(1, len(users) // (self.workers * 4))
+        )
+        ready = []
+        for (number, record, user), (hashed_password, hashed_pin) in zip(users, hashes):
+            ready.append((number, record, {
+                "mobile_number": user.mobile_number,
+                "full_name": user.full_name,
+                "twinpay_id": user.twinpay_id,
+                "hashed_password": hashed_password,
+                "pin": hashed_pin,
+                "balance": 0.0,
+                "aadhar_number": user.aadhar_number,
+                "pan_card": user.pan_card,
+                "date_of_birth": user.date_of_birth,
+                "email": user.email,
+                "address": user.address,
+            }))
+        self._insert(ready)
+
+def read_checkpoint(path: Optional[str]) -> Dict[str, int]:
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"records": 0, "imported": 0, "rejected": 0}
+
+def write_checkpoint(path: str, state: Dict[str, int]):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(state, f)
+    os.replace(temporary, path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-import users from a CSV or NDJSON file")
+    parser.add_argument("input", help="CSV file with a header row, or NDJSON file")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="input format (default: from the file extension)")
+    parser.add_argument("--rejects", help="NDJSON file rejected records are appended to (default: <input>.rejects.ndjson)")
+    parser.add_argument("--checkpoint", help="file to resume from and save progress to (default: <input>.checkpoint)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="records per insert and commit")
+    parser.add_argument("--workers", type=int, default=HASH_WORKERS, help="hashing processes")
+    args = parser.parse_args()
+
+    file_format = args.format or ("csv" if args.input.lower().endswith(".csv") else "ndjson")
+    checkpoint = args.checkpoint or f"{args.input}.checkpoint"
+    state = read_checkpoint(checkpoint)
+    if state["records"]:
+        print(f"Resuming after record {state['records']}")
+
+    started = time.perf_counter()
+    processed = 0
+    with SessionLocal() as db, \
+            ProcessPoolExecutor(max_workers=args.workers) as pool, \
+            open(args.rejects or f"{args.input}.rejects.ndjson", "a", encoding="utf-8") as rejects:
+        importer = Importer(db, pool, args.workers, rejects, state["imported"], state["rejected"])
+
+        def import_chunk(chunk: List[Tuple[int, dict]]):
+            nonlocal processed, state
+            importer.import_chunk(chunk)
+            rejects.flush()
+            processed += len(chunk)
+            state = {"records": chunk[-1][0], "imported": importer.imported, "rejected": importer.rejected}
+            write_checkpoint(checkpoint, state)
+            print(
+                f"Record {chunk[-1][0]}: {importer.imported} imported, {importer.rejected} rejected, "
+                f"{processed / (time.perf_counter() - started):.0f} rows/s"
+            )
+
+        chunk = []
+        for number, record in enumerate(read_records(args.input, file_format), start=1):
+            if number <= state["records"]:
+                continue
+            chunk.append((number, record))
+            if len(chunk) >= args.chunk_size:
+                import_chunk(chunk)
+                chunk = []
+        if chunk:
+            import_chunk(chunk)
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"Import finished in {elapsed:.2f}s: {state['imported']} imported, {state['rejected']} rejected, "
+        f"{processed / elapsed if elapsed else 0:.0f} rows/s"
+    )
+
+if __name__ == "__main__":
+    main()
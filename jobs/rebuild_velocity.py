@@ -0,0 +1,30 @@
+"""Rebuild velocity counters from recent transactions
+
+Run once after rows were written outside the ledger (imports, restores)
+or after velocity limits were first enabled. It is safe while the API is
+serving: buckets are only ever raised to the counts found in the ledger,
+so increments committed by live requests are kept.
+
+    python -m jobs.rebuild_velocity
+"""
+import argparse
+import time
+
+from utils.database import SessionLocal
+from utils.velocity import VELOCITY_ENABLED, rebuild_velocity_counters
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild velocity counters from recent transactions")
+    parser.parse_args()
+
+    if not VELOCITY_ENABLED:
+        print("Velocity limits are disabled; nothing to rebuild")
+        return
+
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        buckets = rebuild_velocity_counters(db)
+    print(f"Rebuilt {buckets} velocity buckets in {time.perf_counter() - started:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Incremental balance reconciliation
+
+Checks every user's recorded balance against checkpoint + transactions since
+that checkpoint, writes fresh checkpoints, and reports mismatches. User id
+ranges are processed in parallel worker processes.
+
+    python -m jobs.reconcile --workers 4 --chunk-size 1000
+    python -m jobs.reconcile --interval 900   # keep running every 15 minutes
+"""
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+
+from models.models import User
+from utils.database import SessionLocal, engine
+from utils.checkpoints import RECONCILE_SETTLE_SECONDS, ReconcileResult, reconcile_range
+
+def _init_worker():
+    # Connections inherited from the parent must not be reused after fork
+    engine.dispose(close=False)
+
+def _reconcile_chunk(start_id: int, end_id: int, settled_before: datetime) -> ReconcileResult:
+    with SessionLocal() as db:
+        result = reconcile_range(db, start_id, end_id, settled_before)
+        db.commit()
+    return result
+
+def run_reconciliation(workers: int = 4, chunk_size: int = 1000) -> ReconcileResult:
+    """Reconcile all users once, fanning id ranges out over worker processes"""
+    settled_before = datetime.utcnow() - timedelta(seconds=RECONCILE_SETTLE_SECONDS)
+    with SessionLocal() as db:
+        low, high = db.execute(select(func.min(User.id), func.max(User.id))).one()
+
+    total = ReconcileResult()
+    if low is None:
+        return total
+
+    ranges = [(start, min(start + chunk_size, high + 1)) for start in range(low, high + 1, chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(_reconcile_chunk, start, end, settled_before) for start, end in ranges]
+        for future in futures:
+            total.merge(future.result())
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile user balances against the transaction ledger")
+    parser.add_argument("--workers", type=int, default=4, help="parallel worker processes")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="user ids per work unit")
+    parser.add_argument("--interval", type=float, default=0, help="repeat every N seconds (0 = run once)")
+    args = parser.parse_args()
+
+    while True:
+        started = time.perf_counter()
+        result = run_reconciliation(args.workers, args.chunk_size)
+        print(
+            f"Checked {result.users_checked} users, wrote {result.checkpoints_written} checkpoints, "
+            f"found {len(result.mismatches)} mismatches in {time.perf_counter() - started:.2f}s"
+        )
+        for user_id, recorded, expected in result.mismatches:
+            print(f"  user {user_id}: recorded {recorded:.2f}, ledger {expected:.2f}")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Turn sharded balance mode on or off for hot accounts
+
+Incoming transfers to a sharded account are spread over N sub-balance rows
+instead of serializing on its users row. The app's shard consolidator folds
+the sub-balances back into the main balance in the background.
+
+    python -m jobs.shard_account TPMERCHANT1234 --shards 16
+    python -m jobs.shard_account TPMERCHANT1234 --shards 0   # back to a plain balance
+"""
+import argparse
+import asyncio
+from sqlalchemy import select
+
+from models.models import User
+from utils.database import AsyncSessionLocal, async_engine
+from utils.shards import MAX_BALANCE_SHARDS, set_balance_shards
+
+async def run(twinpay_id: str, shards: int):
+    async with AsyncSessionLocal() as db:
+        user_id = await db.scalar(select(User.id).where(User.twinpay_id == twinpay_id))
+        if user_id is None:
+            raise SystemExit(f"No user with TwinPay ID {twinpay_id}")
+        await set_balance_shards(db, user_id, shards)
+        await db.commit()
+    await async_engine.dispose()
+    print(f"{twinpay_id} now uses {shards} balance shards" if shards else f"{twinpay_id} now uses a plain balance")
+
+def main():
+    parser = argparse.ArgumentParser(description="Configure sharded balances for an account")
+    parser.add_argument("twinpay_id", help="account to configure")
+    parser.add_argument("--shards", type=int, required=True, help=f"sub-balance rows, 0-{MAX_BALANCE_SHARDS} (0 = off)")
+    args = parser.parse_args()
+    asyncio.run(run(args.twinpay_id, args.shards))
+
+if __name__ == "__main__":
+    main()
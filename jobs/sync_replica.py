@@ -0,0 +1,48 @@
+"""Copy a SQLite primary into a replica file, for trying read-replica routing locally
+
+Point DATABASE_URL at the primary file and READ_REPLICA_URL at the copy,
+then run this with --interval to refresh the copy every few seconds; reads
+served by the replica lag the primary by up to that interval. With
+PostgreSQL, point READ_REPLICA_URL at a streaming-replication standby
+instead.
+
+    python -m jobs.sync_replica replica.db
+    python -m jobs.sync_replica replica.db --interval 2
+"""
+import argparse
+import sqlite3
+import time
+from sqlalchemy.engine import make_url
+
+from utils.database import DATABASE_URL
+
+def sync(primary_path: str, replica_path: str):
+    """Snapshot the primary into the replica with SQLite's online backup"""
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the SQLite primary database into a replica file")
+    parser.add_argument("replica", help="path of the replica database file")
+    parser.add_argument("--interval", type=float, help="keep copying every this many seconds")
+    args = parser.parse_args()
+
+    url = make_url(DATABASE_URL)
+    if url.get_backend_name() != "sqlite" or not url.database:
+        parser.error("DATABASE_URL must point at a SQLite file")
+
+    while True:
+        started = time.perf_counter()
+        sync(url.database, args.replica)
+        print(f"Copied {url.database} to {args.replica} in {time.perf_counter() - started:.3f}s")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
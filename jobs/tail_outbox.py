@@ -0,0 +1,57 @@
+"""Print the outbox change feed as NDJSON, in id order
+
+A reference consumer for downstream systems. With --cursor-file the
+position is saved after every batch, so a restarted consumer resumes where
+it stopped; events delivered just before a crash may be printed again, so
+consumers should deduplicate by id.
+
+    python -m jobs.tail_outbox --after 0
+    python -m jobs.tail_outbox --follow --cursor-file outbox.cursor
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from utils.database import SessionLocal
+from utils.outbox import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OutboxTailer, event_message
+
+def read_cursor(path: str) -> int:
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+def write_cursor(path: str, cursor: int):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        f.write(str(cursor))
+    os.replace(temporary, path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Print outbox events as NDJSON")
+    parser.add_argument("--after", type=int, help="start after this outbox id (default: saved cursor or 0)")
+    parser.add_argument("--follow", action="store_true", help="keep polling for new events")
+    parser.add_argument("--cursor-file", help="file to resume from and save the position to")
+    parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE)
+    args = parser.parse_args()
+
+    cursor = args.after if args.after is not None else (read_cursor(args.cursor_file) if args.cursor_file else 0)
+    tailer = OutboxTailer(cursor)
+    while True:
+        with SessionLocal() as db:
+            rows = db.scalars(tailer.query(args.batch_size)).all()
+        for row in tailer.accept(rows):
+            sys.stdout.write(json.dumps(event_message(row)) + "\n")
+        sys.stdout.flush()
+        if args.cursor_file:
+            write_cursor(args.cursor_file, tailer.cursor)
+        if len(rows) < args.batch_size:
+            if not args.follow:
+                break
+            time.sleep(OUTBOX_POLL_INTERVAL)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, UniqueConstraint
+from sqlalchemy import func, Column, Integer, String, Float, DateTime, Text, UniqueConstraint, ForeignKey, Index
 from utils.database import Base
 
 class User(Base):
@@ -17,13 +17,151 @@ class User(Base):
     date_of_birth = Column(DateTime, nullable=True)
     email = Column(String, unique=True, nullable=True)
     address = Column(String, nullable=True)
+    # Number of sub-balance rows credits are spread over (0 = plain balance)
+    balance_shards = Column(Integer, default=0, server_default="0", nullable=False)
+    
+    __table_args__ = (
+        # Left-anchored LIKE indexes for recipient search; text_pattern_ops lets
+        # Postgres use them under non-C collations
+        Index("ix_users_twinpay_id_prefix", "twinpay_id", postgresql_ops={"twinpay_id": "text_pattern_ops"}),
+        Index(
+            "ix_users_full_name_prefix", func.lower(full_name).label("full_name_lower"),
+            postgresql_ops={"full_name_lower": "text_pattern_ops"}
+        ),
+    )
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        # Keyset pagination walks (user_id, timestamp, id); type and amount are
+        # trailing columns so history filters are answered from the index alone
+        Index("ix_transactions_user_ts_id", "user_id", "timestamp", "id", "transaction_type", "amount"),
+        # Bounded "everything after checkpoint N" scans for reconciliation
+        Index("ix_transactions_user_id_id", "user_id", "id"),
+        # Recent outflows of all users, for rebuilding velocity counters
+        Index("ix_transactions_type_ts", "transaction_type", "timestamp"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, nullable=False)
     transaction_number = Column(String(40), unique=True, nullable=False)
     transaction_type = Column(String, nullable=False)
     amount = Column(Float, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
\ No newline at end of file
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Other side of a transfer and the id shared by its transfer_out/transfer_in pair
+    counterparty_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    transfer_id = Column(String(32), nullable=True, index=True)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_key"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    key = Column(String(255), nullable=False)
+    endpoint = Column(String, nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    # NULL until the first request finishes
+    status_code = Column(Integer, nullable=True)
+    # The final response, or while status_code is NULL the progress of a multi-commit operation
+    response_body = Column(Text, nullable=True)
+    # Lease of the request currently running the operation; its commits are fenced on the token
+    claim_token = Column(String(32), nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class BalanceCheckpoint(Base):
+    __tablename__ = "balance_checkpoints"
+    __table_args__ = (
+        Index("ix_balance_checkpoints_user_created", "user_id", "created_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    # Ledger balance after every transaction with id <= last_transaction_id
+    balance = Column(Float, nullable=False)
+    last_transaction_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class SpendingRollup(Base):
+    __tablename__ = "spending_rollups"
+    __table_args__ = (
+        UniqueConstraint("user_id", "period", "transaction_type", name="uq_spending_rollups_user_period_type"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    # Calendar month in UTC, e.g. "2025-03"
+    period = Column(String(7), nullable=False)
+    transaction_type = Column(String, nullable=False)
+    total_amount = Column(Float, default=0.0, nullable=False)
+    transaction_count = Column(Integer, default=0, nullable=False)
+
+class BalanceShard(Base):
+    __tablename__ = "balance_shards"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # Credits not yet folded into users.balance
+    balance = Column(Float, default=0.0, nullable=False)
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+    __table_args__ = (
+        # Per-user catch-up reads: "this user's events after id N"
+        Index("ix_outbox_events_user_id_id", "user_id", "id"),
+    )
+    
+    # Ordered change feed; ids are assigned at insert and can commit out of order
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    event_type = Column(String(32), nullable=False)
+    # JSON document, see utils/outbox.py
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class VelocityBucket(Base):
+    __tablename__ = "velocity_buckets"
+    __table_args__ = (
+        UniqueConstraint("user_id", "slot", name="uq_velocity_buckets_user_slot"),
+    )
+    
+    # Per-user ring of one-minute outflow counters, see utils/velocity.py
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    slot = Column(Integer, nullable=False)
+    # Minutes since the Unix epoch the counters belong to; older ones are overwritten
+    minute = Column(Integer, nullable=False)
+    outflow_amount = Column(Float, default=0.0, nullable=False)
+    transfer_count = Column(Integer, default=0, nullable=False)
+
+class ScheduledPayment(Base):
+    __tablename__ = "scheduled_payments"
+    
+    # Standing instruction to pay a recipient once or on a schedule, see utils/scheduler.py
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    recipient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    amount = Column(Float, nullable=False)
+    # "once", "daily", "weekly" or "monthly"
+    frequency = Column(String(16), nullable=False)
+    # Nominal time of the first occurrence; later ones repeat its time of day (and day of month)
+    start_at = Column(DateTime, nullable=False)
+    # Occurrences already run or skipped, and the total to run (NULL = until cancelled)
+    occurrence = Column(Integer, default=0, nullable=False)
+    max_runs = Column(Integer, nullable=True)
+    # Fixed per-schedule delay after each nominal time, spreading round-hour peaks
+    spread_seconds = Column(Integer, default=0, nullable=False)
+    # When the scheduler should run it next; NULL once completed or cancelled
+    next_run_at = Column(DateTime, nullable=True, index=True)
+    status = Column(String(16), default="active", nullable=False)
+    # Lease held by the worker executing it
+    claim_token = Column(String(32), nullable=True)
+    claimed_until = Column(DateTime, nullable=True)
+    failure_count = Column(Integer, default=0, nullable=False)
+    last_run_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -1,16 +1,23 @@
 from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 import os
 from dotenv import load_dotenv
 
 from models.models import User
-from schemas.schemas import UserCreate, UserLogin, Token
-from utils.database import get_db
-from utils.security import get_password_hash, verify_password, create_access_token
-from utils.helpers import generate_twinpay_id
+from schemas.schemas import UserCreate, UserLogin, Token, TwinPayIdAvailability
+from utils.database import get_async_db
+from utils.security import get_password_hash_async, verify_password_async, create_access_token
+from utils.admission import admission, hashing_budget
+from utils.directory import invalidate_recipient
+from utils.helpers import (
+    TWINPAY_DOMAIN, available_twinpay_ids, generate_twinpay_id, normalize_twinpay_id,
+    suggest_twinpay_ids, twinpay_id_bases
+)
 
 # Load environment variables
 load_dotenv()
@@ -18,31 +25,43 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
 
 router = APIRouter(tags=["Authentication"])
 
-@router.post("/register", status_code=status.HTTP_201_CREATED)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+# User fields that must be unique, with the label used in conflict messages
+UNIQUE_FIELDS = {
+    "mobile_number": "Mobile number",
+    "email": "Email",
+    "aadhar_number": "Aadhar number",
+    "pan_card": "PAN card",
+    "twinpay_id": "TwinPay ID",
+}
+
+async def _registration_conflicts(user: UserCreate, db: AsyncSession) -> List[str]:
+    """Labels of every unique field already taken, found with a single query"""
+    values = {field: getattr(user, field) for field in UNIQUE_FIELDS if getattr(user, field)}
+    columns = [getattr(User, field) for field in values]
+    rows = (await db.execute(
+        select(*columns).where(or_(*(column == values[column.key] for column in columns)))
+    )).all()
+    return [
+        label for field, label in UNIQUE_FIELDS.items()
+        if field in values and any(getattr(row, field) == values[field] for row in rows)
+    ]
+
+@router.post("/register", status_code=status.HTTP_201_CREATED, dependencies=[Depends(hashing_budget("register", cost=2))])
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """User Registration Endpoint"""
     try:
-        existing_user = db.query(User).filter(User.mobile_number == user.mobile_number).first()
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Mobile number already registered")
-        
-        if user.email and db.query(User).filter(User.email == user.email).first():
-            raise HTTPException(status_code=400, detail="Email already registered")
-        
-        if user.aadhar_number and db.query(User).filter(User.aadhar_number == user.aadhar_number).first():
-            raise HTTPException(status_code=400, detail="Aadhar number already registered")
+        conflicts = await _registration_conflicts(user, db)
+        if conflicts:
+            raise HTTPException(status_code=400, detail=f"{', '.join(conflicts)} already registered")
         
-        if user.pan_card and db.query(User).filter(User.pan_card == user.pan_card).first():
-            raise HTTPException(status_code=400, detail="PAN card already registered")
-        
-        twinpay_id = generate_twinpay_id(user.full_name, user.email, db)
+        twinpay_id = user.twinpay_id or await generate_twinpay_id(user.full_name, user.email, db)
         
         new_user = User(
             mobile_number=user.mobile_number,
             full_name=user.full_name,
             twinpay_id=twinpay_id,
-            hashed_password=get_password_hash(user.password),
-            pin=get_password_hash(user.pin),
+            hashed_password=await get_password_hash_async(user.password),
+            pin=await get_password_hash_async(user.pin),
             balance=0.0,
             aadhar_number=user.aadhar_number,
             pan_card=user.pan_card,
@@ -52,20 +71,21 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
         )
         
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        invalidate_recipient(twinpay_id)
         
         return {"message": "User registered successfully", "twinpay_id": twinpay_id}
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail="Registration failed due to duplicate data")
 
-@router.post("/login", response_model=Token)
-def login(user_login: UserLogin, db: Session = Depends(get_db)):
+@router.post("/login", response_model=Token, dependencies=[Depends(hashing_budget("login"))])
+async def login(user_login: UserLogin, db: AsyncSession = Depends(get_async_db)):
     """User Login Endpoint"""
-    user = db.query(User).filter(User.mobile_number == user_login.mobile_number).first()
+    admission.admit_account("login", user_login.mobile_number)
+    user = await db.scalar(select(User).where(User.mobile_number == user_login.mobile_number))
     
-    if not user or not verify_password(user_login.password, user.hashed_password):
+    if not user or not await verify_password_async(user_login.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -75,15 +95,43 @@ def login(user_login: UserLogin, db: Session = Depends(get_db)):
     
     return {"access_token": access_token, "token_type": "bearer"}
 
+@router.get("/twinpay-id/availability", response_model=TwinPayIdAvailability)
+async def twinpay_id_availability(
+    twinpay_id: Optional[str] = None,
+    full_name: Optional[str] = None,
+    email: Optional[str] = None,
+    limit: int = Query(5, ge=1, le=20),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """TwinPay ID Availability and Suggestions Endpoint"""
+    bases = twinpay_id_bases(full_name, email)
+    available = None
+    if twinpay_id:
+        try:
+            twinpay_id = normalize_twinpay_id(twinpay_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        available = bool(await available_twinpay_ids(db, [twinpay_id]))
+        bases.insert(0, twinpay_id[:-len(TWINPAY_DOMAIN)])
+    if not bases:
+        raise HTTPException(status_code=400, detail="twinpay_id, full_name or email is required")
+    
+    return {
+        "twinpay_id": twinpay_id,
+        "available": available,
+        "suggestions": await suggest_twinpay_ids(db, bases, limit)
+    }
+
 # OAuth2 compatible login
-@router.post("/token", response_model=Token)
-def login_for_access_token(
+@router.post("/token", response_model=Token, dependencies=[Depends(hashing_budget("token"))])
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """OAuth2 compatible token login, get an access token for future requests"""
-    user = db.query(User).filter(User.mobile_number == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    admission.admit_account("token", form_data.username)
+    user = await db.scalar(select(User).where(User.mobile_number == form_data.username))
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect mobile number or password",
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import os
+from fastapi import APIRouter, Depends, Header, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, List, Optional
+
+from schemas.schemas import EventResponse
+from utils.database import get_async_db, AsyncSessionLocal
+from utils.outbox import broker, event_message, user_events
+from utils.security import oauth2_scheme
+from routers.users import Principal, get_current_user
+
+# Seconds between keep-alive comments on an idle stream
+EVENT_HEARTBEAT_INTERVAL = float(os.getenv("EVENT_HEARTBEAT_INTERVAL", "15"))
+# Events replayed from the outbox when a stream resumes after Last-Event-ID
+EVENT_CATCHUP_LIMIT = int(os.getenv("EVENT_CATCHUP_LIMIT", "1000"))
+
+router = APIRouter(tags=["Events"])
+
+async def get_stream_user(token: Annotated[str, Depends(oauth2_scheme)]) -> Principal:
+    """Authenticate with a session of its own, so a long-lived stream holds no connection"""
+    async with AsyncSessionLocal() as db:
+        return await get_current_user(token, db)
+
+def _sse(message: dict) -> str:
+    return f"id: {message['id']}\nevent: {message['event_type']}\ndata: {json.dumps(message['data'])}\n\n"
+
+async def _event_stream(user_id: int, after_id: Optional[int]):
+    # Subscribe before catching up, so nothing committed in between is lost
+    queue = broker.subscribe(user_id)
+    try:
+        replayed = set()
+        if after_id is not None:
+            async with AsyncSessionLocal() as db:
+                missed = await user_events(db, user_id, after_id, EVENT_CATCHUP_LIMIT)
+            if len(missed) == EVENT_CATCHUP_LIMIT:
+                # Too far behind to replay; the client should page through GET /api/events
+                yield "event: reset\ndata: {}\n\n"
+                return
+            for event in missed:
+                replayed.add(event.id)
+                yield _sse(event_message(event))
+        yield ": connected\n\n"
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), EVENT_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                # Fell too far behind; the client reconnects with Last-Event-ID
+                return
+            if event.id not in replayed:
+                yield _sse(event_message(event))
+    finally:
+        broker.unsubscribe(user_id, queue)
+
+@router.get("/stream")
+async def stream_events(
+    after: Optional[int] = Query(None, ge=0),
+    current_user: Principal = Depends(get_stream_user),
+    last_event_id: Optional[str] = Header(None)
+):
+    """Server-Sent Events Stream of Balance and Transaction Events
+
+    Each event carries its outbox id; reconnect with Last-Event-ID (or
+    `after`) to receive whatever was missed while disconnected.
+    """
+    if after is None and last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+    return StreamingResponse(
+        _event_stream(current_user.id, after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("", response_model=List[EventResponse])
+async def list_events(
+    after: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """The Current User's Events After an Outbox Id, Oldest First"""
+    return [event_message(event) for event in await user_events(db, current_user.id, after, limit)]
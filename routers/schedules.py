@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+
+from models.models import ScheduledPayment, User
+from schemas.schemas import ScheduledPaymentCreate, ScheduledPaymentResponse
+from utils.database import get_async_db
+from utils.admission import hashing_budget
+from utils.step_up import STEP_UP_HEADER, authorize_pin
+from utils.idempotency import current_scope, run_idempotent
+from utils.replica import get_read_db
+from utils.directory import resolve_recipient
+from utils.scheduler import SCHEDULE_MAX_PER_USER, first_run_at, random_spread
+from routers.users import Principal, get_current_user, load_user
+
+router = APIRouter(tags=["Scheduled Payments"])
+
+def _schedule_response(payment: ScheduledPayment, recipient_twinpay_id: str) -> dict:
+    return {
+        "id": payment.id,
+        "recipient_twinpay_id": recipient_twinpay_id,
+        "amount": payment.amount,
+        "frequency": payment.frequency,
+        "start_at": payment.start_at,
+        "max_runs": payment.max_runs,
+        "occurrence": payment.occurrence,
+        "next_run_at": payment.next_run_at,
+        "status": payment.status,
+        "failure_count": payment.failure_count,
+        "last_run_at": payment.last_run_at,
+        "last_error": payment.last_error,
+        "created_at": payment.created_at,
+    }
+
+async def _create_schedule(schedule: ScheduledPaymentCreate, current_user: Principal, db: AsyncSession, step_up_token: Optional[str]):
+    """Validate and store a scheduled payment for the current user"""
+    if schedule.amount <= 0:
+        raise HTTPException(status_code=400, detail="Invalid transfer amount")
+
+    if not schedule.pin and not step_up_token:
+        raise HTTPException(status_code=400, detail="PIN is required for transfer")
+
+    now = datetime.utcnow()
+    start_at = schedule.start_at or now
+    if start_at.tzinfo is not None:
+        start_at = start_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if start_at < now - timedelta(minutes=1):
+        raise HTTPException(status_code=400, detail="Start time is in the past")
+
+    recipient = await resolve_recipient(db, schedule.recipient_twinpay_id)
+    if not recipient:
+        raise HTTPException(status_code=404, detail="Recipient not found")
+    if recipient.id == current_user.id:
+        raise HTTPException(status_code=400, detail="Cannot transfer to yourself")
+
+    active = await db.scalar(
+        select(func.count(ScheduledPayment.id))
+        .where(ScheduledPayment.user_id == current_user.id, ScheduledPayment.status == "active")
+    )
+    if active >= SCHEDULE_MAX_PER_USER:
+        raise HTTPException(status_code=400, detail=f"At most {SCHEDULE_MAX_PER_USER} active scheduled payments allowed")
+
+    sender = await load_user(db, current_user.id)
+    if not await authorize_pin("schedule", "transfer", sender, schedule.pin, step_up_token):
+        raise HTTPException(status_code=401, detail="Invalid PIN")
+
+    spread_seconds = random_spread()
+    payment = ScheduledPayment(
+        user_id=current_user.id,
+        recipient_id=recipient.id,
+        amount=schedule.amount,
+        frequency=schedule.frequency,
+        start_at=start_at,
+        max_runs=schedule.max_runs,
+        spread_seconds=spread_seconds,
+        next_run_at=first_run_at(schedule.frequency, start_at, spread_seconds),
+        created_at=now
+    )
+    db.add(payment)
+    await db.flush()
+    response = _schedule_response(payment, recipient.twinpay_id)
+    # Stored with the schedule, so a retry never creates a second one
+    scope = current_scope.get()
+    if scope is not None:
+        await scope.record(db, body=response)
+    await db.commit()
+
+    return response
+
+@router.post(
+    "", status_code=status.HTTP_201_CREATED, response_model=ScheduledPaymentResponse,
+    dependencies=[Depends(hashing_budget("schedule", skip_header=STEP_UP_HEADER))]
+)
+async def create_schedule(
+    schedule: ScheduledPaymentCreate,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    step_up_token: Optional[str] = Header(None, alias=STEP_UP_HEADER)
+):
+    """Schedule a One-Off or Recurring Transfer
+
+    The PIN (or a step-up token for "transfer") authorizes every future run.
+    Runs start within SCHEDULE_SPREAD_SECONDS after their nominal time.
+    """
+    return await run_idempotent(
+        idempotency_key, current_user.id, "schedule", schedule.model_dump(exclude={"pin"}),
+        lambda: _create_schedule(schedule, current_user, db, step_up_token), db,
+        status_code=status.HTTP_201_CREATED
+    )
+
+@router.get("", response_model=List[ScheduledPaymentResponse])
+async def list_schedules(
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """The Current User's Scheduled Payments, Newest First"""
+    rows = (await db.execute(
+        select(ScheduledPayment, User.twinpay_id)
+        .join(User, User.id == ScheduledPayment.recipient_id)
+        .where(ScheduledPayment.user_id == current_user.id)
+        .order_by(ScheduledPayment.id.desc())
+    )).all()
+    return [_schedule_response(payment, twinpay_id) for payment, twinpay_id in rows]
+
+@router.delete("/{schedule_id}", response_model=ScheduledPaymentResponse)
+async def cancel_schedule(
+    schedule_id: int,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Cancel a Scheduled Payment
+
+    Waits for a run of it already in progress; no run starts afterwards.
+    """
+    payment = await db.scalar(
+        select(ScheduledPayment)
+        .where(ScheduledPayment.id == schedule_id, ScheduledPayment.user_id == current_user.id)
+        .with_for_update()
+    )
+    if payment is None:
+        raise HTTPException(status_code=404, detail="Scheduled payment not found")
+    if payment.status == "active":
+        payment.status = "cancelled"
+        payment.next_run_at = None
+    recipient_twinpay_id = await db.scalar(select(User.twinpay_id).where(User.id == payment.recipient_id))
+    await db.commit()
+
+    return _schedule_response(payment, recipient_twinpay_id)
@@ -1,188 +1,496 @@
+import csv
+import io
+import json
+import os
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from typing import List, Optional
 
-from models.models import User, Transaction
-from schemas.schemas import TransactionCreate, TransactionResponse
-from utils.database import get_db
-from utils.security import verify_password
-from utils.helpers import generate_transaction_number
-from routers.users import get_current_user
+from models.models import User, Transaction, SpendingRollup
+from schemas.schemas import (
+    TransactionCreate, TransactionResponse, BatchTransferCreate, BatchTransferResponse, BatchTransferResult,
+    SpendingSummary
+)
+from utils.database import get_async_db, AsyncSessionLocal
+from utils.admission import hashing_budget
+from utils.step_up import STEP_UP_HEADER, authorize_pin
+from utils.helpers import encode_cursor, decode_cursor
+from utils.ledger import apply_deposit, apply_withdrawal, apply_transfer, apply_batch_transfer
+from utils.idempotency import current_scope, run_idempotent
+from utils.group_commit import commit_ledger_write
+from utils.replica import get_read_db
+from utils.directory import resolve_recipient, resolve_recipients
+from utils.archive import archive_horizon, archived_history, iter_archived_rows
+from utils.rollups import INFLOW_TYPES, first_period
+from routers.users import Principal, get_current_user, invalidate_principal, load_user
+
+# Batch transfers commit in chunks of this many items unless the request overrides it
+BATCH_TRANSFER_CHUNK_SIZE = int(os.getenv("BATCH_TRANSFER_CHUNK_SIZE", "500"))
+# Rows fetched per round-trip and written per chunk when streaming statements
+STATEMENT_FETCH_SIZE = int(os.getenv("STATEMENT_FETCH_SIZE", "1000"))
+
+STATEMENT_COLUMNS = ["transaction_number", "timestamp", "transaction_type", "amount", "counterparty_twinpay_id"]
 
 router = APIRouter(tags=["Transactions"])
 
-@router.post("/deposit", status_code=status.HTTP_200_OK)
-def deposit(
-    transaction: TransactionCreate, 
-    current_user: User = Depends(get_current_user), 
-    db: Session = Depends(get_db)
-):
-    """Deposit Money Endpoint"""
+async def _deposit(transaction: TransactionCreate, current_user: Principal, db: AsyncSession):
+    """Validate and apply a deposit for the current user"""
     if transaction.amount <= 0:
         raise HTTPException(status_code=400, detail="Invalid deposit amount")
     
-    current_user.balance += transaction.amount
-    
-    new_transaction = Transaction(
-        user_id=current_user.id,
-        transaction_number=generate_transaction_number(current_user.id),
-        transaction_type='deposit',
-        amount=transaction.amount,
-        timestamp=datetime.utcnow()
+    response = await commit_ledger_write(
+        db, [current_user.id], lambda session: apply_deposit(session, current_user.id, transaction.amount),
+        lambda result: {
+            "message": "Deposit successful",
+            "transaction_number": result[0].transaction_number,
+            "timestamp": result[0].timestamp.isoformat(),
+            "new_balance": result[1]
+        }
     )
+    invalidate_principal(current_user.mobile_number)
     
-    db.add(new_transaction)
-    db.commit()
-    
-    return {
-        "message": "Deposit successful",
-        "transaction_number": new_transaction.transaction_number,
-        "timestamp": new_transaction.timestamp.isoformat(),
-        "new_balance": current_user.balance
-    }
+    return response
 
-@router.post("/withdraw", status_code=status.HTTP_200_OK)
-def withdraw(
+@router.post("/deposit", status_code=status.HTTP_200_OK)
+async def deposit(
     transaction: TransactionCreate, 
-    current_user: User = Depends(get_current_user), 
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user), 
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255)
 ):
-    """Withdraw Money Endpoint"""
+    """Deposit Money Endpoint"""
+    return await run_idempotent(
+        idempotency_key, current_user.id, "deposit", transaction.model_dump(exclude={"pin"}),
+        lambda: _deposit(transaction, current_user, db), db
+    )
+
+async def _withdraw(transaction: TransactionCreate, current_user: Principal, db: AsyncSession, step_up_token: Optional[str]):
+    """Validate and apply a withdrawal for the current user"""
     if transaction.amount <= 0:
         raise HTTPException(status_code=400, detail="Invalid withdrawal amount")
     
-    if current_user.balance < transaction.amount:
-        raise HTTPException(status_code=400, detail="Insufficient balance")
-    
-    if not transaction.pin:
+    if not transaction.pin and not step_up_token:
         raise HTTPException(status_code=400, detail="PIN is required for withdrawal")
     
-    if not verify_password(transaction.pin, current_user.pin):
+    user = await load_user(db, current_user.id)
+    if not await authorize_pin("withdraw", "withdraw", user, transaction.pin, step_up_token):
         raise HTTPException(status_code=401, detail="Invalid PIN")
     
-    current_user.balance -= transaction.amount
-    
-    new_transaction = Transaction(
-        user_id=current_user.id,
-        transaction_number=generate_transaction_number(current_user.id),
-        transaction_type='withdraw',
-        amount=transaction.amount,
-        timestamp=datetime.utcnow()
+    response = await commit_ledger_write(
+        db, [current_user.id], lambda session: apply_withdrawal(session, current_user.id, transaction.amount),
+        lambda result: {
+            "message": "Withdrawal successful",
+            "transaction_number": result[0].transaction_number,
+            "timestamp": result[0].timestamp.isoformat(),
+            "new_balance": result[1]
+        }
     )
+    invalidate_principal(current_user.mobile_number)
     
-    db.add(new_transaction)
-    db.commit()
-    
-    return {
-        "message": "Withdrawal successful",
-        "transaction_number": new_transaction.transaction_number,
-        "timestamp": new_transaction.timestamp.isoformat(),
-        "new_balance": current_user.balance
-    }
+    return response
 
-@router.post("/transfer", status_code=status.HTTP_200_OK)
-def transfer(
-    transaction: TransactionCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+@router.post("/withdraw", status_code=status.HTTP_200_OK, dependencies=[Depends(hashing_budget("withdraw", skip_header=STEP_UP_HEADER))])
+async def withdraw(
+    transaction: TransactionCreate, 
+    current_user: Principal = Depends(get_current_user), 
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    step_up_token: Optional[str] = Header(None, alias=STEP_UP_HEADER)
 ):
-    """Transfer Money to Another User Endpoint"""
+    """Withdraw Money Endpoint"""
+    return await run_idempotent(
+        idempotency_key, current_user.id, "withdraw", transaction.model_dump(exclude={"pin"}),
+        lambda: _withdraw(transaction, current_user, db, step_up_token), db
+    )
+
+async def _transfer(transaction: TransactionCreate, current_user: Principal, db: AsyncSession, step_up_token: Optional[str]):
+    """Validate and apply a transfer for the current user"""
     if transaction.amount <= 0:
         raise HTTPException(status_code=400, detail="Invalid transfer amount")
     
-    if current_user.balance < transaction.amount:
-        raise HTTPException(status_code=400, detail="Insufficient balance")
-    
     if not transaction.recipient_twinpay_id:
         raise HTTPException(status_code=400, detail="Recipient TwinPay ID required")
     
-    if not transaction.pin:
+    if not transaction.pin and not step_up_token:
         raise HTTPException(status_code=400, detail="PIN is required for transfer")
     
-    if not verify_password(transaction.pin, current_user.pin):
-        raise HTTPException(status_code=401, detail="Invalid PIN")
-    
-    recipient = db.query(User).filter(User.twinpay_id == transaction.recipient_twinpay_id).first()
+    # Resolve the recipient first so a mistyped ID costs no PIN hash
+    recipient = await resolve_recipient(db, transaction.recipient_twinpay_id)
     if not recipient:
         raise HTTPException(status_code=404, detail="Recipient not found")
     
-    if recipient.id == current_user.id:
-        raise HTTPException(status_code=400, detail="Cannot transfer to yourself")
-    
-    current_user.balance -= transaction.amount
-    recipient.balance += transaction.amount
+    sender = await load_user(db, current_user.id)
+    if not await authorize_pin("transfer", "transfer", sender, transaction.pin, step_up_token):
+        raise HTTPException(status_code=401, detail="Invalid PIN")
     
-    sender_transaction = Transaction(
-        user_id=current_user.id,
-        transaction_number=generate_transaction_number(current_user.id),
-        transaction_type="transfer_out",
-        amount=transaction.amount,
-        timestamp=datetime.utcnow()
+    recipient_sharded = bool(recipient.balance_shards)
+    response = await commit_ledger_write(
+        db,
+        [current_user.id] if recipient_sharded else [current_user.id, recipient.id],
+        lambda session: apply_transfer(
+            session, current_user.id, recipient.id, transaction.amount, recipient_sharded=recipient_sharded
+        ),
+        lambda result: {
+            "message": "Transfer successful",
+            "transaction_number": result[0].transaction_number,
+            "timestamp": result[0].timestamp.isoformat(),
+            "new_balance": result[1],
+            "recipient_twinpay_id": recipient.twinpay_id
+        }
     )
+    invalidate_principal(current_user.mobile_number)
+    invalidate_principal(recipient.mobile_number)
     
-    receiver_transaction = Transaction(
-        user_id=recipient.id,
-        transaction_number=generate_transaction_number(recipient.id),
-        transaction_type="transfer_in",
-        amount=transaction.amount,
-        timestamp=sender_transaction.timestamp
+    return response
+
+@router.post("/transfer", status_code=status.HTTP_200_OK, dependencies=[Depends(hashing_budget("transfer", skip_header=STEP_UP_HEADER))])
+async def transfer(
+    transaction: TransactionCreate,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    step_up_token: Optional[str] = Header(None, alias=STEP_UP_HEADER)
+):
+    """Transfer Money to Another User Endpoint"""
+    return await run_idempotent(
+        idempotency_key, current_user.id, "transfer", transaction.model_dump(exclude={"pin"}),
+        lambda: _transfer(transaction, current_user, db, step_up_token), db
     )
-    
-    db.add(sender_transaction)
-    db.add(receiver_transaction)
-    db.commit()
-    
+
+def _batch_response(results: List[BatchTransferResult], total_transferred: float, new_balance: float) -> dict:
+    succeeded = sum(1 for result in results if result.status == "success")
     return {
-        "message": "Transfer successful",
-        "transaction_number": sender_transaction.transaction_number,
-        "timestamp": sender_transaction.timestamp.isoformat(),
-        "new_balance": current_user.balance,
-        "recipient_twinpay_id": recipient.twinpay_id
+        "message": "Batch transfer processed",
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "total_transferred": total_transferred,
+        "new_balance": new_balance,
+        "results": results
     }
 
+async def _batch_transfer(batch: BatchTransferCreate, current_user: Principal, db: AsyncSession, step_up_token: Optional[str]):
+    """Apply a batch transfer for the current user
+
+    Under an Idempotency-Key every chunk records the results so far in its
+    own transaction and the last chunk records the response, so a retry
+    after a crash resumes with the items not yet committed. Once a chunk
+    has committed, a failure ends the batch with the remaining items
+    reported as not processed rather than as an error.
+    """
+    if not batch.pin and not step_up_token:
+        raise HTTPException(status_code=400, detail="PIN is required for transfer")
+    
+    sender = await load_user(db, current_user.id)
+    if not await authorize_pin("transfer-batch", "transfer", sender, batch.pin, step_up_token):
+        raise HTTPException(status_code=401, detail="Invalid PIN")
+    new_balance = sender.balance
+    
+    recipients = await resolve_recipients(db, (item.recipient_twinpay_id for item in batch.transfers))
+    sharded = {row.id for row in recipients.values() if row.balance_shards}
+    
+    # Results committed by an earlier, interrupted request with the same key
+    scope = current_scope.get()
+    progress = scope.progress if scope is not None and scope.progress else {"results": [], "total_transferred": 0.0}
+    done = {result["index"]: BatchTransferResult(**result) for result in progress["results"]}
+    total_transferred = progress["total_transferred"]
+    
+    results = [None] * len(batch.transfers)
+    pending = []
+    for index, item in enumerate(batch.transfers):
+        recipient = recipients.get(item.recipient_twinpay_id)
+        if index in done:
+            results[index] = done[index]
+            continue
+        if item.amount <= 0:
+            detail = "Invalid transfer amount"
+        elif recipient is None:
+            detail = "Recipient not found"
+        elif recipient.id == current_user.id:
+            detail = "Cannot transfer to yourself"
+        else:
+            pending.append((index, recipient, item.amount))
+            continue
+        results[index] = BatchTransferResult(
+            index=index, recipient_twinpay_id=item.recipient_twinpay_id,
+            amount=item.amount, status="failed", detail=detail
+        )
+    
+    chunk_size = batch.chunk_size or BATCH_TRANSFER_CHUNK_SIZE
+    credited = set()
+    committed = bool(done)
+    try:
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            outcomes, chunk_balance = await apply_batch_transfer(
+                db, current_user.id, [(recipient.id, amount) for _, recipient, amount in chunk], sharded
+            )
+            chunk_results = list(results)
+            chunk_transferred = 0.0
+            for (index, recipient, amount), (sender_transaction, detail) in zip(chunk, outcomes):
+                if sender_transaction is not None:
+                    chunk_transferred += amount
+                chunk_results[index] = BatchTransferResult(
+                    index=index,
+                    recipient_twinpay_id=recipient.twinpay_id,
+                    amount=amount,
+                    status="failed" if detail else "success",
+                    transaction_number=sender_transaction.transaction_number if sender_transaction else None,
+                    detail=detail
+                )
+            if scope is not None:
+                if start + chunk_size >= len(pending):
+                    await scope.record(db, body=_batch_response(chunk_results, total_transferred + chunk_transferred, chunk_balance))
+                else:
+                    await scope.record(db, progress={
+                        "results": [result for result in chunk_results if result is not None],
+                        "total_transferred": total_transferred + chunk_transferred
+                    })
+            await db.commit()
+            committed = True
+            results, new_balance = chunk_results, chunk_balance
+            total_transferred += chunk_transferred
+            for (_, recipient, _), (sender_transaction, _) in zip(chunk, outcomes):
+                if sender_transaction is not None:
+                    credited.add(recipient.mobile_number)
+    except Exception:
+        if not committed:
+            raise
+        await db.rollback()
+        for index, recipient, amount in pending:
+            if results[index] is None:
+                results[index] = BatchTransferResult(
+                    index=index, recipient_twinpay_id=recipient.twinpay_id,
+                    amount=amount, status="failed", detail="Not processed"
+                )
+    
+    invalidate_principal(current_user.mobile_number)
+    for mobile_number in credited:
+        invalidate_principal(mobile_number)
+    
+    return _batch_response(results, total_transferred, new_balance)
+
+@router.post("/transfer/batch", response_model=BatchTransferResponse, dependencies=[Depends(hashing_budget("transfer-batch", skip_header=STEP_UP_HEADER))])
+async def batch_transfer(
+    batch: BatchTransferCreate,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    step_up_token: Optional[str] = Header(None, alias=STEP_UP_HEADER)
+):
+    """Transfer Money to Many Users in One Request
+
+    The PIN is verified once and all recipients are resolved with one query.
+    Items are applied in chunks, each chunk in a single database transaction;
+    every item gets its own success or failure result.
+    """
+    return await run_idempotent(
+        idempotency_key, current_user.id, "batch_transfer", batch.model_dump(exclude={"pin"}),
+        lambda: _batch_transfer(batch, current_user, db, step_up_token), db
+    )
+
 @router.get("/transactions", response_model=List[TransactionResponse])
-def get_all_transactions(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def get_all_transactions(
+    response: Response,
+    transaction_type: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Get All Transactions for Current User"""
-    transactions = db.query(Transaction).filter(
-        Transaction.user_id == current_user.id
-    ).order_by(Transaction.timestamp.desc()).all()
-    
-    result = []
-    for tx in transactions:
-        tx_data = {
+    """Get Transactions for Current User, newest first
+
+    Pages are keyed on (timestamp, id). When more rows exist the response
+    carries an X-Next-Cursor header to pass back as `cursor`. Months before
+    the archive horizon are read from the archive, and only when the
+    database rows run out before the page is full.
+    """
+    counterparty = aliased(User)
+    query = select(Transaction, counterparty.twinpay_id).outerjoin(
+        counterparty, counterparty.id == Transaction.counterparty_id
+    ).where(Transaction.user_id == current_user.id)
+    
+    horizon = archive_horizon()
+    if horizon is not None:
+        query = query.where(Transaction.timestamp >= horizon)
+    if transaction_type:
+        query = query.where(Transaction.transaction_type == transaction_type)
+    if start_date:
+        query = query.where(Transaction.timestamp >= start_date)
+    if end_date:
+        query = query.where(Transaction.timestamp <= end_date)
+    if min_amount is not None:
+        query = query.where(Transaction.amount >= min_amount)
+    if max_amount is not None:
+        query = query.where(Transaction.amount <= max_amount)
+    before = None
+    if cursor:
+        before = decode_cursor(cursor)
+        cursor_timestamp, cursor_id = before
+        query = query.where(or_(
+            Transaction.timestamp < cursor_timestamp,
+            and_(Transaction.timestamp == cursor_timestamp, Transaction.id < cursor_id)
+        ))
+    
+    result = await db.execute(query.order_by(
+        Transaction.timestamp.desc(), Transaction.id.desc()
+    ).limit(limit + 1))
+    # For transfer_in the counterparty is the sender
+    history = [
+        {
+            "id": tx.id,
             "transaction_number": tx.transaction_number,
             "transaction_type": tx.transaction_type,
             "amount": tx.amount,
             "timestamp": tx.timestamp,
-            "recipient_twinpay_id": None
+            "recipient_twinpay_id": counterparty_twinpay_id
         }
+        for tx, counterparty_twinpay_id in result.all()
+    ]
+    
+    if len(history) <= limit and horizon is not None and (start_date is None or start_date < horizon):
+        if history:
+            before = (history[-1]["timestamp"], history[-1]["id"])
+        archived = await archived_history(
+            current_user.id, limit + 1 - len(history), transaction_type,
+            start_date, end_date, min_amount, max_amount, before
+        )
+        history.extend(await _with_counterparties(db, archived))
+    
+    if len(history) > limit:
+        history = history[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(history[-1]["timestamp"], history[-1]["id"])
+    return history
+
+async def _with_counterparties(db: AsyncSession, rows: List[dict]) -> List[dict]:
+    """Attach counterparty TwinPay IDs to archived rows with one query"""
+    ids = {row["counterparty_id"] for row in rows if row["counterparty_id"]}
+    twinpay_ids = dict((await db.execute(select(User.id, User.twinpay_id).where(User.id.in_(ids)))).all()) if ids else {}
+    return [
+        {
+            "id": row["id"],
+            "transaction_number": row["transaction_number"],
+            "transaction_type": row["transaction_type"],
+            "amount": row["amount"],
+            "timestamp": row["timestamp"],
+            "recipient_twinpay_id": twinpay_ids.get(row["counterparty_id"])
+        }
+        for row in rows
+    ]
+
+@router.get("/summary", response_model=List[SpendingSummary])
+async def get_spending_summary(
+    months: int = Query(6, ge=1, le=60),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Monthly Inflow/Outflow Summary Endpoint, newest month first"""
+    result = await db.execute(
+        select(SpendingRollup).where(
+            SpendingRollup.user_id == current_user.id,
+            SpendingRollup.period >= first_period(months)
+        ).order_by(SpendingRollup.period.desc())
+    )
+    
+    summaries = {}
+    for rollup in result.scalars():
+        summary = summaries.setdefault(rollup.period, {
+            "period": rollup.period, "inflow": 0.0, "outflow": 0.0, "totals": {}, "counts": {}
+        })
+        summary["totals"][rollup.transaction_type] = rollup.total_amount
+        summary["counts"][rollup.transaction_type] = rollup.transaction_count
+        if rollup.transaction_type in INFLOW_TYPES:
+            summary["inflow"] += rollup.total_amount
+        else:
+            summary["outflow"] += rollup.total_amount
+    return list(summaries.values())
+
+async def _statement_rows(user_id: int, start_date: Optional[datetime], end_date: Optional[datetime]):
+    """Yield a user's transactions oldest first through a server-side cursor
+
+    Uses its own session because the response body is streamed after the
+    request's dependencies have been cleaned up. Archived months come first.
+    """
+    counterparty = aliased(User)
+    query = select(
+        Transaction.transaction_number,
+        Transaction.timestamp,
+        Transaction.transaction_type,
+        Transaction.amount,
+        counterparty.twinpay_id
+    ).outerjoin(
+        counterparty, counterparty.id == Transaction.counterparty_id
+    ).where(Transaction.user_id == user_id)
+    if start_date:
+        query = query.where(Transaction.timestamp >= start_date)
+    if end_date:
+        query = query.where(Transaction.timestamp <= end_date)
+    query = query.order_by(Transaction.timestamp, Transaction.id).execution_options(yield_per=STATEMENT_FETCH_SIZE)
+    
+    horizon = archive_horizon()
+    async with AsyncSessionLocal() as db:
+        if horizon is not None and (start_date is None or start_date < horizon):
+            archive_end = horizon if end_date is None else min(end_date, horizon)
+            async for rows in iter_archived_rows(user_id, start_date, archive_end):
+                for start in range(0, len(rows), STATEMENT_FETCH_SIZE):
+                    chunk = await _with_counterparties(db, rows[start:start + STATEMENT_FETCH_SIZE])
+                    yield [
+                        (row["transaction_number"], row["timestamp"], row["transaction_type"], row["amount"], row["recipient_twinpay_id"])
+                        for row in chunk
+                    ]
+            query = query.where(Transaction.timestamp >= horizon)
         
-        if tx.transaction_type == "transfer_out":
-            # Find the recipient by matching transfer_in with same amount and timestamp
-            receiver_tx = db.query(Transaction).filter(
-                Transaction.transaction_type == "transfer_in",
-                Transaction.amount == tx.amount,
-                Transaction.timestamp == tx.timestamp
-            ).first()
-            if receiver_tx:
-                recipient = db.query(User).filter(User.id == receiver_tx.user_id).first()
-                tx_data["recipient_twinpay_id"] = recipient.twinpay_id
-        
-        elif tx.transaction_type == "transfer_in":
-            # Find the sender by matching transfer_out with same amount and timestamp
-            sender_tx = db.query(Transaction).filter(
-                Transaction.transaction_type == "transfer_out",
-                Transaction.amount == tx.amount,
-                Transaction.timestamp == tx.timestamp
-            ).first()
-            if sender_tx:
-                sender = db.query(User).filter(User.id == sender_tx.user_id).first()
-                tx_data["recipient_twinpay_id"] = sender.twinpay_id  # Repurposed as sender ID
-        
-        result.append(tx_data)
+        result = await db.stream(query)
+        async for partition in result.partitions():
+            yield partition
+
+async def _csv_statement(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(STATEMENT_COLUMNS)
+    yield buffer.getvalue()
+    async for partition in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        for number, timestamp, transaction_type, amount, counterparty in partition:
+            writer.writerow([number, timestamp.isoformat(), transaction_type, amount, counterparty or ""])
+        yield buffer.getvalue()
+
+async def _ndjson_statement(rows):
+    async for partition in rows:
+        yield "".join(
+            json.dumps(dict(zip(STATEMENT_COLUMNS, (number, timestamp.isoformat(), transaction_type, amount, counterparty)))) + "\n"
+            for number, timestamp, transaction_type, amount, counterparty in partition
+        )
+
+@router.get("/statement")
+async def export_statement(
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    current_user: Principal = Depends(get_current_user)
+):
+    """Stream a Full Statement as CSV or NDJSON, oldest first
+
+    Rows are written as they are fetched, so memory stays flat regardless
+    of history size and the first bytes go out before the query finishes.
+    """
+    rows = _statement_rows(current_user.id, start_date, end_date)
+    if export_format == "csv":
+        body, media_type = _csv_statement(rows), "text/csv"
+    else:
+        body, media_type = _ndjson_statement(rows), "application/x-ndjson"
     
-    return result
\ No newline at end of file
+    filename = f"statement-{current_user.twinpay_id.split('@')[0]}.{export_format}"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -1,11 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import Annotated
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, List, Optional
 
 from models.models import User
-from schemas.schemas import UserResponse, PasswordUpdate, PinUpdate
-from utils.database import get_db
-from utils.security import oauth2_scheme, verify_password, get_password_hash, jwt
+from schemas.schemas import UserResponse, PasswordUpdate, PinUpdate, RecipientResponse, StepUpRequest, StepUpResponse
+from utils.database import get_async_db, AsyncSessionLocal
+from utils.replica import get_read_db, is_replica
+from utils.cache import TTLCache
+from utils.checkpoints import balance_as_of
+from utils.directory import RECIPIENT_SEARCH_MAX_RESULTS, resolve_recipient, search_recipients
+from utils.shards import shard_balance
+from utils.security import oauth2_scheme, verify_password_async, get_password_hash_async, jwt
+from utils.admission import admission, hashing_budget, verify_pin
+from utils.step_up import STEP_UP_HEADER, STEP_UP_SCOPES, STEP_UP_TOKEN_TTL, authorize_pin, create_step_up_token
 import os
 from dotenv import load_dotenv
 
@@ -14,74 +25,225 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 
+# Authentication caches (per worker process)
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "30"))
+
 router = APIRouter(tags=["Users"])
 
-def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)):
-    """Get current user from JWT token"""
+@dataclass(frozen=True)
+class Principal:
+    """Cached identity of the authenticated user
+
+    Holds no password or PIN hashes and may lag the database by up to
+    PRINCIPAL_CACHE_TTL; anything that checks credentials or moves money
+    must read the row with load_user instead.
+    """
+    id: int
+    mobile_number: str
+    full_name: str
+    twinpay_id: str
+    balance: float
+    email: Optional[str] = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            mobile_number=user.mobile_number,
+            full_name=user.full_name,
+            twinpay_id=user.twinpay_id,
+            balance=user.balance,
+            email=user.email,
+        )
+
+# token -> subject, and subject (mobile number) -> Principal
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+principal_cache = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
+def invalidate_principal(mobile_number: str):
+    """Drop a cached principal after its row changes"""
+    principal_cache.pop(mobile_number)
+
+async def load_user(db: AsyncSession, user_id: int, for_update: bool = False) -> User:
+    """Read a user's current row, optionally locking it for the transaction"""
+    query = select(User).where(User.id == user_id).execution_options(populate_existing=True)
+    if for_update:
+        query = query.with_for_update()
+    user = await db.scalar(query)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSession = Depends(get_read_db)) -> Principal:
+    """Get current user from JWT token, served from the principal cache when possible"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        mobile_number: str = payload.get("sub")
-        if mobile_number is None:
+    mobile_number = token_cache.get(token)
+    if mobile_number is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            mobile_number: str = payload.get("sub")
+            if mobile_number is None:
+                raise credentials_exception
+        except jwt.JWTError:
             raise credentials_exception
-    except jwt.JWTError:
-        raise credentials_exception
+        # Never cache a token past its own expiry
+        expires_in = payload.get("exp", 0) - time.time()
+        token_cache.set(token, mobile_number, ttl=min(TOKEN_CACHE_TTL, expires_in))
     
-    user = db.query(User).filter(User.mobile_number == mobile_number).first()
-    if user is None:
-        raise credentials_exception
-    return user
+    principal = principal_cache.get(mobile_number)
+    if principal is None:
+        user = await db.scalar(select(User).where(User.mobile_number == mobile_number))
+        if user is None and is_replica(db):
+            # A user who just registered may not have reached the replica yet
+            async with AsyncSessionLocal() as primary:
+                user = await primary.scalar(select(User).where(User.mobile_number == mobile_number))
+        if user is None:
+            raise credentials_exception
+        principal = Principal.from_user(user)
+        if user.balance_shards:
+            principal = replace(principal, balance=user.balance + await shard_balance(db, user.id))
+        principal_cache.set(mobile_number, principal)
+    return principal
 
 @router.get("/profile", response_model=UserResponse)
-def get_current_user_profile(current_user: User = Depends(get_current_user)):
+async def get_current_user_profile(current_user: Principal = Depends(get_current_user)):
     """Get current user profile information"""
     return current_user
 
-@router.post("/change-password", status_code=status.HTTP_200_OK)
-def change_password(
+@router.post("/change-password", status_code=status.HTTP_200_OK, dependencies=[Depends(hashing_budget("change-password", cost=2))])
+async def change_password(
     password_update: PasswordUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Change User Password Endpoint"""
-    if not verify_password(password_update.current_password, current_user.hashed_password):
+    admission.admit_account("change-password", current_user.mobile_number)
+    user = await load_user(db, current_user.id)
+    if not await verify_password_async(password_update.current_password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Incorrect current password")
     
-    current_user.hashed_password = get_password_hash(password_update.new_password)
-    db.commit()
+    user.hashed_password = await get_password_hash_async(password_update.new_password)
+    await db.commit()
+    invalidate_principal(user.mobile_number)
     
     return {"message": "Password updated successfully"}
 
-@router.post("/change-pin", status_code=status.HTTP_200_OK)
-def change_pin(
+@router.post("/change-pin", status_code=status.HTTP_200_OK, dependencies=[Depends(hashing_budget("change-pin", cost=2))])
+async def change_pin(
     pin_update: PinUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Change User PIN Endpoint"""
-    if not verify_password(pin_update.current_pin, current_user.pin):
+    user = await load_user(db, current_user.id)
+    if not await verify_pin("change-pin", user, pin_update.current_pin):
         raise HTTPException(status_code=401, detail="Incorrect current PIN")
     
-    current_user.pin = get_password_hash(pin_update.new_pin)
-    db.commit()
+    user.pin = await get_password_hash_async(pin_update.new_pin)
+    await db.commit()
+    invalidate_principal(user.mobile_number)
     
     return {"message": "PIN updated successfully"}
 
-@router.get("/balance")
-def check_balance(
-    pin: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+@router.post("/step-up", response_model=StepUpResponse, dependencies=[Depends(hashing_budget("step-up"))])
+async def step_up(
+    step_up_request: StepUpRequest,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Exchange the PIN for a Short-Lived Step-Up Token Endpoint
+
+    Send the token in the X-Step-Up-Token header instead of the PIN to the
+    balance, withdraw and transfer endpoints until it expires or the PIN
+    changes.
+    """
+    scopes = step_up_request.scope or list(STEP_UP_SCOPES)
+    unknown = set(scopes) - set(STEP_UP_SCOPES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown step-up scope: {', '.join(sorted(unknown))}")
+    
+    user = await load_user(db, current_user.id)
+    if not await verify_pin("step-up", user, step_up_request.pin):
+        raise HTTPException(status_code=401, detail="Invalid PIN")
+    
+    return {
+        "step_up_token": create_step_up_token(user, scopes),
+        "scope": sorted(set(scopes)),
+        "expires_in": STEP_UP_TOKEN_TTL
+    }
+
+@router.get("/balance", dependencies=[Depends(hashing_budget("balance", skip_header=STEP_UP_HEADER))])
+async def check_balance(
+    pin: Optional[str] = None,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+    primary: AsyncSession = Depends(get_async_db),
+    step_up_token: Optional[str] = Header(None, alias=STEP_UP_HEADER)
 ):
-    """Check User Balance Endpoint"""
-    if not pin:
+    """Check User Balance Endpoint
+
+    The PIN is checked against the primary, so a lagging replica never
+    accepts an old PIN or a revoked step-up token; the balance is read
+    from `db`.
+    """
+    if not pin and not step_up_token:
         raise HTTPException(status_code=400, detail="PIN is required to check balance")
     
-    if not verify_password(pin, current_user.pin):
+    user = await load_user(primary, current_user.id)
+    if not await authorize_pin("balance", "balance", user, pin, step_up_token):
         raise HTTPException(status_code=401, detail="Invalid PIN")
     
-    return {"balance": current_user.balance}
\ No newline at end of file
+    balance = await db.scalar(select(User.balance).where(User.id == current_user.id))
+    # Credits to a sharded account wait on sub-balances until consolidated
+    return {"balance": balance + await shard_balance(db, current_user.id)}
+
+@router.get("/balance/as-of", dependencies=[Depends(hashing_budget("balance-as-of", skip_header=STEP_UP_HEADER))])
+async def check_balance_as_of(
+    as_of: datetime,
+    pin: Optional[str] = None,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+    primary: AsyncSession = Depends(get_async_db),
+    step_up_token: Optional[str] = Header(None, alias=STEP_UP_HEADER)
+):
+    """Balance at a Point in Time Endpoint
+
+    As with /balance, the PIN is checked against the primary.
+    """
+    if not pin and not step_up_token:
+        raise HTTPException(status_code=400, detail="PIN is required to check balance")
+    
+    user = await load_user(primary, current_user.id)
+    if not await authorize_pin("balance-as-of", "balance", user, pin, step_up_token):
+        raise HTTPException(status_code=401, detail="Invalid PIN")
+    
+    return {"as_of": as_of.isoformat(), "balance": await balance_as_of(db, current_user.id, as_of)}
+
+@router.get("/recipients/search", response_model=List[RecipientResponse])
+async def search_payees(
+    q: str = Query(min_length=2, max_length=64),
+    limit: int = Query(10, ge=1, le=RECIPIENT_SEARCH_MAX_RESULTS),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Search Payees by TwinPay ID or Name Prefix Endpoint"""
+    return await search_recipients(db, q, limit)
+
+@router.get("/recipients/{twinpay_id}", response_model=RecipientResponse)
+async def lookup_payee(
+    twinpay_id: str,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Look Up a Payee Before Paying Endpoint"""
+    recipient = await resolve_recipient(db, twinpay_id)
+    if recipient is None:
+        raise HTTPException(status_code=404, detail="Recipient not found")
+    return recipient
@@ -1,7 +1,9 @@
 import re
 from datetime import datetime
-from typing import Optional
-from pydantic import BaseModel, field_validator, ConfigDict, EmailStr
+from typing import Any, Dict, List, Literal, Optional
+from pydantic import BaseModel, Field, field_validator, ConfigDict, EmailStr
+
+from utils.helpers import normalize_twinpay_id
 
 class UserCreate(BaseModel):
     mobile_number: str
@@ -13,6 +15,7 @@ class UserCreate(BaseModel):
     date_of_birth: Optional[datetime] = None
     email: Optional[EmailStr] = None
     address: Optional[str] = None
+    twinpay_id: Optional[str] = None
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -44,6 +47,16 @@ class UserCreate(BaseModel):
             raise ValueError('Invalid PAN card format (e.g., ABCDE1234F)')
         return v
 
+    @field_validator('twinpay_id')
+    @classmethod
+    def validate_twinpay_id(cls, v):
+        return normalize_twinpay_id(v) if v else v
+
+class TwinPayIdAvailability(BaseModel):
+    twinpay_id: Optional[str] = None
+    available: Optional[bool] = None
+    suggestions: List[str]
+
 class UserLogin(BaseModel):
     mobile_number: str
     password: str
@@ -57,6 +70,12 @@ class UserResponse(BaseModel):
     
     model_config = ConfigDict(from_attributes=True)
 
+class RecipientResponse(BaseModel):
+    twinpay_id: str
+    full_name: str
+    
+    model_config = ConfigDict(from_attributes=True)
+
 class TransactionCreate(BaseModel):
     amount: float
     transaction_type: str
@@ -70,6 +89,76 @@ class TransactionCreate(BaseModel):
             raise ValueError('PIN must be 4 digits')
         return v
 
+class BatchTransferItem(BaseModel):
+    recipient_twinpay_id: str
+    amount: float
+
+class BatchTransferCreate(BaseModel):
+    pin: Optional[str] = None
+    transfers: List[BatchTransferItem] = Field(min_length=1, max_length=10000)
+    chunk_size: Optional[int] = Field(default=None, ge=1, le=5000)
+
+    @field_validator('pin')
+    @classmethod
+    def validate_pin(cls, v):
+        if v and not re.match(r'^\d{4}$', v):
+            raise ValueError('PIN must be 4 digits')
+        return v
+
+class BatchTransferResult(BaseModel):
+    index: int
+    recipient_twinpay_id: str
+    amount: float
+    status: str
+    transaction_number: Optional[str] = None
+    detail: Optional[str] = None
+
+class BatchTransferResponse(BaseModel):
+    message: str
+    succeeded: int
+    failed: int
+    total_transferred: float
+    new_balance: Optional[float] = None
+    results: List[BatchTransferResult]
+
+class ScheduledPaymentCreate(BaseModel):
+    recipient_twinpay_id: str
+    amount: float
+    frequency: Literal["once", "daily", "weekly", "monthly"]
+    # Defaults to now; times without a zone are UTC
+    start_at: Optional[datetime] = None
+    max_runs: Optional[int] = Field(default=None, ge=1)
+    pin: Optional[str] = None
+
+    @field_validator('pin')
+    @classmethod
+    def validate_pin(cls, v):
+        if v and not re.match(r'^\d{4}$', v):
+            raise ValueError('PIN must be 4 digits')
+        return v
+
+class ScheduledPaymentResponse(BaseModel):
+    id: int
+    recipient_twinpay_id: str
+    amount: float
+    frequency: str
+    start_at: datetime
+    max_runs: Optional[int] = None
+    occurrence: int
+    next_run_at: Optional[datetime] = None
+    status: str
+    failure_count: int
+    last_run_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    created_at: datetime
+
+class SpendingSummary(BaseModel):
+    period: str
+    inflow: float
+    outflow: float
+    totals: Dict[str, float]
+    counts: Dict[str, int]
+
 class TransactionResponse(BaseModel):
     transaction_number: str
     transaction_type: str
@@ -79,10 +168,25 @@ class TransactionResponse(BaseModel):
     
     model_config = ConfigDict(from_attributes=True)
 
+class EventResponse(BaseModel):
+    id: int
+    event_type: str
+    created_at: datetime
+    data: Dict[str, Any]
+
 class Token(BaseModel):
     access_token: str
     token_type: str
 
+class StepUpRequest(BaseModel):
+    pin: str
+    scope: Optional[List[str]] = None
+
+class StepUpResponse(BaseModel):
+    step_up_token: str
+    scope: List[str]
+    expires_in: int
+
 class PasswordUpdate(BaseModel):
     current_password: str
     new_password: str
@@ -0,0 +1,190 @@
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request, status
+
+from utils.cache import TTLCache
+from utils.metrics import ADMISSION_CPU_SAVED, ADMISSION_REJECTED
+from utils.security import hashing_service, verify_password_async
+
+# Admission control for endpoints that run bcrypt. Every client address and
+# every account has a token bucket of bcrypt calls; a request that would
+# overdraw either gets a 429 before it reaches the hashing pool, so a
+# credential-stuffing burst or a client polling /balance cannot take every
+# core. Repeated wrong PINs lock the account's PIN checks with exponential
+# backoff.
+
+# Load environment variables
+load_dotenv()
+# Bucket refill per second and capacity; a rate of 0 disables the bucket
+ADMISSION_CLIENT_RATE = float(os.getenv("ADMISSION_CLIENT_RATE", "5"))
+ADMISSION_CLIENT_BURST = float(os.getenv("ADMISSION_CLIENT_BURST", "20"))
+ADMISSION_ACCOUNT_RATE = float(os.getenv("ADMISSION_ACCOUNT_RATE", "0.5"))
+ADMISSION_ACCOUNT_BURST = float(os.getenv("ADMISSION_ACCOUNT_BURST", "10"))
+ADMISSION_STORE_SIZE = int(os.getenv("ADMISSION_STORE_SIZE", "100000"))
+# Behind a reverse proxy, key clients by the address it appends to X-Forwarded-For
+ADMISSION_TRUST_FORWARDED_FOR = os.getenv("ADMISSION_TRUST_FORWARDED_FOR", "false").lower() in ("1", "true", "yes")
+
+# Lockout after PIN_LOCKOUT_THRESHOLD wrong PINs, doubling per further failure
+PIN_LOCKOUT_THRESHOLD = int(os.getenv("PIN_LOCKOUT_THRESHOLD", "5"))
+PIN_LOCKOUT_BASE = float(os.getenv("PIN_LOCKOUT_BASE", "30"))
+PIN_LOCKOUT_MAX = float(os.getenv("PIN_LOCKOUT_MAX", "3600"))
+# Failures are forgotten after this long without another one, or on a correct PIN
+PIN_FAILURE_WINDOW = float(os.getenv("PIN_FAILURE_WINDOW", "86400"))
+
+class AdmissionStore(ABC):
+    """Where token buckets and PIN failure counts live
+
+    Keys are strings and values plain numbers, so a shared backend such as
+    Redis can implement this to enforce the limits across workers.
+    """
+
+    @abstractmethod
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Take `cost` tokens from a bucket refilling at `rate` per second up to `burst`
+
+        Returns 0 if they were taken, otherwise the seconds until they would be.
+        """
+
+    @abstractmethod
+    def incr(self, key: str, ttl: float) -> int:
+        """Increment a counter, (re)setting its expiry; returns the new value"""
+
+    @abstractmethod
+    def get(self, key: str) -> Any:
+        """Value stored under `key`, or None if missing or expired"""
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float):
+        """Store `value` under `key` for `ttl` seconds"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Remove `key` if present"""
+
+class MemoryAdmissionStore(AdmissionStore):
+    """Per-process store; each worker enforces the limits on its own"""
+
+    def __init__(self, maxsize: int):
+        # A bucket expires once it would have refilled, so evicting it changes nothing
+        self._entries = TTLCache(maxsize, PIN_FAILURE_WINDOW)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        cost = min(cost, burst)
+        with self._lock:
+            tokens, updated = self._entries.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens < cost:
+                wait = (cost - tokens) / rate
+            else:
+                tokens -= cost
+            self._entries.set(key, (tokens, now), ttl=(burst - tokens) / rate)
+            return wait
+
+    def incr(self, key: str, ttl: float) -> int:
+        with self._lock:
+            value = self._entries.get(key, 0) + 1
+            self._entries.set(key, value, ttl=ttl)
+            return value
+
+    def get(self, key: str) -> Any:
+        return self._entries.get(key)
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._entries.set(key, value, ttl=ttl)
+
+    def delete(self, key: str):
+        self._entries.pop(key)
+
+class AdmissionController:
+    """Charges clients and accounts for bcrypt calls and enforces PIN lockouts
+
+    Replace `store` to share state between workers.
+    """
+
+    def __init__(self, store: AdmissionStore):
+        self.store = store
+
+    def _reject(self, action: str, reason: str, retry_after: float, detail: str, cost: float = 1):
+        ADMISSION_REJECTED.inc(action, reason)
+        ADMISSION_CPU_SAVED.inc(action, amount=cost * hashing_service.cpu_cost("verify"))
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def admit_client(self, action: str, client: str, cost: float = 1):
+        """Charge a client address for `cost` bcrypt calls, or raise 429"""
+        if ADMISSION_CLIENT_RATE <= 0:
+            return
+        wait = self.store.take(f"client:{client}", ADMISSION_CLIENT_RATE, ADMISSION_CLIENT_BURST, cost)
+        if wait:
+            self._reject(action, "client", wait, "Too many requests, please retry later", cost)
+
+    def admit_account(self, action: str, account: str, cost: float = 1):
+        """Charge an account (by mobile number) for `cost` bcrypt calls, or raise 429"""
+        if ADMISSION_ACCOUNT_RATE <= 0:
+            return
+        wait = self.store.take(f"account:{account}", ADMISSION_ACCOUNT_RATE, ADMISSION_ACCOUNT_BURST, cost)
+        if wait:
+            self._reject(action, "account", wait, "Too many attempts for this account, please retry later", cost)
+
+    def check_pin_lockout(self, action: str, account: str):
+        """Raise 429 while the account's PIN checks are locked out"""
+        locked_until = self.store.get(f"pin-lock:{account}")
+        if locked_until is not None and locked_until > time.time():
+            self._reject(
+                action, "lockout", locked_until - time.time(),
+                "Too many incorrect PIN attempts, please try again later"
+            )
+
+    def record_pin_failure(self, account: str) -> int:
+        """Count a wrong PIN and start a lockout past the threshold; returns the failure count"""
+        failures = self.store.incr(f"pin-failures:{account}", PIN_FAILURE_WINDOW)
+        if failures >= PIN_LOCKOUT_THRESHOLD:
+            doublings = min(failures - PIN_LOCKOUT_THRESHOLD, 32)
+            seconds = min(PIN_LOCKOUT_MAX, PIN_LOCKOUT_BASE * 2 ** doublings)
+            self.store.set(f"pin-lock:{account}", time.time() + seconds, seconds)
+        return failures
+
+    def clear_pin_failures(self, account: str):
+        self.store.delete(f"pin-failures:{account}")
+
+admission = AdmissionController(MemoryAdmissionStore(ADMISSION_STORE_SIZE))
+
+def client_address(request: Request) -> str:
+    if ADMISSION_TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+def hashing_budget(action: str, cost: float = 1, skip_header: Optional[str] = None):
+    """Dependency charging the calling client for `cost` bcrypt calls before the endpoint runs
+
+    Requests carrying `skip_header` (e.g. a step-up token in place of the
+    PIN) are not charged.
+    """
+    async def dependency(request: Request):
+        if skip_header and request.headers.get(skip_header):
+            return
+        admission.admit_client(action, client_address(request), cost)
+    return dependency
+
+async def verify_pin(action: str, user, pin: Optional[str]) -> bool:
+    """Check a user's PIN subject to the account budget and PIN lockout"""
+    admission.check_pin_lockout(action, user.mobile_number)
+    admission.admit_account(action, user.mobile_number)
+    if await verify_password_async(pin, user.pin):
+        admission.clear_pin_failures(user.mobile_number)
+        return True
+    admission.record_pin_failure(user.mobile_number)
+    return False
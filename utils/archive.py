@@ -0,0 +1,220 @@
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+
+# Cold storage for old transactions. Each archived month lives in
+# ARCHIVE_DIR/transactions/YYYY-MM/ as append-only segments of gzip NDJSON
+# files, one file per user bucket (user_id % buckets), so reading one user's
+# month decompresses a small fraction of it. manifest.json lists the
+# complete segments and is replaced atomically after their files are
+# durable, so readers never see a partial segment.
+#
+# Months are archived oldest first and without gaps. Everything before the
+# end of the newest archived month (the horizon) is read from here only;
+# the database serves everything after it.
+
+# Load environment variables
+load_dotenv()
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_BUCKETS = int(os.getenv("ARCHIVE_BUCKETS", "64"))
+# How long a worker trusts its view of which months are archived
+ARCHIVE_MANIFEST_TTL = float(os.getenv("ARCHIVE_MANIFEST_TTL", "60"))
+
+ARCHIVE_FIELDS = (
+    "id", "user_id", "transaction_number", "transaction_type", "amount", "timestamp",
+    "counterparty_id", "transfer_id",
+)
+
+def month_start(timestamp: datetime) -> datetime:
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def add_months(start: datetime, months: int) -> datetime:
+    index = start.year * 12 + start.month - 1 + months
+    return start.replace(year=index // 12, month=index % 12 + 1)
+
+def period_bounds(period: str) -> Tuple[datetime, datetime]:
+    """[start, end) of a YYYY-MM period"""
+    start = datetime.strptime(period, "%Y-%m")
+    return start, add_months(start, 1)
+
+def _period_dir(period: str) -> str:
+    return os.path.join(ARCHIVE_DIR, "transactions", period)
+
+def _segment_file(period: str, segment: int, bucket: int) -> str:
+    return os.path.join(_period_dir(period), f"seg-{segment:04d}-bucket-{bucket:03d}.ndjson.gz")
+
+def _write_atomically(path: str, data: bytes):
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+def read_manifest(period: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(_period_dir(period), "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+class _ArchiveIndex:
+    """Per-process cache of the archived periods and their manifests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded_at = 0.0
+        self._manifests: Dict[str, dict] = {}
+
+    def manifests(self) -> Dict[str, dict]:
+        with self._lock:
+            if time.monotonic() - self._loaded_at > ARCHIVE_MANIFEST_TTL:
+                root = os.path.join(ARCHIVE_DIR, "transactions")
+                periods = sorted(os.listdir(root)) if os.path.isdir(root) else []
+                self._manifests = {
+                    period: manifest for period in periods
+                    if (manifest := read_manifest(period)) is not None
+                }
+                self._loaded_at = time.monotonic()
+            return self._manifests
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+
+archive_index = _ArchiveIndex()
+
+def archived_periods() -> List[str]:
+    """Archived YYYY-MM periods, oldest first"""
+    return list(archive_index.manifests())
+
+def archive_horizon() -> Optional[datetime]:
+    """End of the newest archived month; older transactions live only in the archive"""
+    periods = archived_periods()
+    return period_bounds(periods[-1])[1] if periods else None
+
+def write_segment(period: str, rows: Iterable[dict], buckets: int = ARCHIVE_BUCKETS) -> dict:
+    """Append a new segment holding `rows` to a period and publish it
+
+    Returns the segment's manifest entry.
+    """
+    directory = _period_dir(period)
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(period) or {"period": period, "segments": []}
+    segment = len(manifest["segments"])
+    buckets = manifest["segments"][0]["buckets"] if manifest["segments"] else buckets
+
+    temporary = [f"{_segment_file(period, segment, bucket)}.tmp" for bucket in range(buckets)]
+    writers = [gzip.open(path, "wt", encoding="utf-8") for path in temporary]
+    count, min_id, max_id = 0, None, None
+    try:
+        for row in rows:
+            record = {field: row[field] for field in ARCHIVE_FIELDS}
+            record["timestamp"] = record["timestamp"].isoformat()
+            writers[record["user_id"] % buckets].write(json.dumps(record, separators=(",", ":")) + "\n")
+            count += 1
+            min_id = record["id"] if min_id is None else min(min_id, record["id"])
+            max_id = record["id"] if max_id is None else max(max_id, record["id"])
+    finally:
+        for writer in writers:
+            writer.close()
+
+    for bucket, path in enumerate(temporary):
+        with open(path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(path, _segment_file(period, segment, bucket))
+
+    entry = {
+        "segment": segment,
+        "buckets": buckets,
+        "rows": count,
+        "min_id": min_id,
+        "max_id": max_id,
+        "archived_at": datetime.utcnow().isoformat(),
+    }
+    manifest["segments"].append(entry)
+    _write_atomically(os.path.join(directory, "manifest.json"), json.dumps(manifest, indent=2).encode())
+    archive_index.invalidate()
+    return entry
+
+def load_user_rows(user_id: int, period: str) -> List[dict]:
+    """One user's archived transactions in a period, oldest first"""
+    manifest = archive_index.manifests().get(period) or read_manifest(period)
+    if manifest is None:
+        return []
+    rows = []
+    for entry in manifest["segments"]:
+        path = _segment_file(period, entry["segment"], user_id % entry["buckets"])
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                # Cheap substring test so other users' rows are skipped unparsed
+                if f'"user_id":{user_id},' not in line:
+                    continue
+                row = json.loads(line)
+                row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+                rows.append(row)
+    rows.sort(key=lambda row: (row["timestamp"], row["id"]))
+    return rows
+
+def _overlapping_periods(start: Optional[datetime], end: Optional[datetime]) -> List[str]:
+    periods = []
+    for period in archived_periods():
+        period_start, period_end = period_bounds(period)
+        if start is not None and period_end <= start:
+            continue
+        if end is not None and period_start > end:
+            continue
+        periods.append(period)
+    return periods
+
+async def archived_history(
+    user_id: int,
+    limit: int,
+    transaction_type: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    before: Optional[Tuple[datetime, int]] = None
+) -> List[dict]:
+    """Up to `limit` archived transactions, newest first, matching the history filters
+
+    `before` is a (timestamp, id) keyset position rows must precede.
+    """
+    upper = end_date if before is None else min(filter(None, (end_date, before[0])))
+    results = []
+    for period in reversed(_overlapping_periods(start_date, upper)):
+        rows = await asyncio.to_thread(load_user_rows, user_id, period)
+        for row in reversed(rows):
+            if before is not None and (row["timestamp"], row["id"]) >= before:
+                continue
+            if start_date and row["timestamp"] < start_date:
+                continue
+            if end_date and row["timestamp"] > end_date:
+                continue
+            if transaction_type and row["transaction_type"] != transaction_type:
+                continue
+            if min_amount is not None and row["amount"] < min_amount:
+                continue
+            if max_amount is not None and row["amount"] > max_amount:
+                continue
+            results.append(row)
+            if len(results) >= limit:
+                return results
+    return results
+
+async def iter_archived_rows(user_id: int, start_date: Optional[datetime], end_date: Optional[datetime]):
+    """Yield a user's archived transactions oldest first, one period at a time"""
+    for period in _overlapping_periods(start_date, end_date):
+        rows = await asyncio.to_thread(load_user_rows, user_id, period)
+        yield [
+            row for row in rows
+            if (start_date is None or row["timestamp"] >= start_date)
+            and (end_date is None or row["timestamp"] <= end_date)
+        ]
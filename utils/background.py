@@ -0,0 +1,33 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List
+
+logger = logging.getLogger(__name__)
+
+# Tasks started at application startup and cancelled at shutdown
+_tasks: List[asyncio.Task] = []
+
+async def _run_periodically(name: str, interval: float, job: Callable[[], Awaitable]):
+    while True:
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Background job %s failed", name)
+        await asyncio.sleep(interval)
+
+def start_periodic_task(name: str, interval: float, job: Callable[[], Awaitable]):
+    """Run an async job every `interval` seconds until shutdown"""
+    _tasks.append(asyncio.create_task(_run_periodically(name, interval, job), name=name))
+
+def start_task(name: str, coro: Awaitable):
+    """Run a long-lived coroutine until shutdown"""
+    _tasks.append(asyncio.create_task(coro, name=name))
+
+async def stop_background_tasks():
+    """Cancel every task started by this module and wait for them to exit"""
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
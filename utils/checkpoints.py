@@ -0,0 +1,135 @@
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+
+from models.models import User, Transaction, BalanceCheckpoint, BalanceShard
+from utils.archive import archive_horizon, iter_archived_rows
+
+# Load environment variables
+load_dotenv()
+# Transactions younger than this are left out of new checkpoints, so rows
+# whose ids were assigned before a slow commit are not skipped over
+RECONCILE_SETTLE_SECONDS = int(os.getenv("RECONCILE_SETTLE_SECONDS", "60"))
+# Largest balance difference still treated as equal
+RECONCILE_TOLERANCE = 1e-6
+
+CREDIT_TYPES = ("deposit", "transfer_in")
+
+def signed_amount():
+    """SQL expression for a transaction's effect on its owner's balance"""
+    return case(
+        (Transaction.transaction_type.in_(CREDIT_TYPES), Transaction.amount),
+        else_=-Transaction.amount
+    )
+
+def latest_checkpoint_id(user_id_column):
+    """Correlated subquery selecting a user's newest checkpoint"""
+    return select(BalanceCheckpoint.id).where(
+        BalanceCheckpoint.user_id == user_id_column
+    ).order_by(
+        BalanceCheckpoint.created_at.desc(), BalanceCheckpoint.id.desc()
+    ).limit(1).scalar_subquery()
+
+@dataclass
+class ReconcileResult:
+    users_checked: int = 0
+    checkpoints_written: int = 0
+    # (user_id, recorded balance, balance implied by the ledger)
+    mismatches: List[Tuple[int, float, float]] = field(default_factory=list)
+
+    def merge(self, other: "ReconcileResult"):
+        self.users_checked += other.users_checked
+        self.checkpoints_written += other.checkpoints_written
+        self.mismatches.extend(other.mismatches)
+
+def reconcile_range(db: Session, start_id: int, end_id: int, settled_before: datetime) -> ReconcileResult:
+    """Check users with start_id <= id < end_id against their ledger
+
+    Only transactions after each user's latest checkpoint are read. Every
+    user's recorded balance is compared with checkpoint + delta, and a new
+    checkpoint is added for users with transactions settled before
+    `settled_before`. The caller commits.
+    """
+    high_water = db.scalar(
+        select(func.max(Transaction.id)).where(Transaction.timestamp < settled_before)
+    ) or 0
+
+    checkpoint = aliased(BalanceCheckpoint)
+    since = func.coalesce(checkpoint.last_transaction_id, 0)
+    signed = signed_amount()
+    settled = Transaction.id <= high_water
+    # Sub-balances of sharded accounts are part of the recorded balance
+    shard_total = select(func.coalesce(func.sum(BalanceShard.balance), 0.0)).where(
+        BalanceShard.user_id == User.id
+    ).scalar_subquery()
+    rows = db.execute(
+        select(
+            User.id,
+            (User.balance + shard_total).label("balance"),
+            func.coalesce(checkpoint.balance, 0.0).label("checkpoint_balance"),
+            func.coalesce(func.sum(signed), 0.0).label("delta"),
+            func.coalesce(func.sum(case((settled, signed), else_=0.0)), 0.0).label("settled_delta"),
+            func.count(case((settled, Transaction.id))).label("settled_count"),
+        )
+        .select_from(User)
+        .outerjoin(checkpoint, checkpoint.id == latest_checkpoint_id(User.id))
+        .outerjoin(Transaction, and_(Transaction.user_id == User.id, Transaction.id > since))
+        .where(User.id >= start_id, User.id < end_id)
+        .group_by(User.id, User.balance, checkpoint.balance)
+    ).all()
+
+    result = ReconcileResult(users_checked=len(rows))
+    for row in rows:
+        expected = row.checkpoint_balance + row.delta
+        if abs(row.balance - expected) > RECONCILE_TOLERANCE:
+            result.mismatches.append((row.id, row.balance, expected))
+        if row.settled_count:
+            db.add(BalanceCheckpoint(
+                user_id=row.id,
+                balance=row.checkpoint_balance + row.settled_delta,
+                last_transaction_id=high_water,
+                created_at=settled_before
+            ))
+            result.checkpoints_written += 1
+    return result
+
+async def balance_as_of(db: AsyncSession, user_id: int, at: datetime) -> float:
+    """Ledger balance of a user at a point in time
+
+    Starts from the newest checkpoint taken at or before `at` and adds the
+    transactions recorded after it, so the scan is bounded by the
+    checkpoint interval rather than the account's age. Archived months
+    are read from the archive.
+    """
+    checkpoint = (await db.execute(
+        select(BalanceCheckpoint.balance, BalanceCheckpoint.last_transaction_id, BalanceCheckpoint.created_at)
+        .where(BalanceCheckpoint.user_id == user_id, BalanceCheckpoint.created_at <= at)
+        .order_by(BalanceCheckpoint.created_at.desc(), BalanceCheckpoint.id.desc())
+        .limit(1)
+    )).first()
+    base, since = (checkpoint.balance, checkpoint.last_transaction_id) if checkpoint else (0.0, 0)
+    
+    # Transactions after the checkpoint may already have been archived
+    horizon = archive_horizon()
+    if horizon is not None:
+        lower = checkpoint.created_at - timedelta(seconds=RECONCILE_SETTLE_SECONDS) if checkpoint else None
+        if lower is None or lower < horizon:
+            async for rows in iter_archived_rows(user_id, lower, min(at, horizon)):
+                base += sum(
+                    row["amount"] if row["transaction_type"] in CREDIT_TYPES else -row["amount"]
+                    for row in rows if row["id"] > since
+                )
+
+    delta = await db.scalar(
+        select(func.coalesce(func.sum(signed_amount()), 0.0)).where(
+            Transaction.user_id == user_id,
+            Transaction.id > since,
+            Transaction.timestamp <= at
+        )
+    )
+    return float(base + delta)
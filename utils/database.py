@@ -1,19 +1,129 @@
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from dotenv import load_dotenv
 
+from utils.metrics import gauge_lines, record_pool_wait, record_query, register_collector
+
 # Load environment variables
 load_dotenv()
 
+# Async drivers used when ASYNC_DATABASE_URL is not set explicitly
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def to_async_url(url: str) -> str:
+    """Swap the driver of a sync database URL for its asyncio counterpart"""
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.get_backend_name(), parsed.drivername)).render_as_string(hide_password=False)
+
 # Database connection
 DATABASE_URL = os.getenv("DATABASE_URL")
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# Connection pool configuration (per engine, per worker process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+class PoolStats:
+    """Checkout wait counters shared by every pool instance of an engine"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, waited: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+class InstrumentedPoolMixin:
+    """Records how long each pool checkout waited for a connection"""
+    stats: PoolStats
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        waited = time.perf_counter() - start
+        self.stats.record(waited)
+        record_pool_wait(waited)
+        return connection
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    stats = PoolStats()
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    stats = PoolStats()
+
+class InstrumentedReplicaQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    stats = PoolStats()
 
-engine = create_engine(DATABASE_URL)
+def pool_options(poolclass) -> dict:
+    """Engine keyword arguments for the configured pool"""
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+engine = create_engine(DATABASE_URL, **pool_options(InstrumentedQueuePool))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Async engine used by the API routers; the sync engine above serves startup and offline jobs
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(InstrumentedAsyncQueuePool))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# Optional read replica of DATABASE_URL for read-only endpoints (see utils/replica.py)
+READ_REPLICA_URL = os.getenv("READ_REPLICA_URL")
+ASYNC_READ_REPLICA_URL = os.getenv("ASYNC_READ_REPLICA_URL") or (to_async_url(READ_REPLICA_URL) if READ_REPLICA_URL else None)
+replica_engine = None
+ReplicaSessionLocal = None
+if ASYNC_READ_REPLICA_URL:
+    replica_engine = create_async_engine(ASYNC_READ_REPLICA_URL, **pool_options(InstrumentedReplicaQueuePool))
+    ReplicaSessionLocal = async_sessionmaker(replica_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+def instrument_queries(sync_engine, engine_name: str):
+    """Time every query and attribute it to the current request's metrics"""
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _query_started(conn, cursor, statement, parameters, context, executemany):
+        context.query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _query_finished(conn, cursor, statement, parameters, context, executemany):
+        record_query(engine_name, time.perf_counter() - context.query_started)
+
+instrument_queries(engine, "sync")
+instrument_queries(async_engine.sync_engine, "async")
+if replica_engine is not None:
+    instrument_queries(replica_engine.sync_engine, "replica")
+
 # Database dependency
 def get_db():
     """Database session dependency"""
@@ -23,7 +133,53 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Async database session dependency"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def pool_status(pool) -> dict:
+    """Snapshot of a pool's occupancy and checkout waits"""
+    capacity = pool.size() + DB_MAX_OVERFLOW
+    checked_out = pool.checkedout()
+    stats = pool.stats
+    return {
+        "size": pool.size(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": checked_out,
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "saturation": round(checked_out / capacity, 3) if capacity else 0.0,
+        "checkouts": stats.checkouts,
+        "checkout_timeouts": stats.timeouts,
+        "checkout_wait_seconds_total": round(stats.wait_seconds_total, 6),
+        "checkout_wait_seconds_max": round(stats.wait_seconds_max, 6),
+    }
+
+def get_pool_stats() -> dict:
+    """Pool status for the sync, async and replica engines"""
+    pools = {
+        "sync": pool_status(engine.pool),
+        "async": pool_status(async_engine.sync_engine.pool),
+    }
+    if replica_engine is not None:
+        pools["replica"] = pool_status(replica_engine.sync_engine.pool)
+    return pools
+
+def pool_metrics() -> list:
+    """Pool gauges for the /metrics endpoint"""
+    pools = get_pool_stats()
+    lines = []
+    for key in ("checked_out", "idle", "overflow", "saturation", "checkout_timeouts", "checkout_wait_seconds_total"):
+        lines.extend(gauge_lines(
+            f"twinpay_db_pool_{key}", f"Connection pool {key.replace('_', ' ')}",
+            [([("engine", name)], stats[key]) for name, stats in pools.items()]
+        ))
+    return lines
+
+register_collector(pool_metrics)
+
 # Database initialization
 def create_tables():
     """Create database tables if they don't exist"""
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
@@ -0,0 +1,85 @@
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+from dotenv import load_dotenv
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.models import User
+from utils.cache import TTLCache
+
+# Load environment variables
+load_dotenv()
+RECIPIENT_CACHE_SIZE = int(os.getenv("RECIPIENT_CACHE_SIZE", "50000"))
+RECIPIENT_CACHE_TTL = float(os.getenv("RECIPIENT_CACHE_TTL", "300"))
+# Unknown IDs are remembered briefly so repeated typos skip the database;
+# other workers learn about a new registration within this window
+RECIPIENT_MISS_TTL = float(os.getenv("RECIPIENT_MISS_TTL", "5"))
+RECIPIENT_SEARCH_MAX_RESULTS = 20
+
+_MISSING = object()
+
+@dataclass(frozen=True)
+class Recipient:
+    """What paying someone needs to know about them"""
+    id: int
+    twinpay_id: str
+    full_name: str
+    mobile_number: str
+    balance_shards: int = 0
+
+# twinpay_id -> Recipient, or _MISSING for IDs with no account
+recipient_cache = TTLCache(RECIPIENT_CACHE_SIZE, RECIPIENT_CACHE_TTL)
+
+RECIPIENT_COLUMNS = (User.id, User.twinpay_id, User.full_name, User.mobile_number, User.balance_shards)
+
+def invalidate_recipient(twinpay_id: str):
+    """Forget a cached lookup, e.g. after the ID is registered"""
+    recipient_cache.pop(twinpay_id)
+
+async def resolve_recipients(db: AsyncSession, twinpay_ids: Iterable[str]) -> Dict[str, Recipient]:
+    """Look up accounts by TwinPay ID, reading only cache misses with one IN query"""
+    found = {}
+    misses = []
+    for twinpay_id in set(twinpay_ids):
+        cached = recipient_cache.get(twinpay_id)
+        if cached is None:
+            misses.append(twinpay_id)
+        elif cached is not _MISSING:
+            found[twinpay_id] = cached
+
+    if misses:
+        rows = await db.execute(select(*RECIPIENT_COLUMNS).where(User.twinpay_id.in_(misses)))
+        for row in rows:
+            found[row.twinpay_id] = Recipient(**row._mapping)
+            recipient_cache.set(row.twinpay_id, found[row.twinpay_id])
+        for twinpay_id in misses:
+            if twinpay_id not in found:
+                recipient_cache.set(twinpay_id, _MISSING, ttl=RECIPIENT_MISS_TTL)
+    return found
+
+async def resolve_recipient(db: AsyncSession, twinpay_id: str) -> Optional[Recipient]:
+    """Look up one account by TwinPay ID"""
+    return (await resolve_recipients(db, [twinpay_id])).get(twinpay_id)
+
+def _like_prefix(prefix: str) -> str:
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%"
+
+async def search_recipients(db: AsyncSession, prefix: str, limit: int) -> List[Recipient]:
+    """Accounts whose TwinPay ID or full name starts with prefix (case-insensitive)
+
+    Both conditions are left-anchored LIKEs answered by the prefix indexes on
+    users.twinpay_id and lower(users.full_name).
+    """
+    pattern = _like_prefix(prefix.strip().lower())
+    rows = await db.execute(
+        select(*RECIPIENT_COLUMNS)
+        .where(or_(
+            User.twinpay_id.like(pattern, escape="\\"),
+            func.lower(User.full_name).like(pattern, escape="\\")
+        ))
+        .order_by(User.twinpay_id)
+        .limit(min(limit, RECIPIENT_SEARCH_MAX_RESULTS))
+    )
+    return [Recipient(**row._mapping) for row in rows]
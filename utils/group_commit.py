@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from utils.background import start_task
+from utils.database import AsyncSessionLocal
+from utils.idempotency import current_scope
+from utils.ledger import lock_users
+from utils.metrics import GROUP_COMMIT_BATCH_SIZE, GROUP_COMMIT_FALLBACKS
+
+logger = logging.getLogger(__name__)
+
+# Optional group commit for single ledger writes. Instead of one commit (and
+# one fsync) per request, requests queue their write to a single writer
+# task per worker, which gathers whatever arrives within GROUP_COMMIT_MAX_DELAY_MS
+# (up to GROUP_COMMIT_MAX_BATCH writes) and applies them in one transaction:
+#
+# - every user row the batch touches is locked up front in ascending id
+#   order, so batches on different workers cannot deadlock;
+# - each write runs in its own savepoint, so a failure such as insufficient
+#   balance rolls back that write alone and is raised to its caller;
+# - if the batch fails before its commit, every write is retried in a
+#   transaction of its own, so one bad batch costs latency rather than errors;
+# - if the commit itself fails, the batch may or may not have been applied.
+#   Only writes that record an idempotent response are retried, since that
+#   record refuses to apply a write twice; the others fail with 503.
+#
+# A queued write runs even if its caller is cancelled meanwhile, so whether
+# it applies never depends on how far the writer has got.
+
+# Load environment variables
+load_dotenv()
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "false").lower() in ("1", "true", "yes")
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "64"))
+GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", "2"))
+
+LedgerWrite = Callable[[AsyncSession], Awaitable[Any]]
+
+@dataclass
+class _PendingWrite:
+    user_ids: Tuple[int, ...]
+    write: LedgerWrite
+    future: asyncio.Future
+    # The write records its idempotent response, so retrying it cannot apply it twice
+    fenced: bool = False
+
+class _CommitFailed(Exception):
+    """The batch's commit raised; whether it was applied is unknown"""
+
+class GroupCommitter:
+    """Single writer that commits concurrent ledger writes together"""
+
+    def __init__(self, max_batch: int, max_delay: float):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+
+    @property
+    def running(self) -> bool:
+        return self._queue is not None
+
+    def start(self):
+        """Start the writer task (at application startup)"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            start_task("group-commit-writer", self._run())
+
+    async def submit(self, user_ids: Iterable[int], write: LedgerWrite, fenced: bool = False) -> Any:
+        """Apply `write` in the next batch; returns its result or raises its error
+
+        `user_ids` are the user rows the write locks. `fenced` marks a write
+        that records its idempotent response and may be retried after a
+        failed commit.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_PendingWrite(tuple(user_ids), write, future, fenced))
+        # Cancelling the caller does not withdraw the write
+        return await asyncio.shield(future)
+
+    async def _next_batch(self) -> List[_PendingWrite]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        batch = []
+        try:
+            while True:
+                batch = await self._next_batch()
+                GROUP_COMMIT_BATCH_SIZE.observe(len(batch))
+                try:
+                    outcomes = await self._apply_batch(batch)
+                except _CommitFailed:
+                    logger.exception("Commit of %d grouped writes failed; retrying only the fenced ones", len(batch))
+                    GROUP_COMMIT_FALLBACKS.inc()
+                    unknown = HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="Could not confirm the transaction; check your history before retrying"
+                    )
+                    outcomes = [
+                        await self._apply_one(pending) if pending.fenced else (unknown, None)
+                        for pending in batch
+                    ]
+                except Exception:
+                    logger.exception("Group commit of %d writes failed; retrying them individually", len(batch))
+                    GROUP_COMMIT_FALLBACKS.inc()
+                    outcomes = [await self._apply_one(pending) for pending in batch]
+                for pending, (error, result) in zip(batch, outcomes):
+                    if pending.future.done():
+                        continue
+                    if error is not None:
+                        pending.future.set_exception(error)
+                    else:
+                        pending.future.set_result(result)
+                batch = []
+        finally:
+            # Shutting down: fail the writes that will never run
+            unavailable = HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is shutting down")
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(unavailable)
+            self._queue = None
+
+    async def _apply_batch(self, batch: List[_PendingWrite]) -> List[Tuple[Optional[BaseException], Any]]:
+        outcomes = []
+        async with AsyncSessionLocal() as db:
+            await lock_users(db, (user_id for pending in batch for user_id in pending.user_ids))
+            for pending in batch:
+                try:
+                    async with db.begin_nested():
+                        outcomes.append((None, await pending.write(db)))
+                except Exception as e:
+                    outcomes.append((e, None))
+            try:
+                await db.commit()
+            except Exception as e:
+                raise _CommitFailed() from e
+        return outcomes
+
+    async def _apply_one(self, pending: _PendingWrite) -> Tuple[Optional[BaseException], Any]:
+        try:
+            async with AsyncSessionLocal() as db:
+                await lock_users(db, pending.user_ids)
+                result = await pending.write(db)
+                await db.commit()
+            return None, result
+        except Exception as e:
+            return e, None
+
+group_committer = GroupCommitter(GROUP_COMMIT_MAX_BATCH, GROUP_COMMIT_MAX_DELAY_MS / 1000)
+
+async def commit_ledger_write(
+    db: AsyncSession,
+    user_ids: Iterable[int],
+    write: LedgerWrite,
+    respond: Optional[Callable[[Any], Any]] = None
+) -> Any:
+    """Apply `write` and commit it, batched with concurrent writes when group commit is on
+
+    Without group commit the write runs on the request's own session `db`.
+    With `respond`, returns `respond(result)` instead of the result, and
+    stores it as the request's idempotent response in the same transaction.
+    """
+    scope = current_scope.get()
+
+    async def write_and_record(session: AsyncSession) -> Any:
+        result = await write(session)
+        if respond is None:
+            return result
+        response = respond(result)
+        if scope is not None:
+            await scope.record(session, body=response)
+        return response
+
+    if not group_committer.running:
+        result = await write_and_record(db)
+        await db.commit()
+        return result
+    # End the request's read transaction so it holds no connection while queued
+    await db.commit()
+    return await group_committer.submit(user_ids, write_and_record, fenced=scope is not None and respond is not None)
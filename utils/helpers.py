@@ -1,30 +1,117 @@
+import base64
 import random
-import string
+import re
+import unicodedata
+import uuid
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional, Tuple
 from fastapi import HTTPException
+from sqlalchemy import select
 
-def generate_twinpay_id(full_name: str, email: Optional[str], db) -> str:
-    """Generate TwinPay ID from full name or email if full name-based ID exists"""
-    from models.models import User
-    
-    base_id = full_name.lower().replace(' ', '')
-    twinpay_id = f"{base_id}@twinpay"
-    
-    # Check if TwinPay ID already exists
-    if db.query(User).filter(User.twinpay_id == twinpay_id).first():
-        if not email:
-            raise HTTPException(status_code=400, detail="Email required when TwinPay ID based on full name is taken")
-        # Use email (without domain) as TwinPay ID
-        email_base = email.split('@')[0].lower().replace('.', '')
-        twinpay_id = f"{email_base}@twinpay"
-        if db.query(User).filter(User.twinpay_id == twinpay_id).first():
-            raise HTTPException(status_code=400, detail="TwinPay ID based on email is also taken")
-    
-    return twinpay_id
-
-def generate_transaction_number(user_id: int) -> str:
-    """Generate a unique transaction number"""
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-    random_suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-    return f"{timestamp}{random_suffix}{user_id:04d}"
\ No newline at end of file
+from models.models import User
+from utils.ids import format_id, id_generator
+
+TWINPAY_DOMAIN = "@twinpay"
+# Candidate IDs checked per query, and queries tried before giving up
+TWINPAY_ID_BATCH_SIZE = 20
+TWINPAY_ID_ROUNDS = 5
+TWINPAY_ID_PATTERN = re.compile(r'^[a-z0-9._-]{3,32}$')
+# Bases are cut to this length to leave room for the longest random suffix
+TWINPAY_ID_BASE_LENGTH = 32 - (TWINPAY_ID_ROUNDS + 1)
+
+def normalize_twinpay_id(twinpay_id: str) -> str:
+    """Lower-case a chosen TwinPay ID, add the domain and check its format"""
+    local_part = twinpay_id.strip().lower()
+    if local_part.endswith(TWINPAY_DOMAIN):
+        local_part = local_part[:-len(TWINPAY_DOMAIN)]
+    if not TWINPAY_ID_PATTERN.match(local_part):
+        raise ValueError('TwinPay ID must be 3-32 characters of letters, digits, ".", "_" or "-"')
+    return f"{local_part}{TWINPAY_DOMAIN}"
+
+def _twinpay_id_base(text: str) -> str:
+    """`text` folded to the characters a TwinPay ID allows ("José" becomes "jose")"""
+    folded = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    return re.sub(r'[^a-z0-9._-]', '', folded)[:TWINPAY_ID_BASE_LENGTH]
+
+def twinpay_id_bases(full_name: Optional[str], email: Optional[str]) -> List[str]:
+    """Local parts TwinPay IDs are derived from: the full name, then the email
+
+    Empty when neither yields a usable character.
+    """
+    bases = []
+    if full_name:
+        bases.append(_twinpay_id_base(full_name))
+    if email:
+        bases.append(_twinpay_id_base(email.split('@')[0].replace('.', '')))
+    return list(dict.fromkeys(base for base in bases if base))
+
+def twinpay_id_candidates(bases: List[str], round_no: int = 0) -> List[str]:
+    """One batch of candidate TwinPay IDs, most preferred first
+
+    The first round tries the bare bases followed by small numbered
+    variants of the first; later rounds draw random suffixes with one more
+    digit each time, so a crowded name still resolves in a few queries.
+    Candidates that do not match TWINPAY_ID_PATTERN are left out.
+    """
+    if not bases:
+        return []
+    if round_no == 0:
+        local_parts = bases + [f"{bases[0]}{n}" for n in range(1, TWINPAY_ID_BATCH_SIZE - len(bases) + 1)]
+    else:
+        low, high = 10 ** (round_no + 1), 10 ** (round_no + 2) - 1
+        local_parts = [f"{random.choice(bases)}{random.randint(low, high)}" for _ in range(TWINPAY_ID_BATCH_SIZE)]
+    return list(dict.fromkeys(
+        f"{local_part}{TWINPAY_DOMAIN}" for local_part in local_parts if TWINPAY_ID_PATTERN.match(local_part)
+    ))
+
+async def available_twinpay_ids(db, candidates: List[str]) -> List[str]:
+    """Candidates not yet taken, in their original order, checked with one IN query"""
+    taken = set(await db.scalars(select(User.twinpay_id).where(User.twinpay_id.in_(candidates))))
+    return [candidate for candidate in candidates if candidate not in taken]
+
+async def suggest_twinpay_ids(db, bases: List[str], limit: int) -> List[str]:
+    """Up to `limit` free TwinPay IDs derived from the given bases"""
+    suggestions = []
+    for round_no in range(TWINPAY_ID_ROUNDS):
+        candidates = twinpay_id_candidates(bases, round_no)
+        if not candidates:
+            continue
+        for candidate in await available_twinpay_ids(db, candidates):
+            if candidate not in suggestions:
+                suggestions.append(candidate)
+        if len(suggestions) >= limit:
+            break
+    return suggestions[:limit]
+
+async def generate_twinpay_id(full_name: str, email: Optional[str], db) -> str:
+    """Generate a free TwinPay ID from the full name, falling back to the email and suffixed variants"""
+    suggestions = await suggest_twinpay_ids(db, twinpay_id_bases(full_name, email), 1)
+    if not suggestions:
+        raise HTTPException(status_code=409, detail="Could not allocate a TwinPay ID, please choose one")
+    return suggestions[0]
+
+def generate_transaction_number() -> str:
+    """Generate a unique, time-ordered transaction number"""
+    return format_id(id_generator.next_id())
+
+def generate_transaction_numbers(count: int) -> List[str]:
+    """Allocate a block of transaction numbers for bulk writes"""
+    return [format_id(value) for value in id_generator.next_ids(count)]
+
+def generate_transfer_id() -> str:
+    """Generate the id shared by both legs of a transfer"""
+    return uuid.uuid4().hex
+
+def encode_cursor(timestamp: datetime, transaction_id: int) -> str:
+    """Encode a (timestamp, id) keyset position as an opaque cursor"""
+    raw = f"{timestamp.isoformat()}|{transaction_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, transaction_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(transaction_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
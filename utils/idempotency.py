@@ -0,0 +1,269 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.models import IdempotencyKey
+from utils.cache import TTLCache
+from utils.database import AsyncSessionLocal
+
+# Load environment variables
+load_dotenv()
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30"))
+# A request must finish (or record progress) within its lease, or a retry may take the key over
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "60"))
+IDEMPOTENCY_SWEEP_INTERVAL = float(os.getenv("IDEMPOTENCY_SWEEP_INTERVAL", "300"))
+IDEMPOTENCY_SWEEP_BATCH = int(os.getenv("IDEMPOTENCY_SWEEP_BATCH", "1000"))
+
+# Poll interval while another worker holds the same key
+POLL_INTERVAL = 0.05
+
+# (user_id, key) -> (request_hash, status_code, body) for completed requests
+response_cache = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL_HOURS * 3600)
+# (user_id, key) -> future resolved when this worker's first request finishes
+_inflight: Dict[Tuple[int, str], asyncio.Future] = {}
+
+def request_fingerprint(endpoint: str, payload: Any) -> str:
+    """Stable hash of the endpoint and request body"""
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{endpoint}:{body}".encode()).hexdigest()
+
+def _replay(request_hash: str, stored: tuple) -> JSONResponse:
+    stored_hash, status_code, body = stored
+    if stored_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    return JSONResponse(content=body, status_code=status_code, headers={"Idempotent-Replayed": "true"})
+
+class IdempotencyScope:
+    """The Idempotency-Key a request is running its operation under
+
+    Operations record their response with `record` inside the transaction
+    that moves the money, so the key is completed exactly when the money
+    moves. Operations that commit several times record `progress` with
+    each commit instead and the final response with the last one; a retry
+    that takes over an abandoned key receives that progress and resumes.
+    Every record is fenced on this request's lease token, so a request
+    whose key was taken over cannot commit.
+    """
+
+    def __init__(self, user_id: int, key: str, request_hash: str, status_code: int):
+        self.user_id = user_id
+        self.key = key
+        self.request_hash = request_hash
+        self.status_code = status_code
+        self.token = uuid.uuid4().hex
+        # Progress left by an earlier request that was interrupted
+        self.progress: Optional[Any] = None
+        # Final response recorded in the operation's own transaction
+        self.body: Optional[Any] = None
+
+    async def record(self, db: AsyncSession, body: Any = None, progress: Any = None):
+        """Store the final response (or progress) in `db`'s transaction, extending the lease"""
+        values = {"locked_until": datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)}
+        if body is not None:
+            body = jsonable_encoder(body)
+            values.update(status_code=self.status_code, response_body=json.dumps(body))
+        else:
+            values.update(response_body=json.dumps(jsonable_encoder(progress)))
+        result = await db.execute(
+            update(IdempotencyKey)
+            .where(
+                IdempotencyKey.user_id == self.user_id,
+                IdempotencyKey.key == self.key,
+                IdempotencyKey.claim_token == self.token,
+                IdempotencyKey.status_code.is_(None)
+            )
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        if body is not None:
+            self.body = body
+
+# Scope of the operation running in the current request, if it sent a key
+current_scope: ContextVar[Optional[IdempotencyScope]] = ContextVar("current_idempotency_scope", default=None)
+
+async def _claim(scope: IdempotencyScope, endpoint: str) -> Optional[tuple]:
+    """Take the lease on a key, or return the stored result if one exists
+
+    A new key is inserted; a pending key whose lease ran out (its request
+    failed or died) is taken over, along with any progress it recorded.
+    Blocks while another request holds the lease.
+    """
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+    while True:
+        now = datetime.utcnow()
+        locked_until = now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+        async with AsyncSessionLocal() as db:
+            db.add(IdempotencyKey(
+                user_id=scope.user_id,
+                key=scope.key,
+                endpoint=endpoint,
+                request_hash=scope.request_hash,
+                claim_token=scope.token,
+                locked_until=locked_until,
+                created_at=now,
+                expires_at=now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+            ))
+            try:
+                await db.commit()
+                return None
+            except IntegrityError:
+                await db.rollback()
+
+            existing = await db.scalar(select(IdempotencyKey).where(
+                IdempotencyKey.user_id == scope.user_id, IdempotencyKey.key == scope.key
+            ))
+            if existing is None:
+                continue
+            if existing.expires_at <= now:
+                await db.execute(delete(IdempotencyKey).where(IdempotencyKey.id == existing.id))
+                await db.commit()
+                continue
+            if existing.status_code is not None:
+                return existing.request_hash, existing.status_code, json.loads(existing.response_body)
+            if existing.request_hash != scope.request_hash:
+                return existing.request_hash, None, None
+            if existing.locked_until is None or existing.locked_until <= now:
+                result = await db.execute(
+                    update(IdempotencyKey)
+                    .where(
+                        IdempotencyKey.id == existing.id,
+                        IdempotencyKey.status_code.is_(None),
+                        or_(IdempotencyKey.locked_until.is_(None), IdempotencyKey.locked_until <= now)
+                    )
+                    .values(claim_token=scope.token, locked_until=locked_until)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                if result.rowcount == 1:
+                    scope.progress = json.loads(existing.response_body) if existing.response_body else None
+                    return None
+                continue
+
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        await asyncio.sleep(POLL_INTERVAL)
+
+async def _complete(scope: IdempotencyScope, body: Any):
+    async with AsyncSessionLocal() as db:
+        await scope.record(db, body=body)
+        await db.commit()
+
+async def _release(scope: IdempotencyScope):
+    """Give up this request's key so the client can retry
+
+    A key without recorded progress is deleted. One whose operation already
+    committed progress is kept with its lease ended, so a retry takes it
+    over and resumes instead of repeating the committed work.
+    """
+    fenced = (
+        IdempotencyKey.user_id == scope.user_id,
+        IdempotencyKey.key == scope.key,
+        IdempotencyKey.claim_token == scope.token,
+        IdempotencyKey.status_code.is_(None)
+    )
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(IdempotencyKey).where(*fenced, IdempotencyKey.response_body.is_(None)))
+        await db.execute(
+            update(IdempotencyKey)
+            .where(*fenced)
+            .values(claim_token=None, locked_until=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
+async def run_idempotent(
+    key: Optional[str],
+    user_id: int,
+    endpoint: str,
+    payload: Any,
+    operation: Callable[[], Awaitable[Any]],
+    db: Optional[AsyncSession] = None,
+    status_code: int = 200
+):
+    """Run a money-moving operation at most once per (user, Idempotency-Key)
+
+    A repeated key replays the stored response without running the
+    operation. Concurrent duplicates wait for the first request to finish.
+    A request that fails gives up its lease so the client can retry; its
+    session `db` is rolled back first so no row locks are held meanwhile.
+    The operation should record its response through `current_scope` in
+    the transaction that moves the money; otherwise it is stored after
+    the operation returns.
+    """
+    if not key:
+        return await operation()
+
+    cache_key = (user_id, key)
+    scope = IdempotencyScope(user_id, key, request_fingerprint(endpoint, payload), status_code)
+    while True:
+        stored = response_cache.get(cache_key)
+        if stored is not None:
+            return _replay(scope.request_hash, stored)
+        waiter = _inflight.get(cache_key)
+        if waiter is None:
+            break
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), IDEMPOTENCY_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+    waiter = asyncio.get_running_loop().create_future()
+    _inflight[cache_key] = waiter
+    try:
+        stored = await _claim(scope, endpoint)
+        if stored is not None:
+            if stored[1] is not None:
+                response_cache.set(cache_key, stored)
+            return _replay(scope.request_hash, stored)
+
+        token = current_scope.set(scope)
+        try:
+            result = await operation()
+        except BaseException:
+            if db is not None:
+                await db.rollback()
+            await asyncio.shield(_release(scope))
+            raise
+        finally:
+            current_scope.reset(token)
+
+        if scope.body is None:
+            await _complete(scope, result)
+        response_cache.set(cache_key, (scope.request_hash, status_code, scope.body))
+        return result
+    finally:
+        _inflight.pop(cache_key, None)
+        waiter.set_result(None)
+
+async def sweep_expired_keys() -> int:
+    """Delete expired idempotency keys in batches; returns the number removed"""
+    removed = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            expired = select(IdempotencyKey.id).where(
+                IdempotencyKey.expires_at <= datetime.utcnow()
+            ).limit(IDEMPOTENCY_SWEEP_BATCH)
+            result = await db.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.id.in_(expired)).execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        removed += result.rowcount
+        if result.rowcount < IDEMPOTENCY_SWEEP_BATCH:
+            return removed
@@ -0,0 +1,128 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import zlib
+from typing import List, Optional
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, fall back to the process id
+    fcntl = None
+
+# Time-ordered 63-bit IDs in the style of Snowflake:
+#
+#   | 41 bits: ms since ID_EPOCH | 5 bits: node | 5 bits: slot | 12 bits: sequence |
+#
+# The node identifies the host (TWINPAY_NODE_ID) and the slot a process on
+# that host. Slots are claimed at first use by taking an exclusive flock on
+# one of 32 lock files, so worker processes started side by side never share
+# one and no coordination service is needed. Each (node, slot) pair hands out
+# up to 4096 IDs per millisecond; when the clock stalls, steps back, or the
+# sequence runs out, the generator keeps counting on a logical clock that is
+# never behind the last ID issued.
+
+# Load environment variables
+load_dotenv()
+TWINPAY_NODE_ID = os.getenv("TWINPAY_NODE_ID")
+TWINPAY_ID_LOCK_DIR = os.getenv("TWINPAY_ID_LOCK_DIR", os.path.join(tempfile.gettempdir(), "twinpay-ids"))
+
+ID_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+NODE_BITS = 5
+SLOT_BITS = 5
+SEQUENCE_BITS = 12
+MAX_NODES = 1 << NODE_BITS
+MAX_SLOTS = 1 << SLOT_BITS
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+# Decimal width of the largest 63-bit ID, so string order matches numeric order
+ID_DIGITS = 19
+
+def node_id() -> int:
+    """Host part of the worker id: TWINPAY_NODE_ID, or a hash of the hostname"""
+    if TWINPAY_NODE_ID is not None:
+        node = int(TWINPAY_NODE_ID)
+        if not 0 <= node < MAX_NODES:
+            raise ValueError(f"TWINPAY_NODE_ID must be between 0 and {MAX_NODES - 1}")
+        return node
+    # Unique hosts are only likely, not guaranteed; set TWINPAY_NODE_ID per host in production
+    return zlib.crc32(socket.gethostname().encode()) % MAX_NODES
+
+def _claim_slot() -> tuple:
+    """Take the first free slot lock on this host; returns (slot, open lock file)"""
+    if fcntl is None:
+        return os.getpid() % MAX_SLOTS, None
+    os.makedirs(TWINPAY_ID_LOCK_DIR, exist_ok=True)
+    for slot in range(MAX_SLOTS):
+        handle = open(os.path.join(TWINPAY_ID_LOCK_DIR, f"slot-{slot}.lock"), "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        return slot, handle
+    raise RuntimeError(f"All {MAX_SLOTS} ID generator slots on this host are in use")
+
+class IdGenerator:
+    """Thread-safe generator of unique, time-ordered integer IDs"""
+
+    def __init__(self, node: Optional[int] = None):
+        self._node = node
+        self._worker: Optional[int] = None
+        self._slot_handle = None
+        self._last_ms = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def _worker_bits(self) -> int:
+        if self._worker is None:
+            node = node_id() if self._node is None else self._node
+            slot, self._slot_handle = _claim_slot()
+            self._worker = (node << SLOT_BITS) | slot
+        return self._worker
+
+    def _reserve(self, count: int) -> tuple:
+        """Reserve up to `count` sequence numbers within one millisecond"""
+        now = int(time.time() * 1000) - ID_EPOCH_MS
+        if now > self._last_ms:
+            self._last_ms, self._sequence = now, 0
+        elif self._sequence > MAX_SEQUENCE:
+            self._last_ms, self._sequence = self._last_ms + 1, 0
+        start = self._sequence
+        taken = min(count, MAX_SEQUENCE + 1 - start)
+        self._sequence += taken
+        return self._last_ms, start, taken
+
+    def next_ids(self, count: int) -> List[int]:
+        """Allocate a block of `count` IDs with as few lock acquisitions as possible"""
+        ids = []
+        with self._lock:
+            prefix_shift = NODE_BITS + SLOT_BITS + SEQUENCE_BITS
+            worker = self._worker_bits() << SEQUENCE_BITS
+            while len(ids) < count:
+                timestamp, start, taken = self._reserve(count - len(ids))
+                base = (timestamp << prefix_shift) | worker
+                ids.extend(range(base | start, base | (start + taken)))
+        return ids
+
+    def next_id(self) -> int:
+        return self.next_ids(1)[0]
+
+    def reset(self):
+        """Forget the claimed slot, e.g. in a freshly forked child"""
+        self._lock = threading.Lock()
+        self._worker = None
+        self._slot_handle = None
+        self._last_ms = 0
+        self._sequence = 0
+
+id_generator = IdGenerator()
+
+# A forked child inherits the parent's slot and sequence; it must claim its own
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=id_generator.reset)
+
+def format_id(value: int) -> str:
+    """Fixed-width decimal form of an ID, sortable as a string"""
+    return f"{value:0{ID_DIGITS}d}"
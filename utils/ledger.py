@@ -0,0 +1,224 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Collection, Dict, Iterable, List, Optional, Sequence, Tuple
+from fastapi import HTTPException
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.models import User, Transaction
+from utils.helpers import generate_transaction_number, generate_transaction_numbers, generate_transfer_id
+from utils.outbox import transaction_events
+from utils.rollups import update_rollups
+from utils.shards import consolidate_shards, credit_shard
+from utils.velocity import check_velocity, update_velocity, velocity_error, velocity_headroom
+
+# Ledger write path: every balance change is a single conditional UPDATE, so
+# concurrent requests on one account can neither lose updates nor overdraw.
+# Callers own the transaction and commit once the postings are recorded.
+
+async def lock_users(db: AsyncSession, user_ids: Iterable[int]):
+    """Lock user rows in ascending id order so multi-row writes cannot deadlock"""
+    ids = sorted(set(user_ids))
+    if ids:
+        await db.execute(
+            select(User.id).where(User.id.in_(ids)).order_by(User.id).with_for_update()
+        )
+
+async def _conditional_debit(db: AsyncSession, user_id: int, amount: float) -> Optional[float]:
+    result = await db.execute(
+        update(User)
+        .where(User.id == user_id, User.balance >= amount)
+        .values(balance=User.balance - amount)
+        .returning(User.balance)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalar_one_or_none()
+
+async def debit(db: AsyncSession, user_id: int, amount: float) -> float:
+    """Subtract amount if the balance covers it and return the new balance
+
+    For a sharded account the sub-balances are folded in before giving up.
+    """
+    new_balance = await _conditional_debit(db, user_id, amount)
+    if new_balance is None and await consolidate_shards(db, user_id):
+        new_balance = await _conditional_debit(db, user_id, amount)
+    if new_balance is None:
+        raise HTTPException(status_code=400, detail="Insufficient balance")
+    return float(new_balance)
+
+async def credit(db: AsyncSession, user_id: int, amount: float) -> float:
+    """Add amount to a balance and return the new balance"""
+    result = await db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(balance=User.balance + amount)
+        .returning(User.balance)
+        .execution_options(synchronize_session=False)
+    )
+    new_balance = result.scalar_one_or_none()
+    if new_balance is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return float(new_balance)
+
+def new_transaction(
+    user_id: int,
+    transaction_type: str,
+    amount: float,
+    timestamp: Optional[datetime] = None,
+    counterparty_id: Optional[int] = None,
+    transfer_id: Optional[str] = None,
+    transaction_number: Optional[str] = None
+) -> Transaction:
+    """Build a Transaction row, with a fresh transaction number unless one was preallocated"""
+    return Transaction(
+        user_id=user_id,
+        transaction_number=transaction_number or generate_transaction_number(),
+        transaction_type=transaction_type,
+        amount=amount,
+        timestamp=timestamp or datetime.utcnow(),
+        counterparty_id=counterparty_id,
+        transfer_id=transfer_id
+    )
+
+async def record_transactions(db: AsyncSession, *transactions: Transaction, balances: Optional[Dict[int, float]] = None):
+    """Add transaction rows, their outbox events and derived data to the current unit of work
+
+    `balances` holds the new balances the caller knows, for the events.
+    """
+    db.add_all(transactions)
+    db.add_all(transaction_events(transactions, balances))
+    await update_rollups(db, transactions)
+    await update_velocity(db, transactions)
+
+async def apply_deposit(db: AsyncSession, user_id: int, amount: float) -> Tuple[Transaction, float]:
+    """Credit a deposit and record it"""
+    new_balance = await credit(db, user_id, amount)
+    deposit_transaction = new_transaction(user_id, "deposit", amount)
+    await record_transactions(db, deposit_transaction, balances={user_id: new_balance})
+    return deposit_transaction, new_balance
+
+async def apply_withdrawal(db: AsyncSession, user_id: int, amount: float) -> Tuple[Transaction, float]:
+    """Debit a withdrawal and record it"""
+    new_balance = await debit(db, user_id, amount)
+    # The debit holds the user's row lock, so this sees every earlier outflow
+    await check_velocity(db, user_id, amount)
+    withdraw_transaction = new_transaction(user_id, "withdraw", amount)
+    await record_transactions(db, withdraw_transaction, balances={user_id: new_balance})
+    return withdraw_transaction, new_balance
+
+async def apply_transfer(
+    db: AsyncSession, sender_id: int, recipient_id: int, amount: float, recipient_sharded: bool = False
+) -> Tuple[Transaction, float]:
+    """Move amount between two users and record both legs
+
+    A sharded recipient's user row is neither locked nor written; the credit
+    lands on one of its sub-balances instead.
+
+    Returns the sender's transfer_out row and the sender's new balance.
+    """
+    if sender_id == recipient_id:
+        raise HTTPException(status_code=400, detail="Cannot transfer to yourself")
+
+    await lock_users(db, (sender_id,) if recipient_sharded else (sender_id, recipient_id))
+    new_balance = await debit(db, sender_id, amount)
+    await check_velocity(db, sender_id, amount, transfers=1)
+    balances = {sender_id: new_balance}
+    if recipient_sharded:
+        await credit_shard(db, recipient_id, amount)
+    else:
+        balances[recipient_id] = await credit(db, recipient_id, amount)
+
+    transfer_id = generate_transfer_id()
+    timestamp = datetime.utcnow()
+    sender_transaction = new_transaction(
+        sender_id, "transfer_out", amount, timestamp,
+        counterparty_id=recipient_id, transfer_id=transfer_id
+    )
+    receiver_transaction = new_transaction(
+        recipient_id, "transfer_in", amount, timestamp,
+        counterparty_id=sender_id, transfer_id=transfer_id
+    )
+    await record_transactions(db, sender_transaction, receiver_transaction, balances=balances)
+    return sender_transaction, new_balance
+
+async def apply_batch_transfer(
+    db: AsyncSession,
+    sender_id: int,
+    transfers: Sequence[Tuple[int, float]],
+    sharded_recipients: Collection[int] = ()
+) -> Tuple[List[Tuple[Optional[Transaction], Optional[str]]], float]:
+    """Pay many recipients from one sender within the current transaction
+
+    Items are taken in order while the balance and the sender's velocity
+    limits cover them; an item that would overdraw or exceed a limit is
+    reported as failed and later items are still tried.
+    The sender is debited once for the total and recipients are credited
+    with a single executemany UPDATE; recipients in `sharded_recipients`
+    are credited on a sub-balance instead.
+
+    Returns one (transfer_out row, None) or (None, error) per item, and the
+    sender's new balance.
+    """
+    await lock_users(db, [sender_id, *(
+        recipient_id for recipient_id, _ in transfers if recipient_id not in sharded_recipients
+    )])
+    available = float(await db.scalar(select(User.balance).where(User.id == sender_id)))
+    if sum(amount for _, amount in transfers) > available:
+        available += await consolidate_shards(db, sender_id)
+    headroom = await velocity_headroom(db, sender_id)
+
+    outcomes = []
+    rows = []
+    credits = defaultdict(float)
+    total = 0.0
+    count = 0
+    timestamp = datetime.utcnow()
+    # Two legs per item, numbered from one block
+    transaction_numbers = iter(generate_transaction_numbers(2 * len(transfers)))
+    for recipient_id, amount in transfers:
+        if total + amount > available:
+            outcomes.append((None, "Insufficient balance"))
+            continue
+        limit_error = velocity_error(headroom, total + amount, count + 1)
+        if limit_error:
+            outcomes.append((None, limit_error))
+            continue
+        total += amount
+        count += 1
+        credits[recipient_id] += amount
+        transfer_id = generate_transfer_id()
+        sender_transaction = new_transaction(
+            sender_id, "transfer_out", amount, timestamp,
+            counterparty_id=recipient_id, transfer_id=transfer_id,
+            transaction_number=next(transaction_numbers)
+        )
+        rows.append(sender_transaction)
+        rows.append(new_transaction(
+            recipient_id, "transfer_in", amount, timestamp,
+            counterparty_id=sender_id, transfer_id=transfer_id,
+            transaction_number=next(transaction_numbers)
+        ))
+        outcomes.append((sender_transaction, None))
+
+    if not rows:
+        return outcomes, available
+
+    new_balance = await debit(db, sender_id, total)
+    plain_credits = [
+        {"recipient_id": recipient_id, "credit_amount": amount}
+        for recipient_id, amount in sorted(credits.items())
+        if recipient_id not in sharded_recipients
+    ]
+    if plain_credits:
+        users_table = User.__table__
+        await db.execute(
+            update(users_table)
+            .where(users_table.c.id == bindparam("recipient_id"))
+            .values(balance=users_table.c.balance + bindparam("credit_amount")),
+            plain_credits
+        )
+    for recipient_id, amount in sorted(credits.items()):
+        if recipient_id in sharded_recipients:
+            await credit_shard(db, recipient_id, amount)
+    await record_transactions(db, *rows, balances={sender_id: new_balance})
+    return outcomes, new_balance
@@ -0,0 +1,259 @@
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+# Requests issuing more queries than this are logged as likely N+1 patterns
+QUERY_COUNT_WARN_THRESHOLD = int(os.getenv("QUERY_COUNT_WARN_THRESHOLD", "20"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+class Histogram:
+    """Cumulative Prometheus histogram with optional labels (per process)"""
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labelvalues, series in sorted(snapshot.items()):
+            labels = list(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_labels(labels + [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(labels)} {cumulative}")
+        return lines
+
+class Counter:
+    """Monotonic Prometheus counter with optional labels (per process)"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for labelvalues, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_labels(list(zip(self.labelnames, labelvalues)))} {value}")
+        return lines
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(pairs: list) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def gauge_lines(name: str, documentation: str, samples: list) -> list:
+    """Render a gauge from ([(label, value), ...], value) samples read at scrape time"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{_labels(labels)} {value}" for labels, value in samples)
+    return lines
+
+REQUEST_LATENCY = Histogram(
+    "twinpay_http_request_duration_seconds", "HTTP request latency by route",
+    LATENCY_BUCKETS, ("method", "route", "status")
+)
+REQUEST_QUERIES = Histogram(
+    "twinpay_http_request_db_queries", "Database queries issued per HTTP request",
+    QUERY_COUNT_BUCKETS, ("method", "route")
+)
+REQUEST_DB_TIME = Histogram(
+    "twinpay_http_request_db_seconds", "Time spent executing queries per HTTP request",
+    LATENCY_BUCKETS, ("method", "route")
+)
+REQUEST_POOL_WAIT = Histogram(
+    "twinpay_http_request_pool_wait_seconds", "Time spent waiting for a pooled connection per HTTP request",
+    LATENCY_BUCKETS, ("method", "route")
+)
+REQUEST_HASH_TIME = Histogram(
+    "twinpay_http_request_hash_seconds", "Time spent waiting on bcrypt per HTTP request",
+    LATENCY_BUCKETS, ("method", "route")
+)
+QUERY_LATENCY = Histogram(
+    "twinpay_db_query_duration_seconds", "Latency of individual database queries",
+    LATENCY_BUCKETS, ("engine",)
+)
+HASH_LATENCY = Histogram(
+    "twinpay_hash_duration_seconds", "bcrypt call latency including time queued for a worker",
+    LATENCY_BUCKETS, ("operation",)
+)
+QUERY_HEAVY_REQUESTS = Counter(
+    "twinpay_http_requests_over_query_threshold_total",
+    "Requests that issued more than QUERY_COUNT_WARN_THRESHOLD queries", ("method", "route")
+)
+ADMISSION_REJECTED = Counter(
+    "twinpay_admission_rejected_total", "Hashing requests rejected with 429 before any bcrypt work",
+    ("action", "reason")
+)
+ADMISSION_CPU_SAVED = Counter(
+    "twinpay_admission_cpu_seconds_saved_total",
+    "Estimated bcrypt CPU time not spent because requests were rejected", ("action",)
+)
+GROUP_COMMIT_BATCH_SIZE = Histogram(
+    "twinpay_group_commit_batch_size", "Ledger writes committed together by the group-commit writer",
+    (1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+GROUP_COMMIT_FALLBACKS = Counter(
+    "twinpay_group_commit_fallbacks_total", "Group commits that failed and were retried as individual commits"
+)
+READ_ROUTING = Counter(
+    "twinpay_db_reads_total", "Read-only requests by database served and why the primary was used",
+    ("target", "reason")
+)
+SCHEDULED_PAYMENTS = Counter(
+    "twinpay_scheduled_payments_total", "Scheduled payment runs by outcome (success, retry, failed)", ("outcome",)
+)
+
+@dataclass
+class RequestStats:
+    """Work attributed to the request being served in the current context"""
+    queries: int = 0
+    db_seconds: float = 0.0
+    pool_wait_seconds: float = 0.0
+    hash_seconds: float = 0.0
+
+# Mutated in place, so updates made in SQLAlchemy's greenlets and in child
+# tasks that copied the context are still seen by the middleware
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+def record_query(engine_name: str, seconds: float):
+    QUERY_LATENCY.observe(seconds, engine_name)
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += seconds
+
+def record_pool_wait(seconds: float):
+    stats = current_request.get()
+    if stats is not None:
+        stats.pool_wait_seconds += seconds
+
+def record_hash(operation: str, seconds: float):
+    HASH_LATENCY.observe(seconds, operation)
+    stats = current_request.get()
+    if stats is not None:
+        stats.hash_seconds += seconds
+
+_PATH_PARAM = re.compile(r"{(\w+)(:\w+)?}")
+
+def route_label(scope) -> str:
+    """Path template of the matched route, including any router prefix"""
+    route = scope.get("route")
+    template = getattr(route, "path_format", None) or getattr(route, "path", None)
+    if not template:
+        return "unmatched"
+    # Routes of included routers may not carry the prefix; take it from the request path
+    path_params = scope.get("path_params", {})
+    rendered = _PATH_PARAM.sub(lambda match: str(path_params.get(match.group(1), match.group(0))), template)
+    path = scope.get("path", "")
+    if path != rendered and path.endswith(rendered):
+        return path[:-len(rendered)] + template
+    return template
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request, streamed bodies included
+
+    Routes are labelled by their path template so path parameters do not
+    create a series per value; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request.reset(token)
+            route_path = route_label(scope)
+            method = scope["method"]
+            REQUEST_LATENCY.observe(elapsed, method, route_path, str(status_code))
+            REQUEST_QUERIES.observe(stats.queries, method, route_path)
+            REQUEST_DB_TIME.observe(stats.db_seconds, method, route_path)
+            REQUEST_POOL_WAIT.observe(stats.pool_wait_seconds, method, route_path)
+            REQUEST_HASH_TIME.observe(stats.hash_seconds, method, route_path)
+            if stats.queries > QUERY_COUNT_WARN_THRESHOLD:
+                QUERY_HEAVY_REQUESTS.inc(method, route_path)
+                logger.warning(
+                    "%s %s issued %d queries (threshold %d) in %.1f ms, %.1f ms of them in the database",
+                    method, route_path, stats.queries, QUERY_COUNT_WARN_THRESHOLD,
+                    elapsed * 1000, stats.db_seconds * 1000
+                )
+
+# Extra gauge sections evaluated at scrape time, e.g. pool occupancy
+_collectors: list = []
+
+def register_collector(collector: Callable[[], list]):
+    """Add a function returning extra exposition lines to every scrape"""
+    _collectors.append(collector)
+
+def render_metrics() -> str:
+    """All metrics of this process in the Prometheus text format"""
+    lines = []
+    for metric in (
+        REQUEST_LATENCY, REQUEST_QUERIES, REQUEST_DB_TIME, REQUEST_POOL_WAIT, REQUEST_HASH_TIME,
+        QUERY_LATENCY, HASH_LATENCY, QUERY_HEAVY_REQUESTS, ADMISSION_REJECTED, ADMISSION_CPU_SAVED,
+        GROUP_COMMIT_BATCH_SIZE, GROUP_COMMIT_FALLBACKS, READ_ROUTING, SCHEDULED_PAYMENTS
+    ):
+        lines.extend(metric.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, or_, select
+
+from models.models import OutboxEvent, Transaction
+from utils.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Transactional outbox. Every ledger write adds one outbox row per posting
+# in the same commit (see utils.ledger.record_transactions), so an event
+# exists exactly when its transaction does. Each worker's dispatcher tails
+# the table by id and fans new rows out to its connected subscribers;
+# downstream consumers can tail it the same way with OutboxTailer.
+#
+# Ids are assigned at insert but transactions commit in any order, so a
+# reader can see id 12 before id 11 commits. The tailer therefore treats a
+# missing id as pending and delivers it once it shows up, and only gives up
+# on it (a rolled-back insert) after OUTBOX_GAP_TIMEOUT seconds.
+
+# Load environment variables
+load_dotenv()
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.2"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "1000"))
+OUTBOX_GAP_TIMEOUT = float(os.getenv("OUTBOX_GAP_TIMEOUT", "5"))
+OUTBOX_RETENTION_HOURS = float(os.getenv("OUTBOX_RETENTION_HOURS", "168"))
+OUTBOX_SWEEP_INTERVAL = float(os.getenv("OUTBOX_SWEEP_INTERVAL", "300"))
+OUTBOX_SWEEP_BATCH = int(os.getenv("OUTBOX_SWEEP_BATCH", "1000"))
+# Beyond this many open gaps the tailer re-reads every row past its cursor
+MAX_TRACKED_GAPS = 100
+# Events buffered per connected stream before it is closed for falling behind
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+
+def transaction_events(transactions: Iterable[Transaction], balances: Optional[Dict[int, float]] = None) -> List[OutboxEvent]:
+    """One "transaction" event per posting
+
+    `balances` maps user ids to their balance once the unit of work
+    commits, where the caller knows it; other events carry a null balance.
+    """
+    balances = balances or {}
+    return [
+        OutboxEvent(
+            user_id=transaction.user_id,
+            event_type="transaction",
+            payload=json.dumps({
+                "transaction_number": transaction.transaction_number,
+                "transaction_type": transaction.transaction_type,
+                "amount": transaction.amount,
+                "timestamp": transaction.timestamp.isoformat(),
+                "transfer_id": transaction.transfer_id,
+                "balance": balances.get(transaction.user_id),
+            }),
+            created_at=transaction.timestamp,
+        )
+        for transaction in transactions
+    ]
+
+def event_message(event: OutboxEvent) -> dict:
+    return {
+        "id": event.id,
+        "event_type": event.event_type,
+        "created_at": event.created_at.isoformat(),
+        "data": json.loads(event.payload),
+    }
+
+class OutboxTailer:
+    """Follows the outbox in id order, tolerating ids that commit late
+
+    Fetch with `query()`, pass the rows to `accept()`, and use what it
+    returns; `cursor` is the id below which everything has been delivered
+    or given up on, and is the position to persist and resume from.
+    """
+
+    def __init__(self, cursor: int = 0, gap_timeout: float = OUTBOX_GAP_TIMEOUT):
+        self.cursor = cursor
+        self.gap_timeout = gap_timeout
+        # Delivered ids above the cursor -> when they were first seen
+        self._seen: Dict[int, float] = {}
+
+    def query(self, limit: int = OUTBOX_BATCH_SIZE):
+        """Rows past the cursor, skipping ones already delivered"""
+        condition = OutboxEvent.id > self.cursor
+        if self._seen:
+            # Only the holes between delivered ids, and everything after the last one
+            holes, previous = [], self.cursor
+            for seen_id in sorted(self._seen):
+                if seen_id > previous + 1:
+                    holes.append(OutboxEvent.id.between(previous + 1, seen_id - 1))
+                previous = seen_id
+            if len(holes) <= MAX_TRACKED_GAPS:
+                condition = or_(OutboxEvent.id > previous, *holes)
+        return select(OutboxEvent).where(condition).order_by(OutboxEvent.id).limit(limit)
+
+    def accept(self, rows: Iterable[OutboxEvent]) -> List[OutboxEvent]:
+        """Rows not delivered before, in id order; advances the cursor"""
+        now = time.monotonic()
+        fresh = [row for row in rows if row.id > self.cursor and row.id not in self._seen]
+        for row in fresh:
+            self._seen[row.id] = now
+        while self._seen:
+            following = min(self._seen)
+            if following != self.cursor + 1 and now - self._seen[following] < self.gap_timeout:
+                break
+            # Either contiguous, or the ids before it have been missing for too long
+            del self._seen[following]
+            self.cursor = following
+        return fresh
+
+class EventBroker:
+    """In-process pub/sub of outbox events, keyed by user id"""
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def publish(self, event: OutboxEvent):
+        for queue in self._subscribers.get(event.user_id, ()):
+            if queue.full():
+                # A stalled consumer gets None and must reconnect and catch up from the outbox
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(event)
+
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+broker = EventBroker()
+
+async def dispatch_outbox(broker: EventBroker = broker):
+    """Publish new outbox rows to this worker's subscribers until cancelled"""
+    tailer = None
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                if tailer is None:
+                    # Streams replay older events themselves; start at the current end
+                    tailer = OutboxTailer(await db.scalar(select(func.max(OutboxEvent.id))) or 0)
+                rows = (await db.scalars(tailer.query())).all()
+            for row in tailer.accept(rows):
+                broker.publish(row)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Outbox dispatch failed")
+        await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+async def user_events(db, user_id: int, after_id: int, limit: int) -> List[OutboxEvent]:
+    """A user's outbox events after `after_id`, oldest first"""
+    return (await db.scalars(
+        select(OutboxEvent)
+        .where(OutboxEvent.user_id == user_id, OutboxEvent.id > after_id)
+        .order_by(OutboxEvent.id)
+        .limit(limit)
+    )).all()
+
+async def sweep_outbox() -> int:
+    """Delete outbox rows past the retention window in batches; returns the number removed"""
+    removed = 0
+    cutoff = datetime.utcnow() - timedelta(hours=OUTBOX_RETENTION_HOURS)
+    while True:
+        async with AsyncSessionLocal() as db:
+            expired = select(OutboxEvent.id).where(OutboxEvent.created_at < cutoff).limit(OUTBOX_SWEEP_BATCH)
+            result = await db.execute(
+                delete(OutboxEvent).where(OutboxEvent.id.in_(expired)).execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        removed += result.rowcount
+        if result.rowcount < OUTBOX_SWEEP_BATCH:
+            return removed
@@ -0,0 +1,122 @@
+import os
+from datetime import datetime
+from typing import List
+from dotenv import load_dotenv
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from models.models import Transaction
+from utils.archive import add_months, month_start
+
+# Monthly range partitioning of the transactions table on Postgres. Only a
+# fresh database gets the partitioned layout; an existing plain table is
+# left alone (migrate it by hand). SQLite keeps a single table, and the
+# archival job deletes archived months from it instead of dropping
+# partitions.
+
+# Load environment variables
+load_dotenv()
+PARTITION_TRANSACTIONS = os.getenv("PARTITION_TRANSACTIONS", "false").lower() in ("1", "true", "yes")
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+# Postgres requires the partition key in every unique constraint, so the
+# partitioned table's own constraints are weaker than the model's:
+#
+# - the primary key is (id, timestamp); ids still come from one sequence,
+#   but the database no longer rejects a hand-inserted duplicate id;
+# - (transaction_number, timestamp) is unique per partition only, so global
+#   uniqueness of transaction numbers is enforced by a trigger claiming each
+#   number in the unpartitioned transaction_numbers table. That costs one
+#   extra index insert per transaction, and numbers stay claimed after
+#   their partition is archived and dropped. Transaction numbers are never
+#   updated, so only inserts are checked.
+PARTITIONED_TRANSACTIONS_DDL = """
+CREATE TABLE transactions (
+    id SERIAL NOT NULL,
+    user_id INTEGER NOT NULL,
+    transaction_number VARCHAR(40) NOT NULL,
+    transaction_type VARCHAR NOT NULL,
+    amount FLOAT NOT NULL,
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    counterparty_id INTEGER REFERENCES users (id),
+    transfer_id VARCHAR(32),
+    PRIMARY KEY (id, timestamp),
+    UNIQUE (transaction_number, timestamp)
+) PARTITION BY RANGE (timestamp)
+"""
+
+TRANSACTION_NUMBERS_DDL = [
+    """
+    CREATE TABLE transaction_numbers (
+        transaction_number VARCHAR(40) PRIMARY KEY
+    )
+    """,
+    """
+    CREATE FUNCTION claim_transaction_number() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO transaction_numbers (transaction_number) VALUES (NEW.transaction_number);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER transactions_unique_number AFTER INSERT ON transactions
+    FOR EACH ROW EXECUTE FUNCTION claim_transaction_number()
+    """,
+]
+
+def partition_name(start: datetime) -> str:
+    return f"transactions_p{start:%Y%m}"
+
+def is_partitioned(conn: Connection) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.scalar(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('transactions')")) == "p"
+
+def create_partitioned_transactions(engine: Engine) -> bool:
+    """Create transactions as a partitioned table if enabled and it does not exist yet
+
+    Must run before Base.metadata.create_all, which then skips the table.
+    Returns whether the table is partitioned.
+    """
+    if not PARTITION_TRANSACTIONS or engine.dialect.name != "postgresql":
+        return False
+    with engine.begin() as conn:
+        if inspect(conn).has_table("transactions"):
+            return is_partitioned(conn)
+        # Referenced by the foreign key above
+        Transaction.__table__.metadata.tables["users"].create(conn, checkfirst=True)
+        conn.execute(text(PARTITIONED_TRANSACTIONS_DDL))
+        for statement in TRANSACTION_NUMBERS_DDL:
+            conn.execute(text(statement))
+        # Catches rows outside every monthly partition instead of failing the insert
+        conn.execute(text("CREATE TABLE transactions_default PARTITION OF transactions DEFAULT"))
+        for index in Transaction.__table__.indexes:
+            index.create(conn)
+    ensure_partitions(engine)
+    return True
+
+def ensure_partitions(engine: Engine, months_ahead: int = PARTITION_MONTHS_AHEAD, now: datetime = None) -> List[str]:
+    """Create the current and next `months_ahead` monthly partitions; returns their names"""
+    created = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return created
+        start = month_start(now or datetime.utcnow())
+        for offset in range(months_ahead + 1):
+            lower, upper = add_months(start, offset), add_months(start, offset + 1)
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(lower)} PARTITION OF transactions "
+                f"FOR VALUES FROM ('{lower:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+            ))
+            created.append(partition_name(lower))
+    return created
+
+def drop_partition(conn: Connection, start: datetime) -> bool:
+    """Detach and drop the monthly partition starting at `start`, if it exists"""
+    name = partition_name(start)
+    if conn.scalar(text("SELECT to_regclass(:name)"), {"name": name}) is None:
+        return False
+    conn.execute(text(f"ALTER TABLE transactions DETACH PARTITION {name}"))
+    conn.execute(text(f"DROP TABLE {name}"))
+    return True
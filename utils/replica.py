@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import os
+import time
+from typing import Optional
+from dotenv import load_dotenv
+from fastapi import Request
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from utils.cache import TTLCache
+from utils.database import AsyncSessionLocal, ReplicaSessionLocal, replica_engine
+from utils.metrics import READ_ROUTING, gauge_lines, register_collector
+
+logger = logging.getLogger(__name__)
+
+# Routing of read-only endpoints to READ_REPLICA_URL. A read goes to the
+# primary instead when
+#
+# - the caller wrote recently: every successful non-GET response carries an
+#   X-Consistency-Token (the write time), and for READ_YOUR_WRITES_SECONDS
+#   reads that send it back, or that use the same bearer token on this
+#   worker, see the primary;
+# - the replica is down or lagging more than REPLICA_MAX_LAG_SECONDS, as
+#   found by the periodic health check or a failed replica query.
+
+# Load environment variables
+load_dotenv()
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "5"))
+RECENT_WRITERS_CACHE_SIZE = int(os.getenv("RECENT_WRITERS_CACHE_SIZE", "100000"))
+
+CONSISTENCY_HEADER = "X-Consistency-Token"
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Zero on a caught-up standby, and on a server that is not a standby at all
+POSTGRES_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+class ReplicaHealth:
+    """Last known state of the read replica"""
+
+    def __init__(self):
+        self.healthy = replica_engine is not None
+        self.lag_seconds = 0.0
+        self.checked_at = 0.0
+
+    def mark_failed(self):
+        if self.healthy:
+            logger.warning("Read replica failed; routing reads to the primary until the next health check")
+        self.healthy = False
+
+    def metrics(self) -> list:
+        if replica_engine is None:
+            return []
+        lines = gauge_lines("twinpay_replica_healthy", "Whether reads are routed to the replica", [([], int(self.healthy))])
+        lines += gauge_lines("twinpay_replica_lag_seconds", "Replication lag at the last health check", [([], self.lag_seconds)])
+        return lines
+
+replica_health = ReplicaHealth()
+register_collector(replica_health.metrics)
+
+# Bearer tokens (hashed) that wrote within READ_YOUR_WRITES_SECONDS on this worker
+recent_writers = TTLCache(RECENT_WRITERS_CACHE_SIZE, READ_YOUR_WRITES_SECONDS)
+
+def _session_key(authorization: Optional[str]) -> Optional[str]:
+    return hashlib.sha256(authorization.encode()).hexdigest()[:32] if authorization else None
+
+async def check_replica():
+    """Probe the replica and update its health (periodic job)"""
+    if replica_engine is None:
+        return
+    try:
+        async with replica_engine.connect() as conn:
+            if conn.dialect.name == "postgresql":
+                lag = float(await conn.scalar(POSTGRES_LAG_QUERY) or 0)
+            else:
+                await conn.execute(text("SELECT 1"))
+                lag = 0.0
+    except Exception:
+        logger.exception("Read replica health check failed")
+        replica_health.mark_failed()
+        return
+    healthy = lag <= REPLICA_MAX_LAG_SECONDS
+    if healthy != replica_health.healthy:
+        logger.warning("Read replica is now %s (lag %.1fs)", "healthy" if healthy else "lagging", lag)
+    replica_health.healthy = healthy
+    replica_health.lag_seconds = lag
+    replica_health.checked_at = time.time()
+
+def _primary_reason(request: Request) -> Optional[str]:
+    if ReplicaSessionLocal is None:
+        return "no-replica"
+    if not replica_health.healthy:
+        return "unhealthy"
+    token = request.headers.get(CONSISTENCY_HEADER)
+    if token and token.isdigit() and 0 <= time.time() - int(token) / 1000 < READ_YOUR_WRITES_SECONDS:
+        return "recent-write"
+    key = _session_key(request.headers.get("authorization"))
+    if key and recent_writers.get(key):
+        return "recent-write"
+    return None
+
+async def get_read_db(request: Request):
+    """Read-only session dependency: the replica unless the caller must read the primary"""
+    reason = _primary_reason(request)
+    if reason is not None:
+        READ_ROUTING.inc("primary", reason)
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    READ_ROUTING.inc("replica", "")
+    async with ReplicaSessionLocal() as db:
+        try:
+            yield db
+        except DBAPIError:
+            replica_health.mark_failed()
+            raise
+
+def is_replica(db: AsyncSession) -> bool:
+    return replica_engine is not None and db.bind is replica_engine
+
+class ConsistencyMiddleware:
+    """ASGI middleware stamping successful writes with a consistency token"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_token(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                written_at = int(time.time() * 1000)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (CONSISTENCY_HEADER.lower().encode(), str(written_at).encode())
+                ]
+                authorization = dict(scope["headers"]).get(b"authorization")
+                if authorization:
+                    recent_writers.set(_session_key(authorization.decode()), True)
+            await send(message)
+
+        await self.app(scope, receive, send_with_token)
@@ -0,0 +1,68 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.models import SpendingRollup, Transaction
+from utils.checkpoints import CREDIT_TYPES
+
+# Dialects whose INSERT supports ON CONFLICT DO UPDATE
+UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+INFLOW_TYPES = CREDIT_TYPES
+
+def period_of(timestamp: datetime) -> str:
+    """Rollup period (calendar month) containing a timestamp"""
+    return timestamp.strftime("%Y-%m")
+
+def first_period(months: int, now: datetime = None) -> str:
+    """Oldest period of the `months` most recent ones, counting the current month"""
+    now = now or datetime.utcnow()
+    index = now.year * 12 + now.month - 1 - (months - 1)
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def period_expression(dialect_name: str, column):
+    """SQL expression computing period_of() for a timestamp column"""
+    if dialect_name == "postgresql":
+        return func.to_char(column, "YYYY-MM")
+    return func.strftime("%Y-%m", column)
+
+def upsert_rollups(dialect_name: str, rows: list):
+    """INSERT ... ON CONFLICT statement adding rows to existing rollups"""
+    insert = UPSERT_INSERTS[dialect_name]
+    statement = insert(SpendingRollup).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=["user_id", "period", "transaction_type"],
+        set_={
+            "total_amount": SpendingRollup.total_amount + statement.excluded.total_amount,
+            "transaction_count": SpendingRollup.transaction_count + statement.excluded.transaction_count,
+        }
+    )
+
+async def update_rollups(db: AsyncSession, transactions: Iterable[Transaction]):
+    """Fold new transactions into the rollup table within the current transaction"""
+    totals = defaultdict(lambda: [0.0, 0])
+    for transaction in transactions:
+        key = (transaction.user_id, period_of(transaction.timestamp), transaction.transaction_type)
+        totals[key][0] += transaction.amount
+        totals[key][1] += 1
+    if not totals:
+        return
+
+    # Sorted so concurrent writers touch rollup rows in the same order
+    rows = [
+        {
+            "user_id": user_id,
+            "period": period,
+            "transaction_type": transaction_type,
+            "total_amount": amount,
+            "transaction_count": count,
+        }
+        for (user_id, period, transaction_type), (amount, count) in sorted(totals.items())
+    ]
+    await db.execute(upsert_rollups(db.get_bind().dialect.name, rows))
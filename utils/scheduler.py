@@ -0,0 +1,178 @@
+import calendar
+import logging
+import os
+import random
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import and_, or_, select, update
+
+from models.models import ScheduledPayment, User
+from utils.database import AsyncSessionLocal
+from utils.ledger import apply_batch_transfer
+from utils.metrics import SCHEDULED_PAYMENTS
+
+logger = logging.getLogger(__name__)
+
+# Scheduled and recurring payments. Every worker runs the scheduler; a tick
+#
+# - claims up to SCHEDULER_BATCH_SIZE due rows (next_run_at <= now, indexed)
+#   by stamping them with a lease token, selecting with SKIP LOCKED on
+#   PostgreSQL so workers never wait on each other's claims;
+# - pays each sender's claimed rows with apply_batch_transfer and moves the
+#   rows to their next occurrence in the same transaction, so an occurrence
+#   is paid exactly once even if a worker dies mid-batch (its lease expires
+#   and the rows are claimed again).
+#
+# Each schedule runs a fixed random delay of up to SCHEDULE_SPREAD_SECONDS
+# after its nominal time, so "rent on the 1st at 09:00" does not arrive as
+# one spike, and a backlog drains at most one batch per tick per worker.
+# Cached profiles of the parties catch up within PRINCIPAL_CACHE_TTL, as
+# with writes made on other workers.
+
+# Load environment variables
+load_dotenv()
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", "5"))
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "500"))
+SCHEDULER_LEASE_SECONDS = float(os.getenv("SCHEDULER_LEASE_SECONDS", "60"))
+SCHEDULE_SPREAD_SECONDS = int(os.getenv("SCHEDULE_SPREAD_SECONDS", "900"))
+# A failed run (e.g. insufficient balance) is retried this much later, up to
+# SCHEDULE_MAX_ATTEMPTS times, before the occurrence is skipped
+SCHEDULE_RETRY_SECONDS = float(os.getenv("SCHEDULE_RETRY_SECONDS", "3600"))
+SCHEDULE_MAX_ATTEMPTS = int(os.getenv("SCHEDULE_MAX_ATTEMPTS", "3"))
+SCHEDULE_MAX_PER_USER = int(os.getenv("SCHEDULE_MAX_PER_USER", "100"))
+
+FREQUENCIES = ("once", "daily", "weekly", "monthly")
+
+def random_spread() -> int:
+    return random.randint(0, SCHEDULE_SPREAD_SECONDS) if SCHEDULE_SPREAD_SECONDS > 0 else 0
+
+def occurrence_at(frequency: str, start_at: datetime, n: int) -> datetime:
+    """Nominal time of the n-th occurrence (0 = start_at)
+
+    Monthly schedules keep the day of month, falling back to the last day
+    of shorter months.
+    """
+    if frequency == "daily":
+        return start_at + timedelta(days=n)
+    if frequency == "weekly":
+        return start_at + timedelta(weeks=n)
+    if frequency == "monthly":
+        month_index = start_at.month - 1 + n
+        year, month = start_at.year + month_index // 12, month_index % 12 + 1
+        return start_at.replace(year=year, month=month, day=min(start_at.day, calendar.monthrange(year, month)[1]))
+    return start_at
+
+def first_run_at(frequency: str, start_at: datetime, spread_seconds: int) -> datetime:
+    return occurrence_at(frequency, start_at, 0) + timedelta(seconds=spread_seconds)
+
+def advance(payment: ScheduledPayment, now: datetime):
+    """Move past the current occurrence, skipping any others already missed"""
+    n = payment.occurrence + 1
+    spread = timedelta(seconds=payment.spread_seconds)
+    if payment.frequency != "once":
+        while occurrence_at(payment.frequency, payment.start_at, n) + spread <= now:
+            n += 1
+    payment.occurrence = n
+    payment.failure_count = 0
+    if payment.frequency == "once" or (payment.max_runs is not None and n >= payment.max_runs):
+        payment.status = "completed"
+        payment.next_run_at = None
+    else:
+        payment.next_run_at = occurrence_at(payment.frequency, payment.start_at, n) + spread
+
+async def claim_due_payments(limit: int = SCHEDULER_BATCH_SIZE) -> Tuple[str, Dict[int, List[int]]]:
+    """Lease up to `limit` due payments to this worker
+
+    Returns the lease token and the claimed payment ids by sender.
+    """
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    claimable = and_(
+        ScheduledPayment.next_run_at <= now,
+        ScheduledPayment.status == "active",
+        or_(ScheduledPayment.claimed_until.is_(None), ScheduledPayment.claimed_until < now)
+    )
+    claimed = defaultdict(list)
+    async with AsyncSessionLocal() as db:
+        ids = (await db.scalars(
+            select(ScheduledPayment.id)
+            .where(claimable)
+            .order_by(ScheduledPayment.next_run_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )).all()
+        if not ids:
+            return token, claimed
+        # Re-checked in the UPDATE for databases without row locks (SQLite)
+        rows = (await db.execute(
+            update(ScheduledPayment)
+            .where(ScheduledPayment.id.in_(ids), claimable)
+            .values(claim_token=token, claimed_until=now + timedelta(seconds=SCHEDULER_LEASE_SECONDS))
+            .returning(ScheduledPayment.id, ScheduledPayment.user_id)
+            .execution_options(synchronize_session=False)
+        )).all()
+        await db.commit()
+    for payment_id, user_id in rows:
+        claimed[user_id].append(payment_id)
+    return token, claimed
+
+async def _pay_claimed(sender_id: int, token: str, payment_ids: List[int]) -> dict:
+    """Run one sender's claimed payments in a single transaction; returns outcome counts"""
+    outcomes = defaultdict(int)
+    async with AsyncSessionLocal() as db:
+        # Rows whose lease passed to another worker, or that were cancelled meanwhile, drop out here
+        payments = (await db.scalars(
+            select(ScheduledPayment)
+            .where(
+                ScheduledPayment.id.in_(payment_ids),
+                ScheduledPayment.claim_token == token,
+                ScheduledPayment.status == "active"
+            )
+            .order_by(ScheduledPayment.next_run_at, ScheduledPayment.id)
+            .with_for_update()
+        )).all()
+        if not payments:
+            return outcomes
+        sharded = set(await db.scalars(
+            select(User.id).where(User.id.in_({payment.recipient_id for payment in payments}), User.balance_shards > 0)
+        ))
+        results, _ = await apply_batch_transfer(
+            db, sender_id, [(payment.recipient_id, payment.amount) for payment in payments], sharded
+        )
+
+        now = datetime.utcnow()
+        for payment, (transaction, detail) in zip(payments, results):
+            payment.claim_token = None
+            payment.claimed_until = None
+            payment.last_run_at = now
+            payment.last_error = detail
+            if transaction is not None:
+                advance(payment, now)
+                outcomes["success"] += 1
+            elif payment.failure_count + 1 < SCHEDULE_MAX_ATTEMPTS:
+                payment.failure_count += 1
+                payment.next_run_at = now + timedelta(seconds=SCHEDULE_RETRY_SECONDS)
+                outcomes["retry"] += 1
+            else:
+                advance(payment, now)
+                outcomes["failed"] += 1
+        await db.commit()
+    return outcomes
+
+async def run_scheduled_payments() -> int:
+    """Claim and execute one batch of due payments (periodic job); returns the number claimed"""
+    token, claimed = await claim_due_payments()
+    for sender_id in sorted(claimed):
+        try:
+            outcomes = await _pay_claimed(sender_id, token, claimed[sender_id])
+        except Exception:
+            # Left claimed; the rows are retried once the lease expires
+            logger.exception("Scheduled payments of user %s failed", sender_id)
+            continue
+        for outcome, count in outcomes.items():
+            SCHEDULED_PAYMENTS.inc(outcome, amount=count)
+    return sum(len(payment_ids) for payment_ids in claimed.values())
@@ -1,11 +1,17 @@
 import os
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from dotenv import load_dotenv
 from jose import jwt
 from passlib.context import CryptContext
+from fastapi import HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
+from utils.metrics import gauge_lines, record_hash, register_collector
+
 # Load environment variables
 load_dotenv()
 
@@ -14,6 +20,10 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
+# Hashing pool configuration
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(HASH_WORKERS * 16)))
+
 # Password utilities
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
@@ -26,6 +36,12 @@ def get_password_hash(password: str) -> str:
     """Hash user password or PIN"""
     return pwd_context.hash(password)
 
+def _timed(func, *args):
+    """Run func in a pool worker and also return the CPU time it took there"""
+    started = time.process_time()
+    result = func(*args)
+    return result, time.process_time() - started
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -35,4 +51,81 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
\ No newline at end of file
+    return encoded_jwt
+
+class HashingService:
+    """Runs bcrypt in a process pool so hashing never blocks the event loop
+
+    At most `max_pending` hashes may be queued or running at once; beyond
+    that callers get a 503 immediately instead of waiting behind the pool.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        # operation -> moving average of worker CPU seconds per call
+        self.cpu_seconds = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        """Create the worker pool (called at startup, or lazily on first use)"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def shutdown(self):
+        """Stop the worker pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, operation: str, func, *args):
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        self.start()
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, cpu_seconds = await loop.run_in_executor(self._executor, _timed, func, *args)
+            average = self.cpu_seconds.get(operation, cpu_seconds)
+            self.cpu_seconds[operation] = average + (cpu_seconds - average) * 0.1
+            return result
+        finally:
+            self.pending -= 1
+            record_hash(operation, time.perf_counter() - started)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("verify", verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", get_password_hash, password)
+
+    def cpu_cost(self, operation: str) -> float:
+        """Typical CPU seconds of one call, 0 until the operation has run once"""
+        return self.cpu_seconds.get(operation, 0.0)
+
+    def metrics(self) -> list:
+        """Hashing pool gauges for the /metrics endpoint"""
+        lines = gauge_lines("twinpay_hash_pending", "bcrypt calls queued or running", [([], self.pending)])
+        lines += gauge_lines("twinpay_hash_max_pending", "Queue limit beyond which hashing returns 503", [([], self.max_pending)])
+        lines += gauge_lines(
+            "twinpay_hash_cpu_seconds", "Moving average of worker CPU time per bcrypt call",
+            [([("operation", operation)], seconds) for operation, seconds in sorted(self.cpu_seconds.items())]
+        )
+        return lines
+
+hashing_service = HashingService(HASH_WORKERS, HASH_MAX_PENDING)
+register_collector(hashing_service.metrics)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify user password or PIN on the hashing pool"""
+    return await hashing_service.verify(plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash user password or PIN on the hashing pool"""
+    return await hashing_service.hash(password)
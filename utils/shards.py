@@ -0,0 +1,127 @@
+import os
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.models import User, BalanceShard
+from utils.database import AsyncSessionLocal
+
+# Sharded balances for hot accounts: a user with balance_shards = N keeps N
+# sub-balance rows next to users.balance. Incoming transfers land on a free
+# sub-balance instead of queueing on the user row; debits fold the
+# sub-balances back into users.balance when it alone does not cover them.
+#
+# Shard rows are only ever taken with SKIP LOCKED, so no transaction waits
+# on a shard while holding another lock and the user-row lock order of
+# utils.ledger still rules out deadlocks.
+
+# Load environment variables
+load_dotenv()
+SHARD_CONSOLIDATE_INTERVAL = float(os.getenv("SHARD_CONSOLIDATE_INTERVAL", "30"))
+MAX_BALANCE_SHARDS = int(os.getenv("MAX_BALANCE_SHARDS", "64"))
+
+async def credit_shard(db: AsyncSession, user_id: int, amount: float):
+    """Add amount to a randomly chosen sub-balance that no one else holds"""
+    shard_id = await db.scalar(
+        select(BalanceShard.id)
+        .where(BalanceShard.user_id == user_id)
+        .order_by(func.random())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    if shard_id is None:
+        # Every sub-balance is busy: open an overflow row for the consolidator to fold back in
+        await db.execute(insert(BalanceShard).values(user_id=user_id, balance=amount))
+        return
+    await db.execute(
+        update(BalanceShard)
+        .where(BalanceShard.id == shard_id)
+        .values(balance=BalanceShard.balance + amount)
+        .execution_options(synchronize_session=False)
+    )
+
+async def consolidate_shards(db: AsyncSession, user_id: int) -> float:
+    """Move every free sub-balance into users.balance; returns the amount moved
+
+    Sub-balances locked by in-flight credits are skipped and picked up on
+    the next pass.
+    """
+    rows = (await db.execute(
+        select(BalanceShard.id, BalanceShard.balance)
+        .where(BalanceShard.user_id == user_id, BalanceShard.balance != 0)
+        .order_by(BalanceShard.id)
+        .with_for_update(skip_locked=True)
+    )).all()
+    if not rows:
+        return 0.0
+
+    moved = float(sum(balance for _, balance in rows))
+    await db.execute(
+        update(BalanceShard)
+        .where(BalanceShard.id.in_([shard_id for shard_id, _ in rows]))
+        .values(balance=0.0)
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(balance=User.balance + moved)
+        .execution_options(synchronize_session=False)
+    )
+    return moved
+
+async def shard_balance(db: AsyncSession, user_id: int) -> float:
+    """Sum of a user's sub-balances not yet folded into users.balance"""
+    total = await db.scalar(
+        select(func.coalesce(func.sum(BalanceShard.balance), 0.0)).where(BalanceShard.user_id == user_id)
+    )
+    return float(total)
+
+async def set_balance_shards(db: AsyncSession, user_id: int, shards: int):
+    """Turn sharded balance mode on (shards > 0) or off (shards = 0) for a user
+
+    Existing sub-balances are folded into users.balance first, so no money
+    is stranded when the shard count shrinks. The caller commits.
+    """
+    if not 0 <= shards <= MAX_BALANCE_SHARDS:
+        raise ValueError(f"shards must be between 0 and {MAX_BALANCE_SHARDS}")
+
+    await db.execute(select(User.id).where(User.id == user_id).with_for_update())
+    await consolidate_shards(db, user_id)
+    await db.execute(delete(BalanceShard).where(BalanceShard.user_id == user_id, BalanceShard.balance == 0))
+    # Rows held by in-flight credits survive; the consolidator empties them later
+    remaining = await db.scalar(select(func.count(BalanceShard.id)).where(BalanceShard.user_id == user_id))
+    if shards > remaining:
+        await db.execute(insert(BalanceShard), [{"user_id": user_id, "balance": 0.0}] * (shards - remaining))
+    await db.execute(
+        update(User).where(User.id == user_id).values(balance_shards=shards)
+        .execution_options(synchronize_session=False)
+    )
+
+async def consolidate_sharded_accounts() -> int:
+    """Fold sub-balances of every account that has them and trim overflow rows
+
+    Returns the number of accounts visited.
+    """
+    async with AsyncSessionLocal() as db:
+        accounts = (await db.execute(
+            select(User.id, User.balance_shards).where(User.id.in_(select(BalanceShard.user_id)))
+        )).all()
+
+    for user_id, shards in accounts:
+        async with AsyncSessionLocal() as db:
+            await consolidate_shards(db, user_id)
+            # Keep the N oldest rows; emptied overflow rows beyond them go away
+            keep = select(BalanceShard.id).where(
+                BalanceShard.user_id == user_id
+            ).order_by(BalanceShard.id).limit(shards)
+            overflow = select(BalanceShard.id).where(
+                BalanceShard.user_id == user_id,
+                BalanceShard.balance == 0,
+                BalanceShard.id.not_in(keep)
+            ).with_for_update(skip_locked=True)
+            overflow_ids = (await db.scalars(overflow)).all()
+            if overflow_ids:
+                await db.execute(delete(BalanceShard).where(BalanceShard.id.in_(overflow_ids)))
+            await db.commit()
+    return len(accounts)
@@ -0,0 +1,67 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from jose import jwt
+
+from utils.admission import verify_pin
+
+# Step-up tokens let a user who just entered their PIN skip bcrypt for a few
+# minutes. Each is a JWT naming the user, the actions it covers and a
+# fingerprint of the user's PIN hash; checking one is an HMAC instead of a
+# bcrypt round. Changing the PIN changes the hash (bcrypt salts every hash),
+# so every token issued before the change stops verifying.
+
+# Load environment variables
+load_dotenv()
+SECRET_KEY = os.getenv("SECRET_KEY")
+ALGORITHM = os.getenv("ALGORITHM")
+STEP_UP_TOKEN_TTL = int(os.getenv("STEP_UP_TOKEN_TTL", "300"))
+
+STEP_UP_HEADER = "X-Step-Up-Token"
+STEP_UP_SCOPES = ("balance", "withdraw", "transfer")
+
+def _signing_key() -> str:
+    # Separate from the access-token key, so neither token passes for the other
+    return f"{SECRET_KEY}:step-up"
+
+def pin_fingerprint(pin_hash: str) -> str:
+    return hashlib.sha256(pin_hash.encode()).hexdigest()[:32]
+
+def create_step_up_token(user, scopes: Iterable[str]) -> str:
+    """Sign a step-up token for `user` covering `scopes`"""
+    return jwt.encode(
+        {
+            "sub": str(user.id),
+            "scope": sorted(set(scopes)),
+            "pin": pin_fingerprint(user.pin),
+            "exp": datetime.utcnow() + timedelta(seconds=STEP_UP_TOKEN_TTL),
+        },
+        _signing_key(),
+        algorithm=ALGORITHM,
+    )
+
+def step_up_scopes(token: str, user) -> List[str]:
+    """Scopes a step-up token grants `user`; empty if it is invalid, expired or revoked"""
+    try:
+        payload = jwt.decode(token, _signing_key(), algorithms=[ALGORITHM])
+    except jwt.JWTError:
+        return []
+    if payload.get("sub") != str(user.id) or payload.get("pin") != pin_fingerprint(user.pin):
+        return []
+    return payload.get("scope", [])
+
+async def authorize_pin(action: str, scope: str, user, pin: Optional[str], step_up_token: Optional[str]) -> bool:
+    """Accept either a step-up token covering `scope` or the user's PIN
+
+    A step-up token, when sent, is used instead of the PIN and costs no
+    bcrypt round; an invalid one is rejected with 401 rather than falling
+    back to the PIN.
+    """
+    if step_up_token:
+        if scope not in step_up_scopes(step_up_token, user):
+            raise HTTPException(status_code=401, detail="Invalid or expired step-up token")
+        return True
+    return await verify_pin(action, user, pin)
@@ -0,0 +1,181 @@
+import operator
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable, List
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from sqlalchemy import Integer, case, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models.models import Transaction, VelocityBucket
+from utils.rollups import UPSERT_INSERTS
+
+# Sliding-window velocity limits on money leaving an account. Each user has
+# a ring of one-minute buckets (velocity_buckets, slot = minute % ring size)
+# counting outflow amount and transfers; the ledger upserts the current
+# minute's bucket in the same transaction as the postings, overwriting the
+# slot's previous lap. A check sums at most one ring of rows instead of
+# scanning transactions. Counters are repaired from the ledger with
+# `python -m jobs.rebuild_velocity`.
+
+# Load environment variables
+load_dotenv()
+# A maximum of 0 disables the limit
+VELOCITY_MAX_OUTFLOW = float(os.getenv("VELOCITY_MAX_OUTFLOW", "50000"))
+VELOCITY_OUTFLOW_WINDOW_MINUTES = int(os.getenv("VELOCITY_OUTFLOW_WINDOW_MINUTES", "1440"))
+VELOCITY_MAX_TRANSFERS = int(os.getenv("VELOCITY_MAX_TRANSFERS", "20"))
+VELOCITY_TRANSFER_WINDOW_MINUTES = int(os.getenv("VELOCITY_TRANSFER_WINDOW_MINUTES", "60"))
+
+OUTFLOW_TYPES = ("withdraw", "transfer_out")
+VELOCITY_ENABLED = VELOCITY_MAX_OUTFLOW > 0 or VELOCITY_MAX_TRANSFERS > 0
+# Buckets per user; the ring must span the longest window
+RING_MINUTES = max(VELOCITY_OUTFLOW_WINDOW_MINUTES, VELOCITY_TRANSFER_WINDOW_MINUTES)
+WARMUP_BATCH_SIZE = 1000
+
+EPOCH = datetime(1970, 1, 1)
+
+@dataclass
+class Headroom:
+    """How much more a user may send before hitting a limit"""
+    amount: float = float("inf")
+    transfers: float = float("inf")
+
+def minute_of(timestamp: datetime) -> int:
+    return int((timestamp - EPOCH).total_seconds() // 60)
+
+def minute_expression(dialect_name: str, column):
+    """SQL expression computing minute_of() for a timestamp column"""
+    if dialect_name == "postgresql":
+        return cast(func.floor(func.extract("epoch", column) / 60), Integer)
+    return cast(func.strftime("%s", column), Integer) // 60
+
+def upsert_buckets(dialect_name: str, rows: list, accumulate: bool = True):
+    """INSERT ... ON CONFLICT statement writing minute buckets into their ring slots
+
+    A slot holding an older minute is overwritten. One still holding the
+    same minute is added to when `accumulate` is set; otherwise it keeps
+    the larger of the two counts, so a rebuild never erases increments
+    that live writers committed after its snapshot. A slot already holding
+    a newer minute is left alone.
+    """
+    insert = UPSERT_INSERTS[dialect_name]
+    statement = insert(VelocityBucket).values(rows)
+    excluded = statement.excluded
+    same_minute = VelocityBucket.minute == excluded.minute
+    if accumulate:
+        merge = operator.add
+    else:
+        merge = func.greatest if dialect_name == "postgresql" else func.max
+    values = {
+        "outflow_amount": case((same_minute, merge(VelocityBucket.outflow_amount, excluded.outflow_amount)), else_=excluded.outflow_amount),
+        "transfer_count": case((same_minute, merge(VelocityBucket.transfer_count, excluded.transfer_count)), else_=excluded.transfer_count),
+    }
+    return statement.on_conflict_do_update(
+        index_elements=["user_id", "slot"],
+        set_={"minute": excluded.minute, **values},
+        where=VelocityBucket.minute <= excluded.minute
+    )
+
+def _bucket_rows(totals: dict) -> List[dict]:
+    return [
+        {
+            "user_id": user_id,
+            "slot": minute % RING_MINUTES,
+            "minute": minute,
+            "outflow_amount": amount,
+            "transfer_count": transfers,
+        }
+        for (user_id, minute), (amount, transfers) in sorted(totals.items())
+    ]
+
+async def update_velocity(db: AsyncSession, transactions: Iterable[Transaction]):
+    """Count new outflows into their users' minute buckets within the current transaction"""
+    if not VELOCITY_ENABLED:
+        return
+    totals = defaultdict(lambda: [0.0, 0])
+    for transaction in transactions:
+        if transaction.transaction_type in OUTFLOW_TYPES:
+            key = (transaction.user_id, minute_of(transaction.timestamp))
+            totals[key][0] += transaction.amount
+            totals[key][1] += transaction.transaction_type == "transfer_out"
+    if totals:
+        # Sorted so concurrent writers touch bucket rows in the same order
+        await db.execute(upsert_buckets(db.get_bind().dialect.name, _bucket_rows(totals)))
+
+async def velocity_headroom(db: AsyncSession, user_id: int, now: datetime = None) -> Headroom:
+    """Remaining outflow amount and transfers within the configured windows"""
+    headroom = Headroom()
+    if not VELOCITY_ENABLED:
+        return headroom
+    current = minute_of(now or datetime.utcnow())
+    outflow_since = current - VELOCITY_OUTFLOW_WINDOW_MINUTES
+    transfers_since = current - VELOCITY_TRANSFER_WINDOW_MINUTES
+    outflow, transfers = (await db.execute(
+        select(
+            func.coalesce(func.sum(case((VelocityBucket.minute > outflow_since, VelocityBucket.outflow_amount), else_=0)), 0),
+            func.coalesce(func.sum(case((VelocityBucket.minute > transfers_since, VelocityBucket.transfer_count), else_=0)), 0),
+        ).where(
+            VelocityBucket.user_id == user_id,
+            VelocityBucket.minute > current - RING_MINUTES
+        )
+    )).one()
+    if VELOCITY_MAX_OUTFLOW > 0:
+        headroom.amount = VELOCITY_MAX_OUTFLOW - float(outflow)
+    if VELOCITY_MAX_TRANSFERS > 0:
+        headroom.transfers = VELOCITY_MAX_TRANSFERS - int(transfers)
+    return headroom
+
+def velocity_error(headroom: Headroom, amount: float, transfers: int):
+    """Detail of the limit an outflow would break, or None"""
+    if amount > headroom.amount + 1e-9:
+        return f"Velocity limit exceeded: at most {VELOCITY_MAX_OUTFLOW:g} out per {VELOCITY_OUTFLOW_WINDOW_MINUTES} minutes"
+    if transfers > headroom.transfers:
+        return f"Velocity limit exceeded: at most {VELOCITY_MAX_TRANSFERS} transfers per {VELOCITY_TRANSFER_WINDOW_MINUTES} minutes"
+    return None
+
+async def check_velocity(db: AsyncSession, user_id: int, amount: float, transfers: int = 0):
+    """Raise 429 if sending `amount` in `transfers` transfers would exceed a limit
+
+    Call with the user's row locked (or just debited), so concurrent
+    outflows of the same user are checked one after the other.
+    """
+    if not VELOCITY_ENABLED:
+        return
+    detail = velocity_error(await velocity_headroom(db, user_id), amount, transfers)
+    if detail:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=detail)
+
+def rebuild_velocity_counters(db: Session, now: datetime = None) -> int:
+    """Recompute the buckets of every completed minute in the ring from transactions
+
+    Repairs counters after rows were written outside the ledger (imports,
+    restores) or limits were first enabled. Safe while the API is serving:
+    buckets are only raised, never lowered, and the current minute is left
+    alone. Returns the number of buckets written.
+    """
+    if not VELOCITY_ENABLED:
+        return 0
+    dialect_name = db.get_bind().dialect.name
+    current = minute_of(now or datetime.utcnow())
+    first = current - RING_MINUTES + 1
+    minute = minute_expression(dialect_name, Transaction.timestamp).label("minute")
+    rows = db.execute(
+        select(
+            Transaction.user_id,
+            minute,
+            func.sum(Transaction.amount),
+            func.sum(case((Transaction.transaction_type == "transfer_out", 1), else_=0)),
+        ).where(
+            Transaction.transaction_type.in_(OUTFLOW_TYPES),
+            Transaction.timestamp >= EPOCH + timedelta(minutes=first),
+            Transaction.timestamp < EPOCH + timedelta(minutes=current),
+        ).group_by(Transaction.user_id, minute)
+    ).all()
+    buckets = _bucket_rows({(user_id, int(m)): (float(amount), int(transfers)) for user_id, m, amount, transfers in rows})
+    for start in range(0, len(buckets), WARMUP_BATCH_SIZE):
+        db.execute(upsert_buckets(dialect_name, buckets[start:start + WARMUP_BATCH_SIZE], accumulate=False))
+    db.commit()
+    return len(buckets)